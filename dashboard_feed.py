@@ -0,0 +1,104 @@
+# dashboard_feed.py
+import threading
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from forecaster import Forecaster
+
+def get_status_info(pred_prob):
+    if pred_prob < 0.3: return "Normal", "normal"
+    elif pred_prob < 0.7: return "Warning", "warning"
+    else: return "Critical", "critical"
+
+class DashboardFeed:
+    """
+    Background producer for the Streamlit dashboard.
+
+    A daemon thread walks the classification dataset on the scheduler's deadlines,
+    runs the classifier and the forecast rollout for every full window and appends
+    one result dict per tick to a bounded deque. The UI drains it at its own render
+    rate (drain()), so model calls never block a rerun and a slow browser only
+    loses the oldest unrendered ticks (counted in `dropped`) instead of falling
+    further and further behind.
+    """
+
+    def __init__(self, df_class, features_class, scaler_class, model_class, df_pred, scaler_pred, model_pred,
+                 scheduler, seq_len=10, future_steps=5, anomaly_threshold=14, max_pending=256):
+        # Rows are scaled once up front instead of one scaler call per tick.
+        self.scaled = scaler_class.transform(df_class[features_class].values).astype(np.float32)
+        self.timestamps = pd.to_datetime(df_class["timestamp"])
+        self.model_class = model_class
+        self.pred_rows = df_pred.values
+        self.forecaster = Forecaster(model_pred, scaler_pred, seq_len)
+        self.forecaster.set_window(self.pred_rows[-seq_len:])
+        self.scheduler = scheduler
+        self.seq_len = seq_len
+        self.future_steps = future_steps
+        self.anomaly_threshold = anomaly_threshold
+        self.results = deque(maxlen=max_pending)
+        self.dropped = 0
+        self.error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="dashboard-feed", daemon=True)
+        self._thread.start()
+        return self
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        try:
+            self.scheduler.start()
+            while not self._stop.is_set():
+                for idx in range(self.seq_len - 1, len(self.scaled)):
+                    if self._stop.is_set():
+                        return
+                    self._publish(self._tick(idx))
+                    self.forecaster.push(self.pred_rows[idx])
+                    self.scheduler.wait()
+        except Exception as e:
+            self.error = e
+
+    def _publish(self, result):
+        if len(self.results) == self.results.maxlen:
+            self.dropped += 1
+        self.results.append(result)
+
+    def _tick(self, idx):
+        window = self.scaled[idx - self.seq_len + 1:idx + 1][np.newaxis]
+        pred_prob = float(self.model_class.predict(window, verbose=0)[0][0])
+        status_text, status_style = get_status_info(pred_prob)
+
+        future_predictions = []; first_anomaly_time = None
+        for step, metric_pred in enumerate(self.forecaster.rollout(self.future_steps)):
+            time_str = f"+{(step + 1) * 10} min"
+            future_predictions.append({"Time": time_str, "Predicted Metric": f"{metric_pred:.2f}"})
+            if metric_pred > self.anomaly_threshold and first_anomaly_time is None:
+                first_anomaly_time = time_str
+
+        # The predictive model can only upgrade a Normal verdict.
+        upgraded = first_anomaly_time is not None and status_text == "Normal"
+        return {
+            "timestamp": self.timestamps.iloc[idx], "pred_prob": pred_prob,
+            "status_text": status_text, "status_style": status_style,
+            "final_status_text": "Warning" if upgraded else status_text,
+            "final_status_style": "warning" if upgraded else status_style,
+            "upgraded": upgraded, "future_predictions": future_predictions,
+            "first_anomaly_time": first_anomaly_time,
+        }
+
+    def drain(self, limit=None):
+        """Pops and returns the pending results, oldest first."""
+        items = []
+        while self.results and (limit is None or len(items) < limit):
+            items.append(self.results.popleft())
+        return items
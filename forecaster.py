@@ -0,0 +1,96 @@
+# forecaster.py
+import numpy as np
+from sklearn.preprocessing import MinMaxScaler, StandardScaler
+
+def _affine_params(scaler):
+    """(multiplier, offset) with scaler.transform(x) == x * multiplier + offset, or None."""
+    if isinstance(scaler, StandardScaler):
+        scale = scaler.scale_ if scaler.with_std else np.ones(scaler.n_features_in_)
+        mean = scaler.mean_ if scaler.with_mean else np.zeros(scaler.n_features_in_)
+        return 1.0 / scale, -mean / scale
+    if isinstance(scaler, MinMaxScaler) and not scaler.clip:
+        return scaler.scale_, scaler.min_
+    return None
+
+class Forecaster:
+    """
+    Autoregressive FUTURE_STEPS rollout of the predictive model.
+
+    The window is kept in scaled space, so each step is a single model call: the
+    predicted (scaled) metric replaces column 0 of the last row, exactly as
+    re-scaling the unscaled prediction would. Only column 0 is ever inverse-scaled,
+    and that is done analytically. rollout_batch() advances several windows (e.g.
+    what-if scenarios) through one batched model call per step.
+    """
+
+    def __init__(self, model, scaler, seq_len):
+        self.model = model
+        self.scaler = scaler
+        self.seq_len = seq_len
+        self.n_features = scaler.n_features_in_
+        self._affine = _affine_params(scaler)
+        self._window = np.zeros((seq_len, self.n_features), dtype=np.float32)
+        self.count = 0
+        self._compiled = None
+        if hasattr(model, "compile"):
+            # Keras models go through one traced graph call instead of predict(),
+            # whose per-call dataset/callback setup dominates for batches this small.
+            import tensorflow as tf
+            self._compiled = tf.function(
+                lambda x: model(x, training=False),
+                input_signature=[tf.TensorSpec([None, seq_len, self.n_features], tf.float32)]
+            )
+
+    def _call(self, x):
+        if self._compiled is not None:
+            return self._compiled(x).numpy()
+        return np.asarray(self.model.predict(x, verbose=0))
+
+    def scale(self, raw_rows):
+        raw_rows = np.asarray(raw_rows, dtype=np.float64)
+        if self._affine is None:
+            return self.scaler.transform(raw_rows.reshape(-1, self.n_features)).reshape(raw_rows.shape)
+        multiplier, offset = self._affine
+        return raw_rows * multiplier + offset
+
+    def unscale_metric(self, scaled_values):
+        """Inverse-scales values of column 0 only."""
+        scaled_values = np.asarray(scaled_values, dtype=np.float64)
+        if self._affine is None:
+            dummy = np.zeros((scaled_values.size, self.n_features))
+            dummy[:, 0] = scaled_values.ravel()
+            return self.scaler.inverse_transform(dummy)[:, 0].reshape(scaled_values.shape)
+        multiplier, offset = self._affine
+        return (scaled_values - offset[0]) / multiplier[0]
+
+    def set_window(self, raw_rows):
+        """Replaces the window with the last seq_len raw rows."""
+        raw_rows = np.asarray(raw_rows)[-self.seq_len:]
+        self._window[-len(raw_rows):] = self.scale(raw_rows)
+        self.count = len(raw_rows)
+
+    def push(self, raw_row):
+        """Appends one raw (unscaled) reading to the window."""
+        self._window[:-1] = self._window[1:]
+        self._window[-1] = self.scale(raw_row)
+        self.count += 1
+
+    def rollout(self, steps):
+        """Unscaled column-0 forecasts for the next `steps` steps from the current window."""
+        return self._rollout_scaled(self._window[np.newaxis], steps)[0]
+
+    def rollout_batch(self, raw_windows, steps):
+        """Forecasts for a batch of raw windows, shaped (n_windows, seq_len, n_features) -> (n_windows, steps)."""
+        return self._rollout_scaled(self.scale(raw_windows).astype(np.float32), steps)
+
+    def _rollout_scaled(self, windows, steps):
+        windows = np.array(windows, dtype=np.float32)
+        forecasts = np.empty((len(windows), steps), dtype=np.float32)
+        for step in range(steps):
+            predicted = self._call(windows)[:, 0]
+            forecasts[:, step] = predicted
+            next_rows = windows[:, -1].copy()
+            next_rows[:, 0] = predicted
+            windows[:, :-1] = windows[:, 1:]
+            windows[:, -1] = next_rows
+        return self.unscale_metric(forecasts)
@@ -0,0 +1,81 @@
+# scheduler.py
+import argparse
+import math
+import os
+import time
+
+def speed_arg(text):
+    """argparse type for --speed: a finite multiplier >= 0 (0 = unthrottled)."""
+    try:
+        speed = float(text)
+    except ValueError:
+        speed = math.nan
+    if not (speed >= 0 and math.isfinite(speed)):
+        raise argparse.ArgumentTypeError(f"must be a finite number >= 0, got {text!r}")
+    return speed
+
+class TickScheduler:
+    """
+    Deadline-based pacing for simulation ticks.
+
+    Each tick is due `interval / speed` seconds after the previous deadline, and
+    wait() only sleeps for whatever is left of that period after the tick's own
+    compute time. speed=1 is real time, speed=N replays N times faster and
+    speed=None (or 0) runs as fast as possible. When the loop falls more than
+    max_lag intervals behind it resynchronizes instead of bursting to catch up.
+    """
+
+    def __init__(self, interval, speed=1.0, max_lag=1.0, clock=time.monotonic, sleep=time.sleep):
+        if speed is not None and not (speed >= 0 and math.isfinite(speed)):
+            # A negative period would just resync every tick and silently run unthrottled.
+            raise ValueError(f"speed must be a finite number >= 0 (0 or None = unthrottled), got {speed!r}")
+        self.interval = interval
+        self.speed = speed or None
+        self.max_lag = max_lag
+        self._clock = clock
+        self._sleep = sleep
+        self._deadline = None
+
+    @classmethod
+    def from_env(cls, interval, **kwargs):
+        """Reads the speed from PRISM_TICK_SPEED ("max" or 0 = unthrottled, default 1)."""
+        raw = os.environ.get("PRISM_TICK_SPEED", "1")
+        return cls(interval, speed=None if raw.lower() == "max" else float(raw), **kwargs)
+
+    @property
+    def unthrottled(self):
+        return self.speed is None
+
+    @property
+    def period(self):
+        """Seconds between deadlines at the current speed."""
+        return 0.0 if self.unthrottled else self.interval / self.speed
+
+    def scaled(self, seconds):
+        """A real-time duration (e.g. a cosmetic delay) converted to the current speed."""
+        return 0.0 if self.unthrottled else seconds / self.speed
+
+    def start(self):
+        self._deadline = self._clock()
+        return self
+
+    def next_deadline(self, deadline):
+        """Deadline following `deadline`, resynchronized if it is too far in the past."""
+        now = self._clock()
+        if self.unthrottled:
+            return now
+        next_due = deadline + self.period
+        if now - next_due > self.max_lag * self.period:
+            return now
+        return next_due
+
+    def wait(self):
+        """Blocks until the next tick is due and returns how late it started (seconds)."""
+        if self._deadline is None:
+            self.start()
+        self._deadline = self.next_deadline(self._deadline)
+        remaining = self._deadline - self._clock()
+        if remaining > 0:
+            self._sleep(remaining)
+            return 0.0
+        return -remaining
@@ -0,0 +1,207 @@
+# server/ml/async_engine.py
+"""
+asyncio core for the simulation engine.
+
+Every device stream is a coroutine that advances its own SimulationSession on its
+own deadline-paced schedule and submits the resulting windows to a MicroBatcher.
+The batcher coalesces pending requests from all streams and runs them through
+score_batch (scaler -> classifier -> screener -> why/when) as one micro-batch,
+flushed as soon as max_batch requests are waiting or the oldest request has waited
+max_delay seconds, whichever comes first. Inference runs on a worker thread, so
+stream pacing never waits on a model call it is not part of.
+
+    python ml/async_engine.py smartphone --streams 200 --batch-size 64 --max-delay 0.02
+    python ml/async_engine.py smartphone --streams 200 --metrics-port 9100   # batch size, flush trigger, latency
+"""
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from metrics import METRICS, MetricsExporter
+from output import close_writer, get_writer
+from simulation_engine import (
+    TICK_DURATION, TICK_LAG, TICK_SECONDS, SimulationSession, emit_packets,
+    load_artifacts, log_debug, score_batch
+)
+from scheduler import TickScheduler, speed_arg
+from simulation_loader import get_registry
+
+BATCH_SIZE = METRICS.histogram(
+    "engine_microbatch_size", "Requests per flushed micro-batch.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+)
+BATCH_FLUSHES = METRICS.counter("engine_microbatch_flushes_total", "Micro-batch flushes by trigger (size or deadline).")
+REQUEST_LATENCY = METRICS.histogram("engine_microbatch_request_seconds", "Time from submitting a window to receiving its packet.")
+BATCH_CONFIG = METRICS.gauge("engine_microbatch_config", "Configured micro-batch limits (max_batch, max_delay_seconds).")
+
+class MicroBatcher:
+    """
+    Coalesces single-window scoring requests for one device into batched
+    score_batch calls. submit() is awaited by stream coroutines; flushing happens
+    in a background task started by start().
+    """
+
+    def __init__(self, artifacts, max_batch=64, max_delay=0.01):
+        self.artifacts = artifacts
+        self.device = artifacts["device"]
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending = []
+        self._wakeup = None
+        self._task = None
+        # One inference thread per device keeps model calls serialized.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"batcher-{self.device}")
+        BATCH_CONFIG.set(max_batch, device=self.device, limit="max_batch")
+        BATCH_CONFIG.set(max_delay, device=self.device, limit="max_delay_seconds")
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    async def submit(self, row, class_input, pred_input):
+        """
+        Scores one (1, 10, n) / (1, seq_len * n) window pair ending at dataset `row`;
+        resolves to its packet. Score-cache hits return without waiting for a batch.
+        """
+        cache = self.artifacts.get("score_cache")
+        if cache is not None:
+            cached = cache.get_many(self.device, self.artifacts["version"], [row])[0]
+            if cached is not None:
+                return {"timestamp": time.strftime("%H:%M:%S"), **cached}
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((class_input, pred_input, future, time.monotonic(), row))
+        self._wakeup.set()
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if not self._pending:
+                continue
+            deadline = self._pending[0][3] + self.max_delay
+            while len(self._pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                self._wakeup.clear()
+
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            if self._pending:
+                self._wakeup.set()
+            BATCH_FLUSHES.inc(device=self.device, trigger="size" if len(batch) == self.max_batch else "deadline")
+            BATCH_SIZE.observe(len(batch), device=self.device)
+
+            class_inputs = np.concatenate([request[0] for request in batch])
+            pred_inputs = np.concatenate([request[1] for request in batch])
+            try:
+                packets = await loop.run_in_executor(
+                    self._executor, self._score, [request[4] for request in batch], class_inputs, pred_inputs
+                )
+            except Exception as e:
+                for request in batch:
+                    if not request[2].done():
+                        request[2].set_exception(e)
+                continue
+            now = time.monotonic()
+            for request, packet in zip(batch, packets):
+                REQUEST_LATENCY.observe(now - request[3], device=self.device)
+                if not request[2].done():
+                    request[2].set_result(packet)
+
+    def _score(self, rows, class_inputs, pred_inputs):
+        packets = score_batch(self.artifacts, class_inputs, pred_inputs)
+        cache = self.artifacts.get("score_cache")
+        if cache is not None:
+            cache.put_many(self.device, self.artifacts["version"], rows, packets)
+        return packets
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=False)
+
+async def run_stream(stream, session, batcher, scheduler, offset=0.0):
+    """One device stream: advance, score through the batcher, emit, and sleep until the next deadline."""
+    device = session.device
+    deadline = time.monotonic() + offset
+    await asyncio.sleep(offset)
+    while True:
+        tick_start = time.monotonic()
+        class_input, pred_input = session.next_windows()
+        packet = await batcher.submit(session.row, class_input, pred_input)
+        packet["stream"] = stream
+        emit_packets([packet], device)
+        TICK_DURATION.observe(time.monotonic() - tick_start, device=device)
+
+        deadline = scheduler.next_deadline(deadline)
+        remaining = deadline - time.monotonic()
+        TICK_LAG.observe(max(0.0, -remaining), device=device)
+        # Even unthrottled streams yield here so the batcher can collect the others.
+        await asyncio.sleep(max(0.0, remaining))
+
+async def run_async(device, n_streams, scheduler=None, max_batch=64, max_delay=0.01, stagger=True, seed=None):
+    """Runs n_streams independent streams of one device against a shared micro-batcher."""
+    scheduler = scheduler or TickScheduler(TICK_SECONDS)
+    artifacts = load_artifacts(device)
+    batcher = MicroBatcher(artifacts, max_batch=max_batch, max_delay=max_delay).start()
+    log_debug(f"Async engine running {n_streams} {device} streams (max_batch={max_batch}, max_delay={max_delay}s).")
+    # Spreading stream start times over one period avoids every stream hitting the same deadline.
+    offsets = np.linspace(0.0, scheduler.period, n_streams, endpoint=False) if stagger else np.zeros(n_streams)
+    streams = [
+        run_stream(
+            stream, SimulationSession(stream, artifacts, seed=None if seed is None else seed + stream),
+            batcher, scheduler, float(offsets[stream])
+        )
+        for stream in range(n_streams)
+    ]
+    try:
+        await asyncio.gather(*streams)
+    finally:
+        await batcher.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run many device streams with deadline-bounded micro-batching.")
+    parser.add_argument("device", nargs="?", default="smartphone")
+    parser.add_argument("--streams", type=int, default=16, help="independent device streams")
+    parser.add_argument("--batch-size", type=int, default=64, help="flush once this many requests are waiting")
+    parser.add_argument("--max-delay", type=float, default=0.01, help="flush once the oldest request has waited this long (seconds)")
+    parser.add_argument("--interval", type=float, default=TICK_SECONDS, help="seconds between packets per stream at real-time speed")
+    parser.add_argument("--speed", type=speed_arg, default=1.0, help="replay speed multiplier")
+    parser.add_argument("--unthrottled", action="store_true", help="emit packets as fast as they can be computed")
+    parser.add_argument("--backend", choices=["keras", "numpy"], help="classifier backend")
+    parser.add_argument("--trees", choices=["native", "numpy"], help="screener/diagnostician backend")
+    parser.add_argument("--seed", type=int, help="makes each stream's device and start point reproducible")
+    parser.add_argument("--metrics-file", help="periodically write metrics (Prometheus text format) to this file")
+    parser.add_argument("--metrics-port", type=int, help="serve metrics on http://127.0.0.1:<port>/metrics")
+    parser.add_argument("--metrics-interval", type=float, default=5.0, help="seconds between metrics file writes")
+    args = parser.parse_args()
+
+    get_registry(model_backend=args.backend, tree_backend=args.trees)
+    exporter = None
+    if args.metrics_file or args.metrics_port is not None:
+        exporter = MetricsExporter(path=args.metrics_file, port=args.metrics_port, interval=args.metrics_interval).start()
+    get_writer()
+    scheduler = TickScheduler(args.interval, speed=None if args.unthrottled else args.speed)
+    try:
+        asyncio.run(run_async(args.device, args.streams, scheduler, args.batch_size, args.max_delay, seed=args.seed))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        close_writer()
+        if exporter is not None:
+            # A last write, so the file covers the whole run.
+            exporter.stop()
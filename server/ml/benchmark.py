@@ -0,0 +1,196 @@
+# server/ml/benchmark.py
+"""
+Stage-level latency benchmark for the simulation pipeline.
+
+Times every stage of run_simulation for each device (smartphone 56, smartwatch 168,
+smartfridge 336 window lengths) on synthetic fleets, so it runs offline without the
+datasets: artifact load, dataset parsing (when the dataset is present), per-row
+scaling vs. full-window scaling, the Keras classifier, the screener, why/when
+models, JSON serialization, and an end-to-end fleet tick. Results are written as
+JSON (p50/p99 latency, throughput, peak RSS) so runs can be compared:
+
+    python ml/benchmark.py --fleet-size 1000 --output bench.json
+    python ml/benchmark.py --compare bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+from sklearn.ensemble import IsolationForest
+
+from simulation_engine import (
+    CLASSIFICATION_SEQUENCE_LENGTH, PREDICTIVE_FEATURE_CONFIG, PREDICTIVE_SEQUENCE_LENGTHS,
+    FleetSimulation, _read_classification_dataset, _read_predictive_dataset,
+    load_model_artifacts, log_debug, score_batch
+)
+from simulation_loader import ArtifactRegistry, get_registry
+from synthetic_fleet import synthetic_artifacts
+from tree_ensemble import CompiledIsolationForest
+from windows import RingWindow
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KB on Linux and bytes on macOS.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def time_stage(func, iterations, items_per_call=1, warmup=1):
+    """Runs func repeatedly and returns latency percentiles (ms) and throughput (items/s)."""
+    for _ in range(warmup):
+        func()
+    samples = np.empty(iterations)
+    for k in range(iterations):
+        started = time.perf_counter()
+        func()
+        samples[k] = time.perf_counter() - started
+    return {
+        "iterations": iterations,
+        "items_per_call": items_per_call,
+        "p50_ms": float(np.percentile(samples, 50) * 1000),
+        "p99_ms": float(np.percentile(samples, 99) * 1000),
+        "mean_ms": float(samples.mean() * 1000),
+        "throughput_per_s": float(items_per_call * iterations / samples.sum()),
+    }
+
+def _screen(screener_model, inputs):
+    if isinstance(screener_model, (IsolationForest, CompiledIsolationForest)):
+        return screener_model.decision_function(inputs)
+    return screener_model.predict_proba(inputs)
+
+def bench_device(device, fleet_size, iterations, seed=0):
+    results = {"sequence_length": PREDICTIVE_SEQUENCE_LENGTHS[device]}
+    seq_len_pred = PREDICTIVE_SEQUENCE_LENGTHS[device]
+
+    # Artifact load: a fresh registry so nothing is served from cache.
+    registry = get_registry()
+    cold_registry = ArtifactRegistry(model_backend=registry.model_backend, tree_backend=registry.tree_backend)
+    for key in ["class_model", "class_scaler", "pred_scaler", "screener_model", "why_model", "when_model"]:
+        started = time.perf_counter()
+        cold_registry.get(device, key)
+        results[f"load_{key}"] = {"seconds": time.perf_counter() - started}
+
+    # Dataset parsing is only measured when the dataset is available locally.
+    artifacts = load_model_artifacts(device, registry)
+    for key, reader, columns in [
+        ("class_dataset", _read_classification_dataset, artifacts["features_class"]),
+        ("pred_dataset", _read_predictive_dataset, PREDICTIVE_FEATURE_CONFIG[device]),
+    ]:
+        path = registry.path(device, key)
+        if os.path.exists(path):
+            results[f"parse_{key}"] = time_stage(lambda: reader(path, columns), max(1, iterations // 20), warmup=0)
+
+    rows_per_device = seq_len_pred + iterations + 1
+    fleet_artifacts = synthetic_artifacts(artifacts, fleet_size, rows_per_device, seed=seed)
+    pred_matrix, class_matrix = fleet_artifacts["pred_matrix"], fleet_artifacts["class_matrix"]
+
+    # Scaling: the ring window scales one row per tick; the legacy loop re-scaled the whole window.
+    window = RingWindow(seq_len_pred, pred_matrix.shape[1], artifacts["scaler_pred"])
+    rows = iter(pred_matrix)
+    results["scale_row_incremental"] = time_stage(lambda: window.push(next(rows)), iterations)
+    window_rows = pred_matrix[:seq_len_pred]
+    results["scale_window_full"] = time_stage(lambda: artifacts["scaler_pred"].transform(window_rows), iterations)
+
+    fleet = FleetSimulation(fleet_artifacts, fleet_size, seed=seed)
+    for _ in range(seq_len_pred):
+        fleet.window_class.push(class_matrix[:fleet_size])
+        fleet.window_pred.push(pred_matrix[:fleet_size])
+    class_batch = np.ascontiguousarray(fleet.window_class.sequences())
+    pred_batch = np.ascontiguousarray(fleet.window_pred.flat())
+    class_one, pred_one = class_batch[:1], pred_batch[:1]
+
+    model_class = artifacts["model_class"]
+    results["classify_single"] = time_stage(lambda: model_class.predict(class_one, verbose=0), iterations)
+    results["classify_batch"] = time_stage(
+        lambda: model_class.predict(class_batch, batch_size=fleet_size, verbose=0),
+        max(1, iterations // 10), items_per_call=fleet_size
+    )
+    screener_model = artifacts["screener_model"]
+    results["screener_single"] = time_stage(lambda: _screen(screener_model, pred_one), iterations)
+    results["screener_batch"] = time_stage(
+        lambda: _screen(screener_model, pred_batch), max(1, iterations // 10), items_per_call=fleet_size
+    )
+    results["why_single"] = time_stage(lambda: artifacts["why_model"].predict(pred_one), iterations)
+    results["when_single"] = time_stage(lambda: artifacts["when_model"].predict(pred_one), iterations)
+
+    packet = score_batch(artifacts, class_one, pred_one)[0]
+    results["serialize_packet"] = time_stage(lambda: json.dumps(packet), iterations * 10)
+
+    results["fleet_tick"] = time_stage(fleet.step, max(1, iterations // 10), items_per_call=fleet_size)
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(devices, fleet_size, iterations, seed=0):
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "backend": get_registry().model_backend,
+            "tree_backend": get_registry().tree_backend,
+            "fleet_size": fleet_size,
+            "iterations": iterations,
+            "classification_sequence_length": CLASSIFICATION_SEQUENCE_LENGTH,
+        },
+        "devices": {},
+    }
+    for device in devices:
+        log_debug(f"Benchmarking {device}...")
+        report["devices"][device] = bench_device(device, fleet_size, iterations, seed)
+    report["meta"]["peak_rss_mb"] = peak_rss_mb()
+    return report
+
+def print_report(report, baseline=None):
+    for device, stages in report["devices"].items():
+        print(f"\n== {device} (window {stages['sequence_length']}) ==")
+        for stage, stats in stages.items():
+            if not isinstance(stats, dict):
+                continue
+            if "p50_ms" not in stats:
+                print(f"  {stage:<24} {stats['seconds'] * 1000:10.1f} ms")
+                continue
+            line = f"  {stage:<24} p50 {stats['p50_ms']:9.3f} ms  p99 {stats['p99_ms']:9.3f} ms  {stats['throughput_per_s']:12.1f}/s"
+            previous = (baseline or {}).get("devices", {}).get(device, {}).get(stage)
+            if previous and "p50_ms" in previous and previous["p50_ms"] > 0:
+                line += f"  ({stats['p50_ms'] / previous['p50_ms']:.2f}x p50 vs baseline)"
+            print(line)
+        print(f"  peak RSS {stages['peak_rss_mb']:.0f} MB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark each stage of the simulation pipeline.")
+    parser.add_argument("--devices", nargs="+", default=list(PREDICTIVE_SEQUENCE_LENGTHS), choices=list(PREDICTIVE_SEQUENCE_LENGTHS))
+    parser.add_argument("--fleet-size", type=int, default=256, help="synthetic devices per batched stage")
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend", choices=["keras", "numpy"])
+    parser.add_argument("--trees", choices=["native", "numpy"])
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare against")
+    args = parser.parse_args()
+
+    get_registry(model_backend=args.backend, tree_backend=args.trees)
+    report = run_benchmarks(args.devices, args.fleet_size, args.iterations, args.seed)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
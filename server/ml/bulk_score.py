@@ -0,0 +1,305 @@
+# server/ml/bulk_score.py
+"""
+Out-of-core bulk scoring of telemetry exports.
+
+The input (CSV, or NDJSON with optional nested "metrics" objects) is read in
+chunks of --chunk-size rows; every row needs the device's classification and
+predictive feature columns plus a device id column (device_id / watch_id, or
+--id-column). Rows are scaled once, and each device keeps the last
+seq_len - 1 scaled rows of both windows as a tail that is prepended to its rows
+in the next chunk, so windows span chunk boundaries exactly as they would in one
+pass over the file. Every row at which both of its device's windows are full is
+scored through evaluate_batch and written with its input row number to a new
+part file of the output directory (Parquet when pyarrow is installed, CSV
+otherwise). Memory is bounded by the chunk size and the number of devices, not
+by the input size.
+
+After each part, a checkpoint (rows consumed, next part number and the device
+tails) is written next to the parts; --resume continues from it, skipping the
+rows already scored and discarding any part written after the checkpoint.
+
+    python ml/bulk_score.py smartphone field_export.csv --output scores/ --chunk-size 50000
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from metrics import METRICS
+from simulation_engine import (
+    CLASSIFICATION_SEQUENCE_LENGTH, PREDICTIVE_FEATURE_CONFIG, PREDICTIVE_SEQUENCE_LENGTHS,
+    evaluate_batch, load_model_artifacts, log_debug
+)
+from simulation_loader import get_registry
+from windows import row_scaler
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+DEFAULT_CHUNK_SIZE = 50000
+DEFAULT_BATCH_SIZE = 4096
+ID_COLUMNS = ("device_id", "watch_id")
+CHECKPOINT_FILE = "_checkpoint.json"
+TAILS_FILE = "_tails.npz"
+RESULT_COLUMNS = [
+    "row", "device_id", "class_prob", "health_status", "screener_prob",
+    "predictive_prob", "is_anomaly", "root_cause", "first_anomaly_time"
+]
+
+BULK_ROWS = METRICS.counter("engine_bulk_rows_total", "Input rows read by bulk scoring.")
+BULK_SCORED = METRICS.counter("engine_bulk_windows_total", "Windows scored by bulk scoring.")
+
+def _input_format(path):
+    return "ndjson" if path.endswith((".ndjson", ".jsonl", ".json")) else "csv"
+
+def read_chunks(path, chunk_size, skip_rows=0, fmt=None):
+    """
+    Yields DataFrames of up to chunk_size input rows, after skipping the first
+    skip_rows data rows (one record per line is assumed for both formats).
+    """
+    fmt = fmt or _input_format(path)
+    with open(path, "r", newline="") as handle:
+        names = None
+        if fmt == "csv":
+            names = pd.read_csv(handle, nrows=0).columns.tolist()
+            handle.seek(0)
+            handle.readline()
+        # Skipping whole lines is far cheaper than letting pandas parse them.
+        for _ in itertools.islice(handle, skip_rows):
+            pass
+        if fmt == "csv":
+            reader = pd.read_csv(handle, names=names, header=None, chunksize=chunk_size)
+        else:
+            reader = pd.read_json(handle, lines=True, chunksize=chunk_size)
+        for chunk in reader:
+            if "metrics" in chunk.columns:
+                chunk = pd.concat(
+                    [chunk.drop(columns=["metrics"]).reset_index(drop=True), pd.json_normalize(chunk["metrics"].tolist())],
+                    axis=1
+                )
+            yield chunk
+
+class PartWriter:
+    """Writes each scored chunk as the next part file of an output directory."""
+
+    def __init__(self, directory, fmt=None):
+        self.directory = directory
+        self.format = fmt or ("parquet" if pq is not None else "csv")
+        if self.format == "parquet" and pq is None:
+            raise ValueError("Parquet output needs pyarrow; install it or use --format csv.")
+        os.makedirs(directory, exist_ok=True)
+
+    def part_path(self, number):
+        return os.path.join(self.directory, f"part-{number:05d}.{self.format}")
+
+    def write(self, number, frame):
+        path = self.part_path(number)
+        tmp_path = f"{path}.tmp"
+        if self.format == "parquet":
+            pq.write_table(pa.Table.from_pandas(frame, preserve_index=False), tmp_path)
+        else:
+            frame.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        return path
+
+    def discard_from(self, number):
+        """Removes parts (and temporaries) numbered `number` or later, left by an interrupted run."""
+        for name in os.listdir(self.directory):
+            if name.startswith("part-") and int(name[5:10]) >= number:
+                os.remove(os.path.join(self.directory, name))
+
+class BulkScorer:
+    """
+    Scores chunks of raw telemetry rows, carrying each device's window tails from
+    one chunk to the next.
+    """
+
+    def __init__(self, artifacts, batch_size=DEFAULT_BATCH_SIZE, id_column=None):
+        self.artifacts = artifacts
+        device = artifacts["device"]
+        self.features_class = list(artifacts["features_class"])
+        self.features_pred = PREDICTIVE_FEATURE_CONFIG[device]
+        self.seq_len_class = CLASSIFICATION_SEQUENCE_LENGTH
+        self.seq_len_pred = PREDICTIVE_SEQUENCE_LENGTHS[device]
+        self.scale_class = row_scaler(artifacts["scaler_class"])
+        self.scale_pred = row_scaler(artifacts["scaler_pred"])
+        self.batch_size = batch_size
+        self.id_column = id_column
+        self.tails = {}
+
+    def _device_ids(self, chunk):
+        column = self.id_column or next((name for name in ID_COLUMNS if name in chunk.columns), None)
+        if column is None:
+            return np.zeros(len(chunk), dtype=np.int64), ["0"]
+        if column not in chunk.columns:
+            raise ValueError(f"Input has no device id column '{column}'.")
+        codes, labels = pd.factorize(chunk[column].astype(str))
+        return codes, list(labels)
+
+    def score_chunk(self, chunk, first_row):
+        """Scores one chunk whose first row is input row `first_row`; returns the result frame."""
+        missing = [name for name in self.features_class + self.features_pred if name not in chunk.columns]
+        if missing:
+            raise ValueError(f"Input is missing feature columns: {', '.join(missing)}")
+        class_rows = self.scale_class(chunk[self.features_class].to_numpy(dtype=np.float64)).astype(np.float32)
+        pred_rows = self.scale_pred(chunk[self.features_pred].to_numpy(dtype=np.float64)).astype(np.float32)
+        codes, labels = self._device_ids(chunk)
+
+        # Every device's tail + new rows are laid end to end in one buffer per window
+        # type; a scored row is described by where its two windows start in them.
+        class_parts, pred_parts, class_starts, pred_starts, scored_rows, scored_devices = [], [], [], [], [], []
+        class_offset = pred_offset = 0
+        order = np.argsort(codes, kind="stable")
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(codes, minlength=len(labels)))))
+        for code, label in enumerate(labels):
+            positions = order[bounds[code]:bounds[code + 1]]
+            class_tail, pred_tail = self.tails.get(label, (class_rows[:0], pred_rows[:0]))
+            extended_class = np.concatenate((class_tail, class_rows[positions]))
+            extended_pred = np.concatenate((pred_tail, pred_rows[positions]))
+            class_ends = len(class_tail) + np.arange(len(positions))
+            pred_ends = len(pred_tail) + np.arange(len(positions))
+            full = (class_ends >= self.seq_len_class - 1) & (pred_ends >= self.seq_len_pred - 1)
+            class_starts.append(class_offset + class_ends[full] - self.seq_len_class + 1)
+            pred_starts.append(pred_offset + pred_ends[full] - self.seq_len_pred + 1)
+            scored_rows.append(first_row + positions[full])
+            scored_devices.append(np.full(int(full.sum()), code))
+            class_parts.append(extended_class)
+            pred_parts.append(extended_pred)
+            class_offset += len(extended_class)
+            pred_offset += len(extended_pred)
+            self.tails[label] = (
+                extended_class[max(0, len(extended_class) - self.seq_len_class + 1):].copy(),
+                extended_pred[max(0, len(extended_pred) - self.seq_len_pred + 1):].copy(),
+            )
+
+        class_buffer = np.concatenate(class_parts)
+        pred_buffer = np.concatenate(pred_parts)
+        class_starts = np.concatenate(class_starts)
+        pred_starts = np.concatenate(pred_starts)
+        rows = np.concatenate(scored_rows)
+        devices = np.concatenate(scored_devices)
+        # Output follows input order rather than device order.
+        by_row = np.argsort(rows, kind="stable")
+        class_starts, pred_starts, rows, devices = class_starts[by_row], pred_starts[by_row], rows[by_row], devices[by_row]
+
+        frames = []
+        class_steps = np.arange(self.seq_len_class)
+        pred_steps = np.arange(self.seq_len_pred)
+        for start in range(0, len(rows), self.batch_size):
+            stop = min(start + self.batch_size, len(rows))
+            class_inputs = class_buffer[class_starts[start:stop, np.newaxis] + class_steps]
+            pred_inputs = pred_buffer[pred_starts[start:stop, np.newaxis] + pred_steps].reshape(stop - start, -1)
+            results = evaluate_batch(self.artifacts, class_inputs, pred_inputs)
+            frames.append(pd.DataFrame({
+                "row": rows[start:stop],
+                "device_id": np.asarray(labels, dtype=object)[devices[start:stop]],
+                "class_prob": results["class_probs"],
+                "health_status": [status for status, _ in results["statuses"]],
+                "screener_prob": results["screener_probs"],
+                "predictive_prob": results["predictive_probs"],
+                "is_anomaly": results["is_anomaly"],
+                "root_cause": results["root_causes"],
+                "first_anomaly_time": results["first_anomaly_times"],
+            }))
+        BULK_ROWS.inc(len(chunk), device=self.artifacts["device"])
+        BULK_SCORED.inc(len(rows), device=self.artifacts["device"])
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=RESULT_COLUMNS)
+
+    def save_tails(self, path):
+        arrays = {}
+        for number, (label, (class_tail, pred_tail)) in enumerate(self.tails.items()):
+            arrays[f"class_{number}"], arrays[f"pred_{number}"] = class_tail, pred_tail
+        arrays["labels"] = np.array(list(self.tails), dtype=object)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    def load_tails(self, path):
+        with np.load(path, allow_pickle=True) as data:
+            self.tails = {
+                str(label): (data[f"class_{number}"], data[f"pred_{number}"])
+                for number, label in enumerate(data["labels"])
+            }
+
+def _read_checkpoint(directory):
+    path = os.path.join(directory, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def _write_checkpoint(directory, checkpoint):
+    path = os.path.join(directory, CHECKPOINT_FILE)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(f"{path}.tmp", path)
+
+def bulk_score(device, input_path, output_dir, chunk_size=DEFAULT_CHUNK_SIZE, batch_size=DEFAULT_BATCH_SIZE,
+               resume=False, id_column=None, input_format=None, output_format=None, registry=None):
+    """Scores input_path into part files under output_dir; returns (rows read, windows scored, seconds)."""
+    scorer = BulkScorer(load_model_artifacts(device, registry), batch_size, id_column)
+    writer = PartWriter(output_dir, output_format)
+    checkpoint = {"input": os.path.abspath(input_path), "device": device, "rows": 0, "scored": 0, "next_part": 0}
+    previous = _read_checkpoint(output_dir) if resume else None
+    if previous is not None:
+        if previous["input"] != checkpoint["input"] or previous["device"] != device:
+            raise ValueError(f"Checkpoint in {output_dir} belongs to {previous['device']} / {previous['input']}.")
+        checkpoint = previous
+        scorer.load_tails(os.path.join(output_dir, TAILS_FILE))
+        log_debug(f"[{device}] Resuming after row {checkpoint['rows']} (part {checkpoint['next_part']}).")
+    else:
+        for name in (CHECKPOINT_FILE, TAILS_FILE):
+            if os.path.exists(os.path.join(output_dir, name)):
+                os.remove(os.path.join(output_dir, name))
+    writer.discard_from(checkpoint["next_part"])
+
+    started = time.monotonic()
+    rows_read = scored = 0
+    for chunk in read_chunks(input_path, chunk_size, checkpoint["rows"], input_format):
+        chunk_started = time.monotonic()
+        results = scorer.score_chunk(chunk, checkpoint["rows"])
+        writer.write(checkpoint["next_part"], results)
+        # Tails first: a checkpoint must never point past the tails it was written with.
+        scorer.save_tails(os.path.join(output_dir, TAILS_FILE))
+        checkpoint.update(
+            rows=checkpoint["rows"] + len(chunk), scored=checkpoint["scored"] + len(results),
+            next_part=checkpoint["next_part"] + 1
+        )
+        _write_checkpoint(output_dir, checkpoint)
+        rows_read += len(chunk)
+        scored += len(results)
+        elapsed = time.monotonic() - chunk_started
+        log_debug(
+            f"[{device}] Part {checkpoint['next_part'] - 1}: {len(chunk)} rows, {len(results)} windows "
+            f"in {elapsed:.2f}s ({len(chunk) / max(elapsed, 1e-9):,.0f} rows/s); {checkpoint['rows']} rows done."
+        )
+    return rows_read, scored, time.monotonic() - started
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score a large telemetry file in chunks with bounded memory.")
+    parser.add_argument("device", choices=sorted(PREDICTIVE_SEQUENCE_LENGTHS))
+    parser.add_argument("input", help="CSV or NDJSON telemetry file")
+    parser.add_argument("--output", required=True, help="directory for the part files and checkpoint")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="input rows per chunk / part file")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="windows per model call")
+    parser.add_argument("--resume", action="store_true", help="continue from the checkpoint in --output")
+    parser.add_argument("--id-column", help="device id column (default: device_id or watch_id)")
+    parser.add_argument("--input-format", choices=["csv", "ndjson"], help="default: from the file extension")
+    parser.add_argument("--format", choices=["parquet", "csv"], help="output format (default: parquet if pyarrow is installed)")
+    parser.add_argument("--backend", choices=["keras", "numpy"], help="classifier backend")
+    parser.add_argument("--trees", choices=["native", "numpy"], help="screener/diagnostician backend")
+    args = parser.parse_args()
+
+    registry = get_registry(model_backend=args.backend, tree_backend=args.trees)
+    rows, windows, seconds = bulk_score(
+        args.device, args.input, args.output, args.chunk_size, args.batch_size, args.resume,
+        args.id_column, args.input_format, args.format, registry
+    )
+    log_debug(f"Read {rows} rows and scored {windows} windows in {seconds:.2f}s ({rows / max(seconds, 1e-9):,.0f} rows/s).")
@@ -0,0 +1,183 @@
+# server/ml/cascade.py
+"""
+Evaluation cascade: skips the classifier and screener on windows that have not
+meaningfully changed since they were last evaluated.
+
+Each stream slot (a fleet stream, a session) remembers, per model, the summary
+statistics of the window it last evaluated (per-feature mean and standard
+deviation over the window, in scaled units) and the score it got. A model is
+re-run for a slot when
+  - the slot has no score yet,
+  - its score is max_staleness ticks old,
+  - its last score lies within `margin` of a decision threshold (0.3 / 0.7 for
+    the classifier's status, the 0.5 cut or the IsolationForest's 0 for the
+    screener), so a verdict can never flip on a stale score, or
+  - a window statistic (per-feature mean, standard deviation or newest value)
+    moved by more than `tolerance` since that evaluation.
+Otherwise the previous score is reused, so a displayed probability can be up to
+max_staleness ticks old. Both models can react sharply to small shifts (the
+LightGBM screener is piecewise constant), so the default tolerance is tight. The screener is also skipped for
+windows the classifier rates critical while its last score was well below the
+0.85 floor the critical branch applies, since it cannot change that verdict.
+Every decision is counted in engine_cascade_decisions_total by model, decision
+and reason. After screen(), `fresh` marks the windows both models actually
+scored; only their verdicts are exact, so only they may be cached.
+
+The cascade is off unless PRISM_CASCADE=1 or the engine runs with --cascade.
+"""
+import os
+
+import numpy as np
+
+from metrics import METRICS
+
+ENABLED = os.environ.get("PRISM_CASCADE", "").lower() in ("1", "true", "yes")
+MAX_STALENESS = int(os.environ.get("PRISM_CASCADE_MAX_STALENESS", 10))
+TOLERANCE = float(os.environ.get("PRISM_CASCADE_TOLERANCE", 0.02))
+MARGIN = float(os.environ.get("PRISM_CASCADE_MARGIN", 0.05))
+
+CLASS_THRESHOLDS = (0.3, 0.7)
+CRITICAL_FLOOR = 0.85
+
+DECISIONS = METRICS.counter(
+    "engine_cascade_decisions_total",
+    "Cascade decisions by model (classifier, screener), decision (run, skip) and reason."
+)
+
+def window_stats(windows):
+    """Per-feature mean, standard deviation and newest value of each (N, seq_len, n_features) window."""
+    # Sums accumulate in float64 straight from the float32 windows, which is several
+    # times cheaper than converting them and calling mean() and std().
+    seq_len = windows.shape[1]
+    mean = windows.sum(axis=1, dtype=np.float64) / seq_len
+    mean_square = np.einsum("ijk,ijk->ik", windows, windows, dtype=np.float64) / seq_len
+    return np.concatenate((mean, np.sqrt(np.maximum(mean_square - mean * mean, 0.0)), windows[:, -1]), axis=1)
+
+class _ModelState:
+    """Window statistics at the last evaluation, and ticks since it, of one model for every slot."""
+
+    def __init__(self, n_slots):
+        self.stats = None
+        self.evaluated = np.zeros(n_slots, dtype=bool)
+        self.age = np.zeros(n_slots, dtype=np.int64)
+
+    def plan(self, slots, stats, near_threshold, max_staleness, tolerance):
+        """Boolean mask of slots to evaluate, plus the reason for each slot."""
+        if self.stats is None:
+            self.stats = np.zeros((len(self.evaluated), stats.shape[1]), dtype=np.float64)
+        first = ~self.evaluated[slots]
+        stale = self.age[slots] + 1 >= max_staleness
+        drifted = np.abs(stats - self.stats[slots]).max(axis=1) > tolerance
+        reasons = np.select(
+            [first, stale, near_threshold, drifted],
+            ["first", "stale", "threshold", "drift"], "stable"
+        )
+        return reasons != "stable", reasons
+
+    def commit(self, slots, run, stats):
+        evaluated = slots[run]
+        self.stats[evaluated] = stats[run]
+        self.evaluated[evaluated] = True
+        self.age[evaluated] = 0
+        self.age[slots[~run]] += 1
+
+class EvaluationGate:
+    """
+    Per-slot cascade state for n_slots streams. classify() and screen() take the
+    models' inputs for a batch of slots and a function that runs the model on a
+    subset; they return scores for the whole batch, reusing stored ones where the
+    model was skipped.
+    """
+
+    def __init__(self, n_slots, pred_seq_len, device=None, max_staleness=MAX_STALENESS, tolerance=TOLERANCE, margin=MARGIN):
+        self.n_slots = n_slots
+        self.pred_seq_len = pred_seq_len
+        self.max_staleness = max_staleness
+        self.tolerance = tolerance
+        self.margin = margin
+        self._classifier = _ModelState(n_slots)
+        self._screener = _ModelState(n_slots)
+        self.class_probs = np.zeros(n_slots, dtype=np.float64)
+        self.screener_probs = np.zeros(n_slots, dtype=np.float64)
+        self.screener_anomaly = np.zeros(n_slots, dtype=bool)
+        self.screener_margins = np.zeros(n_slots, dtype=np.float64)
+        self.device = device
+        self._classified = None
+        self.fresh = None  # per window of the last screen(): both models were run
+        self.decisions = {(model, decision): 0 for model in ("classifier", "screener") for decision in ("run", "skip")}
+
+    def _count(self, model, reasons):
+        for reason, count in zip(*np.unique(reasons, return_counts=True)):
+            decision = "skip" if reason in ("stable", "critical") else "run"
+            self.decisions[model, decision] += int(count)
+            DECISIONS.inc(int(count), device=self.device, model=model, decision=decision, reason=str(reason))
+
+    def skip_ratio(self, model):
+        """Fraction of this gate's decisions for `model` ("classifier" or "screener") that skipped it."""
+        total = self.decisions[model, "run"] + self.decisions[model, "skip"]
+        return self.decisions[model, "skip"] / total if total else 0.0
+
+    def summary(self):
+        return f"classifier skipped {self.skip_ratio('classifier'):.0%}, screener skipped {self.skip_ratio('screener'):.0%}"
+
+    def classify(self, slots, class_inputs, predict):
+        """Classifier probabilities for every window; predict(inputs) -> probabilities."""
+        slots = np.asarray(slots)
+        stats = window_stats(np.asarray(class_inputs))
+        previous = self.class_probs[slots]
+        near = np.min([np.abs(previous - threshold) for threshold in CLASS_THRESHOLDS], axis=0) < self.margin
+        run, reasons = self._classifier.plan(slots, stats, near, self.max_staleness, self.tolerance)
+        if run.any():
+            self.class_probs[slots[run]] = predict(class_inputs[run])
+        self._classified = run
+        self._classifier.commit(slots, run, stats)
+        self._count("classifier", reasons)
+        return self.class_probs[slots].copy()
+
+    def screen(self, slots, pred_inputs, critical, screen):
+        """
+        (is_anomaly, screener probability) for every window; screen(inputs) returns
+        (is_anomaly, probability, distance to the decision boundary).
+        """
+        slots = np.asarray(slots)
+        stats = window_stats(np.asarray(pred_inputs).reshape(len(slots), self.pred_seq_len, -1))
+        near = self.screener_margins[slots] < self.margin
+        run, reasons = self._screener.plan(slots, stats, near, self.max_staleness, self.tolerance)
+        # A critical classifier verdict floors the probability at CRITICAL_FLOOR and
+        # forces the anomaly flag, so a screener score well below it cannot matter.
+        overridden = run & critical & self._screener.evaluated[slots] & (reasons != "stale") \
+            & (self.screener_probs[slots] < CRITICAL_FLOOR - self.margin)
+        run = run & ~overridden
+        reasons = np.where(overridden, "critical", reasons)
+        if run.any():
+            is_anomaly, probs, margins = screen(pred_inputs[run])
+            evaluated = slots[run]
+            self.screener_anomaly[evaluated] = is_anomaly
+            self.screener_probs[evaluated] = probs
+            self.screener_margins[evaluated] = margins
+        # Overridden slots keep their old statistics, so drift is still measured
+        # against the window the stored score belongs to.
+        self._screener.commit(slots, run, stats)
+        self._count("screener", reasons)
+        # classify() ran on the same batch just before.
+        self.fresh = self._classified & run
+        return self.screener_anomaly[slots].copy(), self.screener_probs[slots].copy()
+
+_default_options = None
+
+def get_cascade(**options):
+    """
+    Process-wide gate options (max_staleness, tolerance, margin), or None when the
+    cascade is disabled. Options only take effect on the first call.
+    """
+    global _default_options
+    if _default_options is None:
+        options = {name: value for name, value in options.items() if value is not None}
+        options.setdefault("enabled", ENABLED)
+        options.setdefault("max_staleness", MAX_STALENESS)
+        options.setdefault("tolerance", TOLERANCE)
+        options.setdefault("margin", MARGIN)
+        _default_options = options
+    if not _default_options["enabled"]:
+        return None
+    return {name: value for name, value in _default_options.items() if name != "enabled"}
@@ -0,0 +1,115 @@
+# server/ml/check_hot_swap.py
+"""
+Release and rollback sequences of hot_swap.ModelSwapper, runnable offline (exit
+status 1 on any failure). A temporary artifact root and model directory hold
+one-line "model" files, and prepare() just reads them back, so no real model is
+loaded:
+
+  - a release is prepared and applied, and removing its READY marker goes back
+    to the artifact root,
+  - rollback() to a release or to the root sticks until a newer release appears,
+    and that release is then picked up,
+  - a release that only ships a dataset does not touch the device.
+
+    python ml/check_hot_swap.py
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from hot_swap import READY_MARKER, ModelSwapper
+from simulation_loader import ArtifactRegistry
+
+DEVICE = "smartphone"
+FILES = {"class_model": "models/classifier.txt", "class_dataset": "datasets/classifier.txt"}
+
+def _write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+def _prepare(device, registry, current, batch_sizes):
+    with open(registry.path(device, "class_model")) as f:
+        return {"class_model": f.read()}
+
+class Scenario:
+    """A swapper over a scratch root and model directory, plus helpers to publish releases."""
+
+    def __init__(self, directory):
+        self.root = os.path.join(directory, "root")
+        self.models = os.path.join(directory, "models")
+        for key, relative in FILES.items():
+            _write(os.path.join(self.root, relative), f"root {key}")
+        os.makedirs(self.models, exist_ok=True)
+        registry = ArtifactRegistry(root=self.root, files={DEVICE: FILES})
+        self.swapper = ModelSwapper(self.models, _prepare, ["class_model"], registry=registry, log=lambda message: None)
+        self.artifacts = self.swapper.apply({"device": DEVICE, "class_model": "root class_model"})
+
+    def publish(self, release, keys=("class_model",)):
+        for key in keys:
+            _write(os.path.join(self.models, release, FILES[key]), f"{release} {key}")
+        _write(os.path.join(self.models, release, READY_MARKER), "")
+
+    def withdraw(self, release):
+        os.remove(os.path.join(self.models, release, READY_MARKER))
+
+    def tick(self):
+        """One poll plus the switch the engine makes before its next tick; returns the active model."""
+        self.swapper.poll()
+        self.artifacts = self.swapper.apply(self.artifacts)
+        return self.artifacts["class_model"]
+
+def _expect(label, actual, expected):
+    ok = actual == expected
+    print(f"  {label:<52} {actual!r} [{'OK' if ok else f'FAILED, expected {expected!r}'}]")
+    return ok
+
+def check_release_and_withdraw(directory):
+    s = Scenario(directory)
+    s.publish("v1")
+    ok = _expect("v1 published", s.tick(), "v1 class_model")
+    s.withdraw("v1")
+    ok &= _expect("v1 READY removed -> root", s.tick(), "root class_model")
+    return ok
+
+def check_rollback_from_root(directory):
+    s = Scenario(directory)
+    s.publish("v1")
+    s.tick()
+    s.withdraw("v1")
+    s.tick()
+    s.swapper.rollback(DEVICE)
+    ok = _expect("rollback while the root is active -> v1", s.tick(), "v1 class_model")
+    ok &= _expect("pinned: no newer release, stays v1", s.tick(), "v1 class_model")
+    s.publish("v2")
+    ok &= _expect("v2 published -> v2", s.tick(), "v2 class_model")
+    ok &= _expect("status", s.swapper.status()[DEVICE]["active"], "v2")
+    return ok
+
+def check_rollback_to_root(directory):
+    s = Scenario(directory)
+    s.publish("v1")
+    s.tick()
+    s.swapper.rollback(DEVICE)
+    ok = _expect("rollback while v1 is active -> root", s.tick(), "root class_model")
+    ok &= _expect("pinned: v1 still newest, stays root", s.tick(), "root class_model")
+    s.publish("v2")
+    ok &= _expect("v2 published -> v2", s.tick(), "v2 class_model")
+    return ok
+
+def check_dataset_only_release(directory):
+    s = Scenario(directory)
+    s.publish("v1", keys=("class_dataset",))
+    ok = _expect("dataset-only release leaves the root", s.tick(), "root class_model")
+    ok &= _expect("nothing pending", s.swapper.status()[DEVICE]["pending"], None)
+    return ok
+
+if __name__ == "__main__":
+    ok = True
+    for check in (check_release_and_withdraw, check_rollback_from_root, check_rollback_to_root, check_dataset_only_release):
+        print(f"{check.__name__}:")
+        with tempfile.TemporaryDirectory(prefix="prism-hot-swap-") as directory:
+            ok &= check(directory)
+    print("All hot-swap checks passed." if ok else "Hot-swap checks FAILED.")
+    raise SystemExit(0 if ok else 1)
@@ -0,0 +1,129 @@
+# server/ml/check_parity.py
+"""
+Parity checks for the NumPy backends, as one script (exit status 1 on any mismatch):
+
+  - every bundled Keras classifier against numpy_backend (needs TensorFlow),
+  - every bundled screener / diagnostician against tree_ensemble, plus a small
+    fitted IsolationForest (no bundled screener is one),
+  - the same models through a second artifact path: each file is copied over
+    the relative path of another bundled model, keeping that model's basename,
+    folder and mtime, the way a model release (hot_swap.py) shadows the artifact
+    root. The copy and the original must both keep matching their own native
+    model, so an export shared between equally named files is caught.
+
+Exports are written to a fresh temporary directory unless --export-dir is given,
+so stale exports from earlier runs cannot hide a regression.
+
+    python ml/check_parity.py
+"""
+import argparse
+import glob
+import os
+import shutil
+import tempfile
+
+import joblib
+import numpy as np
+from sklearn.ensemble import IsolationForest
+
+import numpy_backend
+import tree_ensemble
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+KERAS_TOLERANCE = 1e-5
+TREE_TOLERANCE = 1e-9
+
+def second_paths(paths, directory):
+    """
+    (original, copy) pairs: the contents of each file placed at the next file's
+    path relative to BASE_DIR under `directory`, with the next file's mtime.
+    """
+    if len(paths) < 2:
+        return []
+    pairs = []
+    for source, shadowed in zip(paths, paths[1:] + paths[:1]):
+        copy = os.path.join(directory, os.path.relpath(shadowed, BASE_DIR))
+        os.makedirs(os.path.dirname(copy), exist_ok=True)
+        shutil.copyfile(source, copy)
+        stat = os.stat(shadowed)
+        os.utime(copy, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        pairs.append((shadowed, copy))
+    return pairs
+
+def _report(label, diff, tolerance):
+    status = "OK" if diff <= tolerance else "MISMATCH"
+    print(f"  {label:<40} max |diff| = {diff:.2e} [{status}]")
+    return diff <= tolerance
+
+def _failed(label, error):
+    # A wrong export can also break the call outright (another model's shape or type).
+    print(f"  {label:<40} {type(error).__name__}: {error} [MISMATCH]")
+    return False
+
+def _check_classifier(path, label, tolerance):
+    try:
+        return _report(label, numpy_backend.check_parity(path), tolerance)
+    except Exception as e:
+        return _failed(label, e)
+
+def check_classifiers(paths, directory, tolerance=KERAS_TOLERANCE):
+    """True if every classifier (and its second-path copy) matches Keras."""
+    try:
+        import tensorflow  # noqa: F401
+    except ImportError:
+        print("Keras classifiers: skipped (TensorFlow is not installed)")
+        return True
+    ok = True
+    print("Keras classifiers vs numpy_backend:")
+    for path in paths:
+        ok &= _check_classifier(path, os.path.relpath(path, BASE_DIR), tolerance)
+    for original, copy in second_paths(paths, directory):
+        # The original first, so its export exists when the copy is loaded, then
+        # again, so a copy that overwrote the export shows up too.
+        for path, label in ((original, "original"), (copy, "second path"), (original, "original again")):
+            ok &= _check_classifier(path, f"{os.path.basename(original)} ({label})", tolerance)
+    return ok
+
+def _check_tree(path, model, label, tolerance):
+    try:
+        compiled = tree_ensemble.load_compiled(path, model) if path else tree_ensemble.compile_model(model)
+        diffs = tree_ensemble.check_parity(model, compiled)
+    except Exception as e:
+        return _failed(label, e)
+    ok = True
+    for method, diff in diffs.items():
+        ok &= _report(f"{label} {method}", diff, tolerance)
+    return ok
+
+def check_trees(paths, directory, tolerance=TREE_TOLERANCE):
+    """True if every tree ensemble (and its second-path copy) matches LightGBM / sklearn."""
+    ok = True
+    print("Tree ensembles vs tree_ensemble:")
+    for path in paths:
+        ok &= _check_tree(path, joblib.load(path), os.path.relpath(path, BASE_DIR), tolerance)
+    rng = np.random.default_rng(0)
+    forest = IsolationForest(n_estimators=50, max_features=0.5, random_state=0).fit(rng.random((512, 40)))
+    ok &= _check_tree(None, forest, "<synthetic IsolationForest>", tolerance)
+    for original, copy in second_paths(paths, directory):
+        name = os.path.relpath(original, BASE_DIR)
+        for path, label in ((original, "original"), (copy, "second path"), (original, "original again")):
+            ok &= _check_tree(path, joblib.load(path), f"{name} ({label})", tolerance)
+    return ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the NumPy backends against Keras, LightGBM and sklearn.")
+    parser.add_argument("--export-dir", help="directory for the exports (default: a fresh temporary one)")
+    parser.add_argument("--skip-classifiers", action="store_true", help="only check the tree ensembles")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="prism-parity-") as scratch:
+        export_dir = args.export_dir or os.path.join(scratch, "exports")
+        numpy_backend.EXPORT_DIR = tree_ensemble.EXPORT_DIR = export_dir
+        classifiers = sorted(glob.glob(os.path.join(BASE_DIR, "classification", "h5", "*.h5")))
+        trees = sorted(glob.glob(os.path.join(BASE_DIR, "prediction", "models", "*", "*.joblib")))
+        ok = True
+        if not args.skip_classifiers:
+            ok &= check_classifiers(classifiers, os.path.join(scratch, "classifiers"))
+        ok &= check_trees(trees, os.path.join(scratch, "trees"))
+    print("All parity checks passed." if ok else "Parity checks FAILED.")
+    raise SystemExit(0 if ok else 1)
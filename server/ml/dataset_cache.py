@@ -0,0 +1,85 @@
+# server/ml/dataset_cache.py
+"""
+On-disk cache of prepared dataset columns.
+
+The first load of a dataset parses the source (JSON/CSV) and materializes the
+columns the engine needs as .npy files; later loads memory-map those files, so
+startup skips parsing entirely and every process shares the same page cache.
+An entry is rebuilt whenever the source file's size or mtime (optionally its
+content hash) or the requested columns change.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+CACHE_DIR = os.environ.get(
+    "PRISM_DATASET_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "datasets")
+)
+# Hashing multi-GB sources on every start defeats the point, so it is opt-in.
+HASH_SOURCES = os.environ.get("PRISM_DATASET_CACHE_HASH", "0") == "1"
+
+def source_signature(source_path, columns, hash_contents=HASH_SOURCES):
+    """Identifies one version of a source file and the columns extracted from it."""
+    stat = os.stat(source_path)
+    signature = {
+        "source": os.path.abspath(source_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "columns": list(columns),
+    }
+    if hash_contents:
+        digest = hashlib.sha1()
+        with open(source_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        signature["sha1"] = digest.hexdigest()
+    return signature
+
+def _entry_paths(name, keys, cache_dir):
+    return {key: os.path.join(cache_dir, f"{name}.{key}.npy") for key in keys}
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def cached_arrays(source_path, name, columns, build, cache_dir=None):
+    """
+    Returns (arrays, meta) for a cache entry, building it on a miss.
+
+    build() must return (arrays, meta) where arrays maps a key to an ndarray and
+    meta is any JSON-serializable extra information (e.g. id labels). On a hit the
+    arrays come back as read-only memory maps.
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    signature = source_signature(source_path, columns)
+    meta_path = os.path.join(cache_dir, f"{name}.json")
+
+    cached = _read_meta(meta_path)
+    if cached is not None and cached.get("signature") == signature:
+        paths = _entry_paths(name, cached["keys"], cache_dir)
+        if all(os.path.exists(path) for path in paths.values()):
+            arrays = {key: np.load(path, mmap_mode="r") for key, path in paths.items()}
+            return arrays, cached.get("meta", {})
+
+    arrays, meta = build()
+    os.makedirs(cache_dir, exist_ok=True)
+    paths = _entry_paths(name, arrays, cache_dir)
+    for key, array in arrays.items():
+        tmp_path = f"{paths[key]}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.ascontiguousarray(array))
+        os.replace(tmp_path, paths[key])
+
+    # The metadata is written last, so a partially written entry is never a hit.
+    tmp_meta_path = f"{meta_path}.{os.getpid()}.tmp"
+    with open(tmp_meta_path, "w") as f:
+        json.dump({"signature": signature, "keys": list(arrays), "meta": meta}, f)
+    os.replace(tmp_meta_path, meta_path)
+
+    return {key: np.load(path, mmap_mode="r") for key, path in paths.items()}, meta
@@ -0,0 +1,107 @@
+# server/ml/dataset_index.py
+"""
+Device-partition and failure-event index of a predictive dataset.
+
+Rows are grouped by physical device (the dataset's device_id / watch_id column):
+`order` lists row numbers device by device, in file order within a device, and
+order[offsets[d]:offsets[d + 1]] is device d's timeline. Failure events are the
+positions on a device's timeline where failure_type turns non-zero; a session
+that starts lead_up rows before one replays the run-up to that failure. The index
+is built once per dataset version and persisted with the dataset cache, so a
+session seeks to "device X, N rows before failure Y" in O(1) instead of scanning
+the dataset, and its windows never mix readings from different devices.
+"""
+import numpy as np
+
+LEAD_UP_ROWS = 300
+INDEX_KEYS = ("order", "offsets", "event_devices", "event_positions", "event_types")
+
+class DatasetIndex:
+    def __init__(self, order, offsets, event_devices, event_positions, event_types, labels):
+        self.order = order
+        self.offsets = offsets
+        self.event_devices = event_devices
+        self.event_positions = event_positions
+        self.event_types = event_types
+        self.labels = list(labels)
+        self.lengths = np.diff(offsets)
+        self._codes = {label: code for code, label in enumerate(self.labels)}
+
+    @classmethod
+    def build(cls, device_codes, failure_type, labels):
+        """Builds the index from per-row device codes (0..len(labels)-1) and failure codes."""
+        device_codes = np.asarray(device_codes)
+        order = np.argsort(device_codes, kind="stable").astype(np.int64)
+        lengths = np.bincount(device_codes, minlength=len(labels))
+        offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+
+        failing = np.asarray(failure_type)[order] != 0
+        first_of_device = np.zeros(len(order), dtype=bool)
+        first_of_device[offsets[:-1][lengths > 0]] = True
+        onset = failing & (first_of_device | ~np.concatenate(([False], failing[:-1])))
+        event_rows = np.flatnonzero(onset)
+        event_devices = device_codes[order[event_rows]].astype(np.int32)
+        return cls(
+            order, offsets, event_devices,
+            (event_rows - offsets[event_devices]).astype(np.int64),
+            np.asarray(failure_type)[order[event_rows]].astype(np.int32),
+            labels
+        )
+
+    def to_arrays(self):
+        return {key: getattr(self, key) for key in INDEX_KEYS}
+
+    @classmethod
+    def from_arrays(cls, arrays, labels):
+        return cls(*(arrays[key] for key in INDEX_KEYS), labels)
+
+    @property
+    def n_devices(self):
+        return len(self.labels)
+
+    @property
+    def n_events(self):
+        return len(self.event_devices)
+
+    def device_code(self, device_id):
+        try:
+            return self._codes[str(device_id)]
+        except KeyError:
+            raise ValueError(f"Unknown device id: {device_id}") from None
+
+    def device_rows(self, code):
+        """Dataset row numbers of one device's timeline."""
+        return self.order[self.offsets[code]:self.offsets[code + 1]]
+
+    def events(self, code=None):
+        """Event numbers, optionally only those of one device."""
+        if code is None:
+            return np.arange(self.n_events)
+        return np.flatnonzero(self.event_devices == code)
+
+    def event_start(self, event, lead_up=LEAD_UP_ROWS):
+        """(device code, timeline position) lead_up rows before an event."""
+        code = int(self.event_devices[event])
+        return code, max(0, int(self.event_positions[event]) - lead_up)
+
+    def seek(self, rng, device_id=None, event=None, lead_up=LEAD_UP_ROWS, min_length=1):
+        """
+        Picks where a session starts: lead_up rows before `event`, or before a random
+        failure event (of `device_id` if given), or a random position of a device
+        with no recorded failures. Only devices with at least min_length rows qualify.
+        """
+        if event is not None:
+            return self.event_start(event, lead_up)
+        code = None if device_id is None else self.device_code(device_id)
+        if code is not None and self.lengths[code] < min_length:
+            raise ValueError(f"Device {device_id} has {self.lengths[code]} rows, fewer than one window ({min_length}).")
+        candidates = self.events(code)
+        candidates = candidates[self.lengths[self.event_devices[candidates]] >= min_length]
+        if candidates.size:
+            return self.event_start(int(rng.choice(candidates)), lead_up)
+        if code is None:
+            eligible = np.flatnonzero(self.lengths >= min_length)
+            if not eligible.size:
+                raise ValueError(f"No device has at least {min_length} rows.")
+            code = int(rng.choice(eligible))
+        return code, int(rng.integers(0, self.lengths[code]))
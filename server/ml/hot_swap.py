@@ -0,0 +1,286 @@
+# server/ml/hot_swap.py
+"""
+Model upgrades without restarting the engine.
+
+A model directory (PRISM_MODEL_DIR or --model-dir) holds one subdirectory per
+release, laid out like the artifact root (see ARTIFACT_FILES in
+simulation_loader.py) but containing only the files the release replaces:
+
+    models/2026-10-17.1/prediction/models/smartphone/prediction_model_lgbm_final.joblib
+    models/2026-10-17.1/READY
+
+Only the model files the engine loads (its MODEL_KEYS: scalers, feature lists
+and models) are taken from a release. Datasets stay those of the artifact root,
+so other files in a release are logged and ignored, and a release with none of
+the device's model files does not touch it.
+
+A release is picked up once its READY marker exists (write it last); releases
+are ordered by name, so use sortable names (dates, zero-padded numbers). The
+ModelSwapper thread polls the directory. For every device served by this
+process whose files the newest release touches, it loads the full model set in
+the background (files the release lacks come from the artifact root), has the
+engine check it against the running set and warm it up, and leaves it pending.
+The engine then switches its sessions over between two ticks with apply().
+
+The previous set stays loaded. Removing the newest release's READY marker, or
+rollback(), switches back to it without loading anything. A release that fails
+to load or to pass the checks is logged and skipped.
+"""
+import gc
+import os
+import re
+import sys
+import threading
+import time
+
+from metrics import METRICS
+from simulation_loader import ArtifactRegistry, get_registry
+
+MODEL_DIR = os.environ.get("PRISM_MODEL_DIR") or None
+POLL_SECONDS = float(os.environ.get("PRISM_MODEL_POLL_SECONDS", 10.0))
+READY_MARKER = "READY"
+LOADER_NICENESS = 10
+# Longest a prepared set may hold back full collections while waiting to be applied.
+MAX_COLLECTION_HOLD_SECONDS = 60.0
+
+SWAPS = METRICS.counter("engine_model_swaps_total", "Model set changes by device and outcome (prepared, rejected, swapped, rolled_back).")
+
+class IncompatibleModels(ValueError):
+    """A model set that cannot replace the running one (features, shapes or a failing warm-up)."""
+
+def _release_order(name):
+    # "v10" sorts after "v9".
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+
+def _stderr(message):
+    print(f"[DEBUG] {message}", file=sys.stderr, flush=True)
+
+class ModelSwapper:
+    """
+    Watches a model directory and prepares new model sets for the devices it has
+    seen in apply(). prepare(device, registry, current, batch_sizes) loads the
+    set from `registry` and returns the artifacts it replaces in `current`, or
+    raises IncompatibleModels. `keys` are the artifact keys a release may replace.
+    """
+
+    def __init__(self, directory, prepare, keys, registry=None, poll_seconds=POLL_SECONDS, log=_stderr):
+        self.directory = directory
+        self.prepare = prepare
+        self.keys = set(keys)
+        self.registry = registry or get_registry()
+        self.poll_seconds = poll_seconds
+        self.log = log
+        self.warm_batch_sizes = {1}
+        self._lock = threading.Lock()
+        self._current = {}   # device -> (release, artifacts); release None is the artifact root
+        self._previous = {}
+        self._pending = {}
+        self._rejected = set()
+        self._pinned = {}    # device -> release a rollback stepped away from
+        self._ignored = set()  # (device, release) whose extra files were already reported
+        self._gc_threshold = None  # saved while full collections are held back
+        self._held_since = None
+        self._loading = False
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="model-swapper", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _run(self):
+        # Loading and warm-up compete with live ticks for CPU; on Linux niceness is
+        # per thread (and inherited by the loader threads this one starts).
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), LOADER_NICENESS)
+        except (AttributeError, OSError):
+            pass
+        while not self._stop.is_set():
+            # Cleared first, so a device watched during a poll triggers another one.
+            self._wake.clear()
+            try:
+                self.poll()
+            except Exception as e:
+                self.log(f"Model directory poll failed: {e}")
+            self._wake.wait(self.poll_seconds)
+
+    def releases(self):
+        """Names of the releases whose READY marker exists, oldest first."""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        ready = [name for name in names if os.path.exists(os.path.join(self.directory, name, READY_MARKER))]
+        return sorted(ready, key=_release_order)
+
+    def _files(self, device, release):
+        """The device's artifact paths in a release, or None if the release replaces none of its models."""
+        files, touched, ignored = {}, False, []
+        for key, relative in self.registry.files[device].items():
+            candidate = os.path.join(self.directory, release, relative)
+            files[key] = os.path.join(self.registry.root, relative)
+            if not os.path.exists(candidate):
+                continue
+            if key in self.keys:
+                files[key], touched = candidate, True
+            else:
+                ignored.append(key)
+        if ignored and (device, release) not in self._ignored:
+            self._ignored.add((device, release))
+            self.log(f"[{device}] Model release {release}: ignoring {', '.join(ignored)} (only model files are swapped).")
+        return files if touched else None
+
+    def _target(self, device, releases):
+        for release in reversed(releases):
+            if self._files(device, release) is not None:
+                return release
+        return None
+
+    def poll(self):
+        """Prepares the newest release of every watched device that is not active or pending yet."""
+        releases = self.releases()
+        with self._lock:
+            devices = list(self._current)
+        for device in devices:
+            target = self._target(device, releases)
+            with self._lock:
+                # The pinned release may be None (the artifact root), so test membership.
+                if device in self._pinned and self._pinned[device] != target:
+                    del self._pinned[device]
+                current_release, current = self._current[device]
+                previous = self._previous.get(device)
+                pending = self._pending.get(device)
+                if device in self._pinned or target == current_release or (pending and pending[0] == target) \
+                        or (device, target) in self._rejected:
+                    continue
+            if previous is not None and previous[0] == target:
+                candidate = previous[1]
+            else:
+                candidate = self._load(device, target, current)
+                if candidate is None:
+                    continue
+            with self._lock:
+                self._pending[device] = (target, candidate)
+            SWAPS.inc(device=device, outcome="prepared")
+            self.log(f"[{device}] Model release {target or 'root'} is ready; switching at the next tick.")
+        if self._held_since is not None and time.monotonic() - self._held_since > MAX_COLLECTION_HOLD_SECONDS:
+            self._release_full_collections(collect=False)
+
+    def _load(self, device, release, current):
+        files = self._files(device, release) if release else {
+            key: self.registry.path(device, key) for key in self.registry.files[device]
+        }
+        self._hold_full_collections()
+        self._loading = True
+        # Absolute paths ignore the registry root.
+        registry = ArtifactRegistry(
+            files={device: files}, max_devices=1, max_workers=1, model_backend=self.registry.model_backend,
+            tree_backend=self.registry.tree_backend
+        )
+        try:
+            models = self.prepare(device, registry, current, sorted(self.warm_batch_sizes))
+        except Exception as e:
+            with self._lock:
+                self._rejected.add((device, release))
+            SWAPS.inc(device=device, outcome="rejected")
+            self.log(f"[{device}] Model release {release or 'root'} rejected: {e}")
+            self._release_full_collections(collect=False)
+            return None
+        finally:
+            self._loading = False
+            registry.close()
+        return dict(current, **models)
+
+    def apply(self, artifacts):
+        """
+        The artifacts a device should be scored with now: `artifacts` itself, or the
+        newest prepared set once one is pending. Call between ticks; the first call
+        for a device starts watching it.
+        """
+        device = artifacts["device"]
+        with self._lock:
+            if device not in self._current:
+                self._current[device] = (None, artifacts)
+                self._wake.set()
+                return artifacts
+            pending = self._pending.pop(device, None)
+            if pending is not None:
+                self._previous[device] = self._current[device]
+                self._current[device] = pending
+            current = self._current[device][1]
+        if pending is not None:
+            if not self._loading:
+                self._release_full_collections(collect=True)
+            SWAPS.inc(device=device, outcome="swapped")
+            self.log(f"[{device}] Switched to model release {pending[0] or 'root'}.")
+        return current
+
+    def _hold_full_collections(self):
+        # Loading a model set allocates enough to make a full (gen-2) collection due,
+        # and that pass over the whole heap (a few hundred ms with TensorFlow loaded)
+        # would run in whichever thread allocates next, usually inside a live tick.
+        with self._lock:
+            if self._gc_threshold is None:
+                self._gc_threshold = gc.get_threshold()
+                self._held_since = time.monotonic()
+                gc.set_threshold(self._gc_threshold[0], self._gc_threshold[1], 2 ** 30)
+
+    def _release_full_collections(self, collect):
+        with self._lock:
+            threshold, self._gc_threshold, self._held_since = self._gc_threshold, None, None
+        if threshold is None:
+            return
+        if collect:
+            # Called between ticks: run the held-back collection now and freeze what
+            # survives, so later full collections skip the loaded models. Unfreezing
+            # first lets the sets dropped by earlier swaps be collected.
+            gc.unfreeze()
+            gc.collect()
+            gc.freeze()
+        gc.set_threshold(*threshold)
+
+    def rollback(self, device):
+        """Queues the previous model set of a device; it stays active until a newer release appears."""
+        with self._lock:
+            previous = self._previous.get(device)
+            if previous is None:
+                return False
+            self._pinned[device] = self._current[device][0]
+            self._pending[device] = previous
+        SWAPS.inc(device=device, outcome="rolled_back")
+        return True
+
+    def status(self):
+        with self._lock:
+            return {
+                device: {
+                    "active": release or "root",
+                    "previous": (self._previous[device][0] or "root") if device in self._previous else None,
+                    "pending": (self._pending[device][0] or "root") if device in self._pending else None,
+                }
+                for device, (release, _) in self._current.items()
+            }
+
+_default_swapper = None
+_configured = False
+
+def get_model_swapper(**options):
+    """
+    Process-wide swapper watching PRISM_MODEL_DIR (or options["directory"]), or None
+    when no model directory is configured. The first call that passes `prepare`
+    configures it (see ModelSwapper); later options are ignored.
+    """
+    global _default_swapper, _configured
+    if not _configured and "prepare" in options:
+        _configured = True
+        directory = options.pop("directory", None) or MODEL_DIR
+        if directory:
+            _default_swapper = ModelSwapper(directory, **options).start()
+    return _default_swapper
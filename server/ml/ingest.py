@@ -0,0 +1,383 @@
+# server/ml/ingest.py
+"""
+Live telemetry ingestion: scores real device readings instead of replaying datasets.
+
+Readings arrive as NDJSON, one per line, on stdin or on a local Unix / TCP socket:
+
+    {"device": "smartphone", "device_id": "sm-0417", "metrics": {"battery_level": 61.2, ...}}
+
+Feature values may also sit at the top level instead of under "metrics"; "device"
+may be omitted when only one device type is loaded. Each reading is validated
+against the device's classification and predictive feature schemas, passed
+through a per-device token bucket and put on a bounded queue; readings that fail
+any of these are dropped and counted in engine_ingest_readings_total by outcome,
+so overload is shed explicitly instead of growing memory or latency. A single
+consumer drains the queue in batches, pushes every reading into its device's two
+sliding windows and scores all windows that are full with one score_batch call
+per device type. Verdicts go to the output writer with the reading's device_id.
+
+    python ml/ingest.py smartphone smartwatch --listen tcp:127.0.0.1:7070 --rate 2
+    producer | python ml/ingest.py smartphone
+"""
+import argparse
+import json
+import math
+import os
+import queue
+import socketserver
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from metrics import METRICS, MetricsExporter
+from output import close_writer, get_writer
+from risk_index import get_risk_index, stream_key
+from simulation_engine import (
+    BACKLOG, CLASSIFICATION_SEQUENCE_LENGTH, PREDICTIVE_FEATURE_CONFIG, PREDICTIVE_SEQUENCE_LENGTHS,
+    TICK_DURATION, emit_packets, load_model_artifacts, log_debug, score_batch
+)
+from simulation_loader import DEVICE_TYPES, get_registry
+from verdict_store import close_verdict_store, get_verdict_store
+from windows import RingWindow
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_MAX_DEVICES = 100000
+STATS_SECONDS = 10.0
+
+READINGS = METRICS.counter(
+    "engine_ingest_readings_total",
+    "Ingested readings by outcome (accepted, invalid, rate_limited, queue_full)."
+)
+INVALID = METRICS.counter("engine_ingest_invalid_total", "Rejected readings by validation failure.")
+EVICTED = METRICS.counter("engine_ingest_evicted_total", "Idle devices whose windows were dropped to stay under max_devices.")
+DEVICES = METRICS.gauge("engine_ingest_devices", "Devices with open ingestion windows.")
+
+class TokenBucket:
+    """Allows `rate` events per second on average, with bursts of up to `burst`."""
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def allow(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+class Reading:
+    __slots__ = ("device", "device_id", "class_row", "pred_row")
+
+    def __init__(self, device, device_id, class_row, pred_row):
+        self.device = device
+        self.device_id = device_id
+        self.class_row = class_row
+        self.pred_row = pred_row
+
+class InvalidReading(ValueError):
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+class DeviceWindows:
+    """The two sliding windows of one physical device."""
+
+    def __init__(self, artifacts):
+        device = artifacts["device"]
+        self.window_class = RingWindow(CLASSIFICATION_SEQUENCE_LENGTH, len(artifacts["features_class"]), artifacts["scaler_class"])
+        self.window_pred = RingWindow(PREDICTIVE_SEQUENCE_LENGTHS[device], len(PREDICTIVE_FEATURE_CONFIG[device]), artifacts["scaler_pred"])
+
+    def push(self, reading):
+        """Adds a reading; returns copies of both model inputs once the windows are full, else None."""
+        self.window_class.push(reading.class_row)
+        self.window_pred.push(reading.pred_row)
+        if self.window_class.full and self.window_pred.full:
+            # The ring buffers are overwritten by the next push, so the inputs are copied.
+            return self.window_class.sequence().copy(), self.window_pred.flat().copy()
+        return None
+
+class Ingestor:
+    """
+    Validates, rate-limits and queues readings (offer / offer_line, safe to call
+    from any number of producer threads) and scores them on one consumer thread
+    (run).
+    """
+
+    def __init__(self, artifacts_by_device, max_queue=DEFAULT_QUEUE_SIZE, rate=None, burst=None,
+                 max_batch=DEFAULT_BATCH_SIZE, max_devices=DEFAULT_MAX_DEVICES, clock=time.monotonic):
+        self.artifacts_by_device = artifacts_by_device
+        self.schemas = {
+            device: (list(artifacts["features_class"]), PREDICTIVE_FEATURE_CONFIG[device])
+            for device, artifacts in artifacts_by_device.items()
+        }
+        self.rate = rate
+        self.burst = burst or max(1.0, rate or 1.0)
+        self.max_batch = max_batch
+        self.max_devices = max_devices
+        self._clock = clock
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._buckets = OrderedDict()
+        self._buckets_lock = threading.Lock()
+        self._windows = OrderedDict()
+        self._logged_reasons = set()
+
+    def validate(self, record):
+        """Turns a decoded reading into a Reading or raises InvalidReading."""
+        if not isinstance(record, dict):
+            raise InvalidReading("malformed", "reading is not a JSON object")
+        device = record.get("device")
+        if device is None and len(self.schemas) == 1:
+            device = next(iter(self.schemas))
+        if device not in self.schemas:
+            raise InvalidReading("unknown_device", f"unknown or unloaded device type: {device}")
+        device_id = record.get("device_id", record.get("watch_id"))
+        if device_id is None or isinstance(device_id, (dict, list)):
+            raise InvalidReading("missing_field", "reading has no device_id")
+        values = record.get("metrics")
+        values = values if isinstance(values, dict) else record
+
+        rows = []
+        for features in self.schemas[device]:
+            row = np.empty(len(features), dtype=np.float64)
+            for k, name in enumerate(features):
+                value = values.get(name)
+                if value is None:
+                    raise InvalidReading("missing_field", f"{device} reading has no '{name}'")
+                # JSON true/false are ints to Python; a reading must not score them as 1.0 / 0.0.
+                if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                    raise InvalidReading("bad_value", f"'{name}' must be a finite number, got {value!r}")
+                row[k] = value
+            rows.append(row)
+        return Reading(device, str(device_id), rows[0], rows[1])
+
+    def _allowed(self, reading):
+        if self.rate is None:
+            return True
+        key = (reading.device, reading.device_id)
+        now = self._clock()
+        with self._buckets_lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, now)
+                if len(self._buckets) > self.max_devices:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket.allow(now)
+
+    def offer(self, record):
+        """Admits one decoded reading; returns the outcome it was counted under."""
+        try:
+            reading = self.validate(record)
+        except InvalidReading as e:
+            INVALID.inc(reason=e.reason)
+            if e.reason not in self._logged_reasons:
+                self._logged_reasons.add(e.reason)
+                log_debug(f"Rejecting invalid readings ({e.reason}), e.g.: {e}")
+            outcome = "invalid"
+        else:
+            if not self._allowed(reading):
+                outcome = "rate_limited"
+            else:
+                try:
+                    self._queue.put_nowait(reading)
+                    outcome = "accepted"
+                except queue.Full:
+                    outcome = "queue_full"
+        READINGS.inc(outcome=outcome)
+        return outcome
+
+    def offer_line(self, line):
+        line = line.strip()
+        if not line:
+            return None
+        try:
+            record = json.loads(line)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            INVALID.inc(reason="malformed")
+            READINGS.inc(outcome="invalid")
+            return "invalid"
+        return self.offer(record)
+
+    def close(self):
+        """Ends run() once every reading queued so far has been scored."""
+        self._queue.put(None)
+
+    def _drain(self):
+        """Blocks for one queue item, then takes whatever else is waiting, up to max_batch."""
+        items = [self._queue.get()]
+        while len(items) < self.max_batch:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _device_windows(self, reading):
+        key = (reading.device, reading.device_id)
+        windows = self._windows.get(key)
+        if windows is None:
+            windows = self._windows[key] = DeviceWindows(self.artifacts_by_device[reading.device])
+            if len(self._windows) > self.max_devices:
+                (device, device_id), _ = self._windows.popitem(last=False)
+                EVICTED.inc()
+                risk_index = get_risk_index()
+                if risk_index is not None:
+                    risk_index.remove(stream_key(device, {"stream": device_id}))
+        else:
+            self._windows.move_to_end(key)
+        return windows
+
+    def process(self, readings):
+        """Pushes readings into their devices' windows and scores every full window; returns the packets."""
+        ready = {}
+        for reading in readings:
+            inputs = self._device_windows(reading).push(reading)
+            if inputs is not None:
+                ready.setdefault(reading.device, []).append((reading.device_id, *inputs))
+        DEVICES.set(len(self._windows))
+        packets = []
+        for device, windows in ready.items():
+            scored = score_batch(
+                self.artifacts_by_device[device],
+                np.concatenate([window[1] for window in windows]),
+                np.concatenate([window[2] for window in windows])
+            )
+            for (device_id, _, _), packet in zip(windows, scored):
+                packet["device"] = device
+                packet["device_id"] = device_id
+                # Keys the output writer's per-stream coalescing by physical device.
+                packet["stream"] = device_id
+                packets.append(packet)
+        return packets
+
+    def run(self):
+        """Consumes the queue until close(); emits verdicts through the output writer."""
+        last_stats = self._clock()
+        while True:
+            items = self._drain()
+            stop = items[-1] is None
+            readings = [item for item in items if item is not None]
+            BACKLOG.set(self._queue.qsize(), queue="ingest")
+            if readings:
+                started = time.monotonic()
+                by_device = {}
+                for packet in self.process(readings):
+                    by_device.setdefault(packet["device"], []).append(packet)
+                for device, packets in by_device.items():
+                    emit_packets(packets, device)
+                    TICK_DURATION.observe(time.monotonic() - started, device=device)
+            now = self._clock()
+            if now - last_stats >= STATS_SECONDS:
+                last_stats = now
+                log_debug(self.summary())
+            if stop:
+                log_debug(self.summary())
+                return
+
+    def summary(self):
+        counts = ", ".join(
+            f"{outcome}={int(READINGS.value(outcome=outcome))}"
+            for outcome in ("accepted", "invalid", "rate_limited", "queue_full")
+        )
+        return f"Ingest: {counts}; {len(self._windows)} devices, {self._queue.qsize()} queued."
+
+def _read_stream(ingestor, lines):
+    for line in lines:
+        ingestor.offer_line(line)
+
+def serve(ingestor, listen):
+    """
+    Starts a threaded line server for `listen` ("unix:/path/to.sock" or
+    "tcp:host:port"); every connection streams NDJSON readings. Returns the server.
+    """
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            _read_stream(ingestor, (raw.decode("utf-8", "replace") for raw in self.rfile))
+
+    scheme, _, address = listen.partition(":")
+    if scheme == "unix":
+        if os.path.exists(address):
+            os.remove(address)
+        server = socketserver.ThreadingUnixStreamServer(address, Handler)
+    elif scheme == "tcp":
+        host, _, port = address.rpartition(":")
+        server = socketserver.ThreadingTCPServer((host or "127.0.0.1", int(port)), Handler)
+    else:
+        raise ValueError(f"Unknown listen address: {listen} (expected unix:PATH or tcp:HOST:PORT)")
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="ingest-server", daemon=True).start()
+    log_debug(f"Listening for readings on {listen}.")
+    return server
+
+def run_ingest(devices=None, listen=None, **options):
+    """
+    Loads the models of `devices` and scores readings from stdin, or from `listen`
+    (then stdin is not read). Options are passed to Ingestor. Returns when stdin
+    closes; with `listen`, runs until interrupted.
+    """
+    artifacts_by_device = {device: load_model_artifacts(device) for device in devices or DEVICE_TYPES}
+    ingestor = Ingestor(artifacts_by_device, **options)
+    get_writer().send({"type": "ready", "devices": sorted(artifacts_by_device), "mode": "ingest"}, control=True)
+    server = None
+    if listen:
+        server = serve(ingestor, listen)
+    else:
+        def read_stdin():
+            _read_stream(ingestor, sys.stdin)
+            ingestor.close()
+        threading.Thread(target=read_stdin, name="ingest-stdin", daemon=True).start()
+    try:
+        ingestor.run()
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+    return ingestor
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score live device readings (NDJSON) instead of replaying datasets.")
+    parser.add_argument("devices", nargs="*", help="device types to load (default: all)")
+    parser.add_argument("--listen", help="unix:PATH or tcp:HOST:PORT to accept readings on (default: stdin)")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE, help="readings waiting to be scored before new ones are shed")
+    parser.add_argument("--rate", type=float, help="max readings per second per device (default: unlimited)")
+    parser.add_argument("--burst", type=float, help="readings a device may send at once above --rate (default: max(1, rate))")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="readings processed per scoring pass")
+    parser.add_argument("--max-devices", type=int, default=DEFAULT_MAX_DEVICES, help="devices whose windows are kept (least recently seen are dropped)")
+    parser.add_argument("--backend", choices=["keras", "numpy"], help="classifier backend")
+    parser.add_argument("--trees", choices=["native", "numpy"], help="screener/diagnostician backend")
+    parser.add_argument("--metrics-file", help="periodically write metrics (Prometheus text format) to this file")
+    parser.add_argument("--metrics-port", type=int, help="serve metrics on http://127.0.0.1:<port>/metrics")
+    parser.add_argument("--metrics-interval", type=float, default=5.0, help="seconds between metrics file writes")
+    parser.add_argument("--verdict-dir", help="append every verdict to a queryable history store in this directory (default: PRISM_VERDICT_DIR)")
+    parser.add_argument("--risk-index", action="store_true", default=None, help="keep a fleet risk index and emit periodic risk reports (default: PRISM_RISK_INDEX)")
+    args = parser.parse_args()
+
+    get_registry(model_backend=args.backend, tree_backend=args.trees)
+    get_risk_index(enabled=args.risk_index)
+    get_verdict_store(directory=args.verdict_dir)
+    exporter = None
+    if args.metrics_file or args.metrics_port is not None:
+        exporter = MetricsExporter(path=args.metrics_file, port=args.metrics_port, interval=args.metrics_interval).start()
+    get_writer()
+    try:
+        run_ingest(
+            args.devices or None, args.listen, max_queue=args.queue_size, rate=args.rate, burst=args.burst,
+            max_batch=args.batch_size, max_devices=args.max_devices
+        )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        close_verdict_store()
+        close_writer()
+        if exporter is not None:
+            # A last write, so the file covers the whole run.
+            exporter.stop()
@@ -0,0 +1,207 @@
+# server/ml/numpy_backend.py
+"""
+TensorFlow-free inference for the Sequential LSTM classifiers.
+
+The Keras .h5 files are plain HDF5: the layer configs and weights are read with
+h5py, exported once to a compact .npz next to the dataset cache, and the forward
+pass runs in NumPy. NumpySequentialModel exposes the same predict() call the
+engine uses on Keras models, so it is a drop-in replacement selected with
+PRISM_CLASSIFIER_BACKEND=numpy (or the engine's --backend numpy).
+
+    python ml/numpy_backend.py --parity    # compare against Keras on random inputs
+    python ml/check_parity.py              # the parity check for both backends (see there)
+"""
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+
+EXPORT_DIR = os.environ.get(
+    "PRISM_MODEL_EXPORT_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "models")
+)
+SUPPORTED_LAYERS = {"InputLayer", "LSTM", "Dense", "Dropout"}
+
+def _sigmoid(x):
+    # exp(-logaddexp(0, -x)) == 1 / (1 + exp(-x)) without overflowing for large negative x.
+    return np.exp(-np.logaddexp(0.0, -x))
+
+def _hard_sigmoid(x):
+    return np.clip(x / 6.0 + 0.5, 0.0, 1.0)
+
+def _softmax(x):
+    e = np.exp(x - x.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+ACTIVATIONS = {
+    "linear": lambda x: x,
+    None: lambda x: x,
+    "relu": lambda x: np.maximum(x, 0.0),
+    "tanh": np.tanh,
+    "sigmoid": _sigmoid,
+    "hard_sigmoid": _hard_sigmoid,
+    "softmax": _softmax,
+}
+
+def _read_h5(h5_path):
+    """Returns (layer specs, {layer name: [weights]}) from a Keras .h5 file."""
+    import h5py
+
+    with h5py.File(h5_path, "r") as f:
+        config = json.loads(f.attrs["model_config"])
+        if config["class_name"] != "Sequential":
+            raise ValueError(f"{h5_path}: only Sequential models are supported, got {config['class_name']}")
+        weights_group = f["model_weights"]
+        weights = {}
+        for layer_name in weights_group.attrs["layer_names"]:
+            layer_name = layer_name.decode() if isinstance(layer_name, bytes) else layer_name
+            layer_group = weights_group[layer_name]
+            names = [n.decode() if isinstance(n, bytes) else n for n in layer_group.attrs["weight_names"]]
+            weights[layer_name] = [np.asarray(layer_group[name], dtype=np.float32) for name in names]
+
+    specs = []
+    for layer in config["config"]["layers"]:
+        class_name, layer_config = layer["class_name"], layer["config"]
+        if class_name not in SUPPORTED_LAYERS:
+            raise ValueError(f"{h5_path}: unsupported layer {class_name}")
+        if class_name == "LSTM" and (layer_config.get("return_sequences") or layer_config.get("go_backwards") or layer_config.get("stateful")):
+            raise ValueError(f"{h5_path}: only plain many-to-one LSTM layers are supported")
+        if class_name in ("InputLayer", "Dropout"):
+            continue
+        specs.append({
+            "type": class_name,
+            "name": layer_config["name"],
+            "activation": layer_config.get("activation"),
+            "recurrent_activation": layer_config.get("recurrent_activation"),
+            "use_bias": layer_config.get("use_bias", True),
+        })
+    return specs, weights
+
+def export_weights(h5_path, npz_path=None):
+    """Exports a Keras .h5 model to a .npz (layer specs + weights) and returns its path."""
+    specs, weights = _read_h5(h5_path)
+    if npz_path is None:
+        npz_path = export_path(h5_path)
+    arrays = {}
+    for index, spec in enumerate(specs):
+        for k, array in enumerate(weights[spec["name"]]):
+            arrays[f"layer{index}_{k}"] = array
+    os.makedirs(os.path.dirname(npz_path) or ".", exist_ok=True)
+    tmp_path = f"{npz_path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, specs=np.array(json.dumps(specs)), **arrays)
+    os.replace(tmp_path, npz_path)
+    return npz_path
+
+class NumpySequentialModel:
+    """Forward pass of an exported LSTM/Dense Sequential model, in float32 NumPy."""
+
+    def __init__(self, specs, layer_weights):
+        self.layers = []
+        for spec, weights in zip(specs, layer_weights):
+            activation = ACTIVATIONS[spec["activation"]]
+            if spec["type"] == "LSTM":
+                kernel, recurrent_kernel = weights[0], weights[1]
+                bias = weights[2] if spec["use_bias"] else np.zeros(kernel.shape[1], dtype=np.float32)
+                self.layers.append(("LSTM", (kernel, recurrent_kernel, bias, activation, ACTIVATIONS[spec["recurrent_activation"]])))
+            else:
+                kernel = weights[0]
+                bias = weights[1] if spec["use_bias"] else np.zeros(kernel.shape[1], dtype=np.float32)
+                self.layers.append(("Dense", (kernel, bias, activation)))
+
+    @classmethod
+    def load(cls, npz_path):
+        with np.load(npz_path) as data:
+            specs = json.loads(str(data["specs"]))
+            layer_weights = []
+            for index in range(len(specs)):
+                layer_weights.append([data[key] for key in sorted(
+                    (key for key in data.files if key.startswith(f"layer{index}_")),
+                    key=lambda key: int(key.rsplit("_", 1)[1])
+                )])
+        return cls(specs, layer_weights)
+
+    @staticmethod
+    def _lstm(x, kernel, recurrent_kernel, bias, activation, recurrent_activation):
+        units = recurrent_kernel.shape[0]
+        batch, steps, _ = x.shape
+        h = np.zeros((batch, units), dtype=np.float32)
+        c = np.zeros((batch, units), dtype=np.float32)
+        # The input projection for every timestep is one matmul; only h @ U is sequential.
+        x_proj = (x.reshape(batch * steps, -1) @ kernel + bias).reshape(batch, steps, -1)
+        for t in range(steps):
+            z = x_proj[:, t] + h @ recurrent_kernel
+            i = recurrent_activation(z[:, :units])
+            f = recurrent_activation(z[:, units:2 * units])
+            g = activation(z[:, 2 * units:3 * units])
+            o = recurrent_activation(z[:, 3 * units:])
+            c = f * c + i * g
+            h = o * activation(c)
+        return h
+
+    def __call__(self, x):
+        out = np.asarray(x, dtype=np.float32)
+        for layer_type, params in self.layers:
+            if layer_type == "LSTM":
+                out = self._lstm(out, *params)
+            else:
+                kernel, bias, activation = params
+                out = activation(out @ kernel + bias)
+        return out
+
+    def predict(self, x, batch_size=None, verbose=0):
+        """Same call shape as keras.Model.predict; the whole input is one batch."""
+        return self(x)
+
+def source_digest(path):
+    """Short hash of a file's contents; names exports so equal basenames (e.g. a model release) never share one."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+def export_path(source_path, suffix=".npz"):
+    """Export file of a model source: its basename plus a content digest, so a changed file gets a new export."""
+    name = os.path.splitext(os.path.basename(source_path))[0]
+    return os.path.join(EXPORT_DIR, f"{name}.{source_digest(source_path)}{suffix}")
+
+def load_numpy_model(h5_path):
+    """Loads the NumPy version of a Keras .h5 model, exporting it first if needed."""
+    npz_path = export_path(h5_path)
+    if not os.path.exists(npz_path):
+        export_weights(h5_path, npz_path)
+    return NumpySequentialModel.load(npz_path)
+
+def check_parity(h5_path, n_samples=256, seed=0):
+    """Returns the max absolute difference between Keras and NumPy outputs on random inputs."""
+    from tensorflow.keras.models import load_model
+
+    keras_model = load_model(h5_path)
+    numpy_model = load_numpy_model(h5_path)
+    input_shape = keras_model.input_shape[1:]
+    inputs = np.random.default_rng(seed).normal(size=(n_samples, *input_shape)).astype(np.float32)
+    expected = keras_model.predict(inputs, verbose=0)
+    return float(np.abs(expected - numpy_model.predict(inputs)).max())
+
+if __name__ == "__main__":
+    import glob
+
+    parser = argparse.ArgumentParser(description="Export Keras classifiers for the NumPy backend.")
+    parser.add_argument("models", nargs="*", help="Keras .h5 files (default: every bundled classifier)")
+    parser.add_argument("--parity", action="store_true", help="also compare outputs against Keras")
+    parser.add_argument("--tolerance", type=float, default=1e-5)
+    args = parser.parse_args()
+
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    models = args.models or sorted(glob.glob(os.path.join(base_dir, "classification", "h5", "*.h5")))
+    failed = False
+    for h5_path in models:
+        print(f"Exported {h5_path} -> {export_weights(h5_path)}")
+        if args.parity:
+            diff = check_parity(h5_path)
+            status = "OK" if diff <= args.tolerance else "MISMATCH"
+            failed = failed or diff > args.tolerance
+            print(f"  parity vs Keras: max |diff| = {diff:.2e} [{status}]")
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,187 @@
+# server/ml/output.py
+"""
+Output layer for engine packets.
+
+Producers hand packets to a PacketWriter and return immediately; a writer thread
+encodes everything that is pending and sends it to stdout in one write. Framing is
+either JSON lines ("lines", the default for humans and shell pipes) or a 4-byte
+big-endian length prefix per frame ("length", used by server.js), and frames can be
+JSON or, with msgpack installed, MessagePack. The queue of data packets is bounded;
+when the consumer lags the overflow policy decides what happens:
+
+    block        producers wait for room (nothing is lost)
+    drop_oldest  the oldest queued packet is discarded
+    latest       only the newest packet per stream is kept
+
+Control messages (ready, errors) are never dropped.
+"""
+import json
+import struct
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+
+from metrics import METRICS
+
+FRAMINGS = ("lines", "length")
+POLICIES = ("block", "drop_oldest", "latest")
+
+FRAMES_WRITTEN = METRICS.counter("engine_output_frames_total", "Frames written to the output stream.")
+WRITES = METRICS.counter("engine_output_writes_total", "Coalesced writes to the output stream.")
+BYTES_WRITTEN = METRICS.counter("engine_output_bytes_total", "Bytes written to the output stream.")
+DROPPED = METRICS.counter("engine_output_dropped_total", "Packets discarded because the consumer lagged.")
+QUEUE_DEPTH = METRICS.gauge("engine_output_queue_depth", "Packets waiting for the output writer.")
+ENCODE_SECONDS = METRICS.histogram("engine_output_encode_seconds", "Time to encode one coalesced write.")
+
+def _encode_json(packet):
+    return json.dumps(packet, separators=(",", ":")).encode()
+
+def _msgpack_encoder():
+    # Optional dependency, only needed for --encoding msgpack.
+    import msgpack
+    return lambda packet: msgpack.packb(packet, use_bin_type=True)
+
+ENCODERS = {"json": lambda: _encode_json, "msgpack": _msgpack_encoder}
+
+class PacketWriter:
+    """
+    Bounded, coalescing packet writer. send() never blocks unless policy="block"
+    and the queue is full; write errors (e.g. a closed pipe) are re-raised from the
+    next send() so producer loops stop the way a failing print() would stop them.
+    """
+
+    def __init__(self, stream=None, framing="lines", encoding="json", policy="block",
+                 max_queue=1024, max_batch=256, linger=0.0):
+        if framing not in FRAMINGS:
+            raise ValueError(f"Unknown framing: {framing}")
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        if encoding not in ENCODERS:
+            raise ValueError(f"Unknown encoding: {encoding}")
+        if framing == "lines" and encoding != "json":
+            raise ValueError("Line framing requires JSON encoding; use framing='length'.")
+        self.stream = stream or sys.stdout.buffer
+        self.framing = framing
+        self.encoding = encoding
+        self.policy = policy
+        self.max_queue = max_queue
+        self.max_batch = max_batch
+        self.linger = linger
+        self._encode = ENCODERS[encoding]()
+        self._control = deque()
+        # latest: stream key -> newest packet, in first-queued order; otherwise a FIFO.
+        self._data = OrderedDict() if policy == "latest" else deque()
+        self._sequence = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="packet-writer", daemon=True)
+        self._thread.start()
+
+    def pending(self):
+        return len(self._control) + len(self._data)
+
+    def send(self, packet, key=None, control=False):
+        """
+        Queues one packet. `key` identifies its stream (used by the latest policy);
+        control packets bypass the bound and are never dropped.
+        """
+        with self._cond:
+            if self._error is not None:
+                raise self._error
+            if self._closed:
+                raise ValueError("PacketWriter is closed")
+            if control:
+                self._control.append(packet)
+            elif self.policy == "latest":
+                if key in self._data:
+                    self._data[key] = packet
+                    DROPPED.inc(policy=self.policy)
+                else:
+                    if len(self._data) >= self.max_queue:
+                        self._data.popitem(last=False)
+                        DROPPED.inc(policy=self.policy)
+                    self._data[key] = packet
+            else:
+                while self.policy == "block" and len(self._data) >= self.max_queue and self._error is None:
+                    self._cond.wait()
+                if self._error is not None:
+                    raise self._error
+                if len(self._data) >= self.max_queue:
+                    self._data.popleft()
+                    DROPPED.inc(policy=self.policy)
+                self._data.append(packet)
+            QUEUE_DEPTH.set(self.pending())
+            self._cond.notify_all()
+
+    def send_many(self, packets, key=None):
+        for packet in packets:
+            self.send(packet, key=key(packet) if callable(key) else key)
+
+    def _take(self):
+        batch = []
+        while self._control and len(batch) < self.max_batch:
+            batch.append(self._control.popleft())
+        while self._data and len(batch) < self.max_batch:
+            batch.append(self._data.popitem(last=False)[1] if self.policy == "latest" else self._data.popleft())
+        QUEUE_DEPTH.set(self.pending())
+        self._cond.notify_all()
+        return batch
+
+    def _frame(self, packet):
+        payload = self._encode(packet)
+        if self.framing == "length":
+            return struct.pack(">I", len(payload)) + payload
+        return payload + b"\n"
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self.pending() and not self._closed:
+                    self._cond.wait()
+                if not self.pending():
+                    return
+            if self.linger:
+                # Give a burst a moment to land so it goes out in one write.
+                time.sleep(self.linger)
+            with self._cond:
+                batch = self._take()
+            try:
+                with ENCODE_SECONDS.time():
+                    payload = b"".join(self._frame(packet) for packet in batch)
+                self.stream.write(payload)
+                self.stream.flush()
+            except (OSError, ValueError, TypeError) as e:
+                with self._cond:
+                    self._error = e
+                    self._data.clear()
+                    self._control.clear()
+                    self._cond.notify_all()
+                return
+            FRAMES_WRITTEN.inc(len(batch))
+            WRITES.inc()
+            BYTES_WRITTEN.inc(len(payload))
+
+    def close(self, timeout=5.0):
+        """Flushes what is queued and stops the writer thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+_default_writer = None
+
+def get_writer(**options):
+    """
+    Process-wide writer for stdout. Options (see PacketWriter) only take effect on
+    the first call, which creates it.
+    """
+    global _default_writer
+    if _default_writer is None:
+        _default_writer = PacketWriter(**options)
+    return _default_writer
+
+def close_writer():
+    if _default_writer is not None:
+        _default_writer.close()
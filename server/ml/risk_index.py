@@ -0,0 +1,261 @@
+# server/ml/risk_index.py
+"""
+Fleet risk index: the latest verdict of every stream, kept ordered so the
+operations questions are cheap to answer at fleet scale.
+
+Every emitted packet updates its stream's entry, keyed by stream_key(): a daemon
+session, a fleet stream or an ingested device id. The index keeps
+  - an indexed max-heap by risk (health style severity, then
+    predictive_probability) for the top-K riskiest streams,
+  - an indexed min-heap by minutes to the predicted failure
+    (first_anomaly_time) for streams predicted to fail within a horizon,
+  - counts of streams per current root cause and per health style.
+An update is O(log n). top(k) is O(k log k), and failing_within() visits only
+the entries it returns plus their direct children, so neither scans the fleet.
+Predicted failure times are the "+N min" of each stream's latest verdict.
+
+The index is off unless PRISM_RISK_INDEX=1 or the engine runs with --risk-index.
+The daemon then answers {"type": "risk"} commands, and every mode emits a "risk"
+control packet every PRISM_RISK_REPORT_SECONDS seconds.
+"""
+import heapq
+import os
+import threading
+
+from metrics import METRICS
+
+ENABLED = os.environ.get("PRISM_RISK_INDEX", "").lower() in ("1", "true", "yes")
+REPORT_SECONDS = float(os.environ.get("PRISM_RISK_REPORT_SECONDS", 10.0))
+TOP_K = 10
+HORIZON_MINUTES = 60
+
+SEVERITY = {"normal": 0, "warning": 1, "critical": 2}
+
+STREAMS = METRICS.gauge("engine_risk_streams", "Streams in the risk index by current health style.")
+ROOT_CAUSES = METRICS.gauge("engine_risk_root_causes", "Streams in the risk index by current root cause.")
+
+def parse_minutes(first_anomaly_time):
+    """Minutes until the predicted failure from a verdict's "+N min", or None."""
+    if not first_anomaly_time:
+        return None
+    try:
+        return int(first_anomaly_time.strip().lstrip("+").split()[0])
+    except (ValueError, IndexError):
+        return None
+
+def stream_key(device, packet):
+    """(device, session, stream): the index key of the stream a packet belongs to."""
+    return device, packet.get("session"), packet.get("stream")
+
+class IndexedHeap:
+    """
+    Binary min-heap of (priority, key) with a key -> position map, so a key's
+    priority can be changed or removed in O(log n).
+    """
+
+    def __init__(self):
+        self._items = []
+        self._positions = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._positions
+
+    def _swap(self, i, j):
+        items = self._items
+        items[i], items[j] = items[j], items[i]
+        self._positions[items[i][1]] = i
+        self._positions[items[j][1]] = j
+
+    def _sift_up(self, i):
+        items = self._items
+        while i > 0:
+            parent = (i - 1) // 2
+            if items[i][0] >= items[parent][0]:
+                break
+            self._swap(i, parent)
+            i = parent
+
+    def _sift_down(self, i):
+        items = self._items
+        n = len(items)
+        while True:
+            smallest = i
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < n and items[child][0] < items[smallest][0]:
+                    smallest = child
+            if smallest == i:
+                return
+            self._swap(i, smallest)
+            i = smallest
+
+    def set(self, key, priority):
+        i = self._positions.get(key)
+        if i is None:
+            self._items.append((priority, key))
+            self._positions[key] = len(self._items) - 1
+            self._sift_up(len(self._items) - 1)
+            return
+        old = self._items[i][0]
+        self._items[i] = (priority, key)
+        if priority < old:
+            self._sift_up(i)
+        elif priority > old:
+            self._sift_down(i)
+
+    def remove(self, key):
+        i = self._positions.pop(key, None)
+        if i is None:
+            return
+        last = self._items.pop()
+        if i < len(self._items):
+            self._items[i] = last
+            self._positions[last[1]] = i
+            self._sift_up(i)
+            self._sift_down(self._positions[last[1]])
+
+    def smallest(self, k):
+        """The k lowest-priority keys in order, via a frontier heap over the tree."""
+        items = self._items
+        result = []
+        frontier = [(items[0][0], 0)] if items else []
+        while frontier and len(result) < k:
+            _, i = heapq.heappop(frontier)
+            result.append(items[i][1])
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(items):
+                    heapq.heappush(frontier, (items[child][0], child))
+        return result
+
+    def at_most(self, bound):
+        """Every key with priority <= bound, skipping subtrees whose root exceeds it."""
+        items = self._items
+        result = []
+        stack = [0] if items else []
+        while stack:
+            i = stack.pop()
+            if items[i][0] > bound:
+                continue
+            result.append((items[i][0], items[i][1]))
+            stack.extend(child for child in (2 * i + 1, 2 * i + 2) if child < len(items))
+        result.sort()
+        return [key for _, key in result]
+
+class RiskIndex:
+    """Latest verdict per stream with risk, failure-time and root-cause indexes. Thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._risk = IndexedHeap()
+        self._failure = IndexedHeap()
+        self._root_causes = {}
+        self._styles = {}
+        self._reported_root_causes = set()
+        self._last_report = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _count(self, counts, name, delta):
+        counts[name] = counts.get(name, 0) + delta
+        if not counts[name]:
+            del counts[name]
+
+    def _forget(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._count(self._styles, entry["current_health_style"], -1)
+        if entry["root_cause"] != "None":
+            self._count(self._root_causes, entry["root_cause"], -1)
+
+    def update(self, key, packet):
+        """Records a stream's newest verdict under key (see stream_key)."""
+        entry = {
+            "device_id": packet.get("device_id"),
+            "current_health_style": packet["current_health_style"],
+            "predictive_probability": float(packet["predictive_probability"]),
+            "root_cause": packet.get("root_cause") or "None",
+            "first_anomaly_time": packet.get("first_anomaly_time"),
+        }
+        minutes = parse_minutes(entry["first_anomaly_time"])
+        with self._lock:
+            self._forget(key)
+            self._entries[key] = entry
+            self._count(self._styles, entry["current_health_style"], 1)
+            if entry["root_cause"] != "None":
+                self._count(self._root_causes, entry["root_cause"], 1)
+            severity = SEVERITY.get(entry["current_health_style"], 0)
+            self._risk.set(key, (-severity, -entry["predictive_probability"]))
+            if minutes is None:
+                self._failure.remove(key)
+            else:
+                self._failure.set(key, minutes)
+
+    def update_many(self, device, packets):
+        for packet in packets:
+            self.update(stream_key(device, packet), packet)
+
+    def remove(self, key):
+        """Drops a stream that stopped (e.g. a daemon session)."""
+        with self._lock:
+            self._forget(key)
+            self._risk.remove(key)
+            self._failure.remove(key)
+
+    def _describe(self, key):
+        device, session, stream = key
+        return {"device": device, "session": session, "stream": stream, **self._entries[key]}
+
+    def top(self, k=TOP_K):
+        """The k riskiest streams: critical before warning before normal, then by probability."""
+        with self._lock:
+            return [self._describe(key) for key in self._risk.smallest(k)]
+
+    def failing_within(self, minutes=HORIZON_MINUTES):
+        """Streams whose latest verdict predicts a failure within `minutes`, soonest first."""
+        with self._lock:
+            return [self._describe(key) for key in self._failure.at_most(minutes)]
+
+    def root_cause_counts(self):
+        with self._lock:
+            return dict(self._root_causes)
+
+    def style_counts(self):
+        with self._lock:
+            return dict(self._styles)
+
+    def report(self, k=TOP_K, horizon=HORIZON_MINUTES):
+        """A "risk" control packet answering all three queries; also refreshes the gauges."""
+        styles, root_causes = self.style_counts(), self.root_cause_counts()
+        for style in SEVERITY:
+            STREAMS.set(styles.get(style, 0), style=style)
+        self._reported_root_causes.update(root_causes)
+        for root_cause in self._reported_root_causes:
+            ROOT_CAUSES.set(root_causes.get(root_cause, 0), root_cause=root_cause)
+        return {
+            "type": "risk", "streams": len(self), "styles": styles, "root_causes": root_causes,
+            "top": self.top(k), "horizon_minutes": horizon, "failing_within": self.failing_within(horizon),
+        }
+
+    def report_due(self, now, interval=REPORT_SECONDS):
+        """True once every `interval` seconds of `now` (a monotonic time), starting with the first call."""
+        if self._last_report is not None and now - self._last_report < interval:
+            return False
+        self._last_report = now
+        return True
+
+_default_index = None
+_enabled = None
+
+def get_risk_index(enabled=None):
+    """Process-wide index, or None when disabled; `enabled` only takes effect on the first call."""
+    global _default_index, _enabled
+    if _enabled is None:
+        _enabled = ENABLED if enabled is None else enabled
+        if _enabled:
+            _default_index = RiskIndex()
+    return _default_index
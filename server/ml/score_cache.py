@@ -0,0 +1,145 @@
+# server/ml/score_cache.py
+"""
+Memoized verdicts for dataset replays.
+
+A window of a device timeline always contains the same rows, so its verdict only
+depends on (device, artifact version, dataset row ending the window). Replays loop
+over the same timelines forever and every viewer of a device walks the same rows,
+so after the first pass nearly every window is a cache hit. Verdicts are kept in
+an in-memory LRU bounded by entry count and, optionally, persisted to a SQLite
+file so they survive restarts and can be shared by several engine processes.
+Cached packets carry everything but the timestamp, which is stamped on the way out.
+"""
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from metrics import METRICS
+
+MAX_ENTRIES = int(os.environ.get("PRISM_SCORE_CACHE_ENTRIES", 100000))
+CACHE_PATH = os.environ.get("PRISM_SCORE_CACHE_PATH") or None
+FLUSH_EVERY = 256
+
+LOOKUPS = METRICS.counter("engine_score_cache_lookups_total", "Score cache lookups by result (memory, disk, miss).")
+ENTRIES = METRICS.gauge("engine_score_cache_entries", "Verdicts held in the in-memory score cache.")
+
+class ScoreCache:
+    """
+    LRU of verdict packets keyed by (device, version, row), with an optional
+    SQLite file behind it. Thread-safe; disk writes are batched.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, path=None):
+        self.max_entries = max_entries
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._unflushed = []
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS scores ("
+                "device TEXT, version TEXT, row INTEGER, packet TEXT, "
+                "PRIMARY KEY (device, version, row))"
+            )
+            self._db.commit()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remember(self, key, packet):
+        self._entries[key] = packet
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_many(self, device, version, rows):
+        """Cached packets for rows (None where missing), without timestamps."""
+        results = [None] * len(rows)
+        missing = []
+        with self._lock:
+            for k, row in enumerate(rows):
+                packet = self._entries.get((device, version, int(row)))
+                if packet is None:
+                    missing.append(k)
+                else:
+                    self._entries.move_to_end((device, version, int(row)))
+                    results[k] = packet
+            LOOKUPS.inc(len(rows) - len(missing), result="memory")
+            if missing and self._db is not None:
+                wanted = {int(rows[k]): k for k in missing}
+                placeholders = ",".join("?" * len(wanted))
+                found = self._db.execute(
+                    f"SELECT row, packet FROM scores WHERE device = ? AND version = ? AND row IN ({placeholders})",
+                    [device, version, *wanted]
+                ).fetchall()
+                for row, payload in found:
+                    packet = json.loads(payload)
+                    results[wanted[row]] = packet
+                    self._remember((device, version, row), packet)
+                LOOKUPS.inc(len(found), result="disk")
+                missing = [k for k in missing if results[k] is None]
+            LOOKUPS.inc(len(missing), result="miss")
+            ENTRIES.set(len(self._entries))
+        return results
+
+    def put_many(self, device, version, rows, packets):
+        """Stores packets (their timestamps are dropped) for rows."""
+        with self._lock:
+            for row, packet in zip(rows, packets):
+                packet = {name: value for name, value in packet.items() if name != "timestamp"}
+                self._remember((device, version, int(row)), packet)
+                if self._db is not None:
+                    self._unflushed.append((device, version, int(row), json.dumps(packet)))
+            ENTRIES.set(len(self._entries))
+            if len(self._unflushed) >= FLUSH_EVERY:
+                self._flush()
+
+    def _flush(self):
+        if self._db is None or not self._unflushed:
+            return
+        self._db.executemany("INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)", self._unflushed)
+        self._db.commit()
+        self._unflushed = []
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def clear(self, device=None):
+        """Forgets the in-memory entries (of one device, or all)."""
+        with self._lock:
+            for key in [key for key in self._entries if device is None or key[0] == device]:
+                del self._entries[key]
+            ENTRIES.set(len(self._entries))
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+_default_cache = None
+
+def get_score_cache(**options):
+    """
+    Process-wide cache, or None when disabled (max_entries=0 and no path). Options
+    (see ScoreCache) only take effect on the first call, which creates it.
+    """
+    global _default_cache
+    if _default_cache is None:
+        options.setdefault("max_entries", MAX_ENTRIES)
+        options.setdefault("path", CACHE_PATH)
+        if not options["max_entries"] and not options["path"]:
+            return None
+        _default_cache = ScoreCache(**options)
+    return _default_cache
+
+def close_score_cache():
+    if _default_cache is not None:
+        _default_cache.close()
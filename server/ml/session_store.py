@@ -0,0 +1,85 @@
+# server/ml/session_store.py
+"""
+Session snapshots for instant resume.
+
+A snapshot (SimulationSession.snapshot()) is a few KB of compressed npz: the
+device, dataset position, chosen start and seed, and the scaled contents of both
+sliding windows. The daemon stores one per resume key every SNAPSHOT_EVERY ticks
+and whenever a session stops, so a client that reconnects with the same key gets
+its next verdict on the first tick and the same device story continues, instead of
+refilling a 56/168/336-row window from a new random start. Snapshots are kept in
+an in-memory LRU and, optionally, as files in a directory so they also survive a
+daemon restart.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from metrics import METRICS
+
+MAX_ENTRIES = int(os.environ.get("PRISM_SNAPSHOT_ENTRIES", 10000))
+SNAPSHOT_DIR = os.environ.get("PRISM_SNAPSHOT_DIR") or None
+SNAPSHOT_EVERY = 20
+
+SNAPSHOTS = METRICS.counter("engine_session_snapshots_total", "Session snapshots by operation (saved, resumed, discarded).")
+
+class SessionStore:
+    """LRU of snapshot bytes by resume key, optionally mirrored to files. Thread-safe."""
+
+    def __init__(self, max_entries=MAX_ENTRIES, directory=None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _path(self, key):
+        # Keys come from clients, so they never become file names directly.
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + ".snapshot")
+
+    def put(self, key, blob):
+        with self._lock:
+            self._entries[key] = blob
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        if self.directory:
+            path = self._path(key)
+            with open(f"{path}.tmp", "wb") as f:
+                f.write(blob)
+            os.replace(f"{path}.tmp", path)
+        SNAPSHOTS.inc(operation="saved")
+
+    def get(self, key):
+        with self._lock:
+            blob = self._entries.get(key)
+            if blob is not None:
+                self._entries.move_to_end(key)
+                return blob
+        if self.directory and os.path.exists(self._path(key)):
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        return None
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.directory and os.path.exists(self._path(key)):
+            os.remove(self._path(key))
+        SNAPSHOTS.inc(operation="discarded")
+
+_default_store = None
+
+def get_session_store(**options):
+    """Process-wide store; options (see SessionStore) only take effect on the first call."""
+    global _default_store
+    if _default_store is None:
+        options.setdefault("max_entries", MAX_ENTRIES)
+        options.setdefault("directory", SNAPSHOT_DIR)
+        _default_store = SessionStore(**options)
+    return _default_store
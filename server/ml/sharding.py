@@ -0,0 +1,245 @@
+# server/ml/sharding.py
+"""
+Process-pool sharding of fleet simulations.
+
+The parent process loads a device's prepared feature matrices and dataset index
+once and copies them into named shared memory; each worker process attaches to
+those segments (no per-worker copy), loads its own models, and runs a
+FleetSimulation over a contiguous shard of the global stream ids. Every tick the parent asks all workers
+to step in parallel and concatenates their packets in shard order, so the merged
+output is ordered by stream exactly like a single-process fleet.
+
+Each worker is limited to --threads-per-worker BLAS/TensorFlow/LightGBM threads
+(and, where supported, pinned to as many CPUs) so N workers never oversubscribe
+the machine:
+
+    python ml/sharding.py smartphone --streams 4096 --workers 32
+"""
+import argparse
+import multiprocessing as mp
+import os
+import time
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from cascade import get_cascade
+from dataset_index import DatasetIndex
+from metrics import METRICS
+from output import close_writer, get_writer
+from risk_index import get_risk_index
+from simulation_engine import (
+    TICK_DURATION, TICK_LAG, TICK_SECONDS, FleetSimulation, attach_score_cache, emit_packets,
+    load_dataset_arrays, load_model_artifacts, log_debug
+)
+from scheduler import TickScheduler, speed_arg
+from simulation_loader import get_registry
+from verdict_store import close_verdict_store, get_verdict_store
+
+# Read by OpenMP/BLAS and TensorFlow when they initialize, so they are set in the
+# environment the workers are spawned with rather than inside the workers.
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "TF_NUM_INTRAOP_THREADS")
+
+SHARD_STEP = METRICS.histogram("engine_shard_step_seconds", "Wall time of one parallel step across all shards.")
+
+class SharedArrays:
+    """Shared-memory copies of a dict of arrays. The creating process owns and unlinks them."""
+
+    def __init__(self, arrays):
+        self.specs = {}
+        self._segments = []
+        for key, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            segment = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+            np.ndarray(array.shape, array.dtype, buffer=segment.buf)[...] = array
+            self._segments.append(segment)
+            self.specs[key] = (segment.name, array.shape, array.dtype.str)
+
+    def close(self):
+        for segment in self._segments:
+            segment.close()
+            segment.unlink()
+        self._segments = []
+
+def attach_arrays(specs):
+    """Maps SharedArrays.specs into this process as read-only arrays; keep the segments alive."""
+    arrays, segments = {}, []
+    for key, (name, shape, dtype) in specs.items():
+        segment = shared_memory.SharedMemory(name=name)
+        segments.append(segment)
+        array = np.ndarray(shape, np.dtype(dtype), buffer=segment.buf)
+        array.flags.writeable = False
+        arrays[key] = array
+    return arrays, segments
+
+@contextmanager
+def _thread_env(threads):
+    previous = {var: os.environ.get(var) for var in THREAD_ENV_VARS + ("TF_NUM_INTEROP_THREADS",)}
+    os.environ.update({var: str(threads) for var in THREAD_ENV_VARS})
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+    try:
+        yield
+    finally:
+        for var, value in previous.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+
+def _limit_model_threads(artifacts, threads):
+    """LightGBM and IsolationForest otherwise use every core on each predict call."""
+    for key in ("screener_model", "why_model", "when_model"):
+        model = artifacts[key]
+        if hasattr(model, "get_params") and "n_jobs" in model.get_params():
+            model.set_params(n_jobs=threads)
+
+def _worker_main(conn, device, specs, device_labels, n_streams, streams, seed, threads, cpus, model_backend, tree_backend, cascade):
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    registry = get_registry(model_backend=model_backend, tree_backend=tree_backend)
+    get_cascade(enabled=cascade is not None, **(cascade or {}))
+    artifacts = load_model_artifacts(device, registry)
+    attach_score_cache(artifacts, registry)
+    _limit_model_threads(artifacts, threads)
+    arrays, segments = attach_arrays(specs)
+    artifacts["class_matrix"] = arrays.pop("class_matrix")
+    artifacts["pred_matrix"] = arrays.pop("pred_matrix")
+    artifacts["index"] = DatasetIndex.from_arrays(arrays, device_labels)
+    fleet = FleetSimulation(artifacts, n_streams, seed=seed, streams=streams)
+    conn.send("ready")
+    try:
+        while conn.recv() == "step":
+            conn.send(fleet.step())
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        for segment in segments:
+            segment.close()
+
+class ShardedFleet:
+    """
+    A FleetSimulation split across worker processes. step() returns the same
+    packets, in the same stream order, as FleetSimulation(artifacts, n_streams,
+    seed).step() would.
+    """
+
+    def __init__(self, device, n_streams=None, workers=None, threads_per_worker=1, seed=None, pin_cpus=True, registry=None):
+        self.device = device
+        self.workers = workers or os.cpu_count()
+        self.threads_per_worker = threads_per_worker
+        # Every shard must draw the same stream offsets, so the seed is fixed up front.
+        self.seed = int(np.random.default_rng().integers(2 ** 31)) if seed is None else seed
+        self.pin_cpus = pin_cpus
+        self.registry = registry or get_registry()
+        self.n_streams = n_streams
+        self._shared = None
+        self._processes = []
+        self._conns = []
+
+    def _cpus(self, index):
+        if not self.pin_cpus or not hasattr(os, "sched_getaffinity"):
+            return None
+        available = sorted(os.sched_getaffinity(0))
+        first = index * self.threads_per_worker
+        return {available[(first + k) % len(available)] for k in range(self.threads_per_worker)}
+
+    def start(self):
+        features_class = self.registry.get(self.device, "class_features")
+        datasets = load_dataset_arrays(self.device, features_class, self.registry)
+        index = datasets["index"]
+        self.n_streams = self.n_streams or index.n_devices
+        self._shared = SharedArrays(dict(
+            index.to_arrays(), class_matrix=datasets["class_matrix"], pred_matrix=datasets["pred_matrix"]
+        ))
+        shards = [shard for shard in np.array_split(np.arange(self.n_streams), self.workers) if shard.size]
+
+        # spawn, not fork: forked copies of an initialized TensorFlow runtime misbehave.
+        context = mp.get_context("spawn")
+        with _thread_env(self.threads_per_worker):
+            for number, shard in enumerate(shards):
+                parent_conn, child_conn = context.Pipe()
+                process = context.Process(
+                    target=_worker_main, name=f"shard-{number}", daemon=True,
+                    args=(child_conn, self.device, self._shared.specs, index.labels, self.n_streams,
+                          shard, self.seed, self.threads_per_worker, self._cpus(number),
+                          self.registry.model_backend, self.registry.tree_backend, get_cascade())
+                )
+                process.start()
+                self._processes.append(process)
+                self._conns.append(parent_conn)
+        for conn in self._conns:
+            conn.recv()
+        log_debug(f"[{self.device}] {len(shards)} shards ready for {self.n_streams} streams.")
+        return self
+
+    def step(self):
+        with SHARD_STEP.time(device=self.device):
+            for conn in self._conns:
+                conn.send("step")
+            packets = []
+            for conn in self._conns:
+                packets.extend(conn.recv())
+        return packets
+
+    def close(self):
+        for conn in self._conns:
+            try:
+                conn.send("stop")
+            except OSError:
+                pass
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._processes, self._conns = [], []
+        if self._shared is not None:
+            self._shared.close()
+            self._shared = None
+
+def run_sharded(device, n_streams=None, workers=None, threads_per_worker=1, seed=None, scheduler=None, pin_cpus=True):
+    scheduler = scheduler or TickScheduler(TICK_SECONDS)
+    fleet = ShardedFleet(device, n_streams, workers, threads_per_worker, seed, pin_cpus).start()
+    try:
+        scheduler.start()
+        while True:
+            tick_start = time.monotonic()
+            packets = fleet.step()
+            if packets:
+                emit_packets(packets, device)
+            elapsed = time.monotonic() - tick_start
+            TICK_DURATION.observe(elapsed, device=device)
+            log_debug(f"Scored {len(packets)} windows across {fleet.workers} workers in {elapsed * 1000:.1f} ms.")
+            TICK_LAG.observe(scheduler.wait(), device=device)
+    finally:
+        fleet.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fleet simulation sharded across worker processes.")
+    parser.add_argument("device", nargs="?", default="smartphone")
+    parser.add_argument("--streams", type=int, help="global stream count (default: one per physical device)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--threads-per-worker", type=int, default=1, help="BLAS/TensorFlow/LightGBM threads per worker")
+    parser.add_argument("--no-pin", action="store_true", help="do not pin workers to CPUs")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--interval", type=float, default=TICK_SECONDS, help="seconds between ticks at real-time speed")
+    parser.add_argument("--speed", type=speed_arg, default=1.0, help="replay speed multiplier")
+    parser.add_argument("--unthrottled", action="store_true", help="step as fast as the shards allow")
+    parser.add_argument("--backend", choices=["keras", "numpy"], help="classifier backend")
+    parser.add_argument("--trees", choices=["native", "numpy"], help="screener/diagnostician backend")
+    parser.add_argument("--verdict-dir", help="append every verdict to a queryable history store in this directory (default: PRISM_VERDICT_DIR)")
+    parser.add_argument("--risk-index", action="store_true", default=None, help="keep a fleet risk index and emit periodic risk reports (default: PRISM_RISK_INDEX)")
+    args = parser.parse_args()
+
+    get_registry(model_backend=args.backend, tree_backend=args.trees)
+    get_risk_index(enabled=args.risk_index)
+    get_verdict_store(directory=args.verdict_dir)
+    get_writer()
+    scheduler = TickScheduler(args.interval, speed=None if args.unthrottled else args.speed)
+    try:
+        run_sharded(args.device, args.streams, args.workers, args.threads_per_worker, args.seed, scheduler, not args.no_pin)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        close_verdict_store()
+        close_writer()
@@ -5,16 +5,34 @@ os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 import logging
 logging.getLogger('tensorflow').setLevel(logging.ERROR)
 
+import io
 import sys
 import time
 import json
+import heapq
+import queue
+import threading
 import pandas as pd
 import numpy as np
-import joblib
-from tensorflow.keras.models import load_model
 from sklearn.ensemble import IsolationForest
 import warnings
-import random
+
+# Shared modules (simulation_loader.py, scheduler.py) live at the repository root.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from simulation_loader import DEVICE_TYPES, get_registry
+from scheduler import TickScheduler, speed_arg
+from cascade import EvaluationGate, get_cascade
+from dataset_cache import cached_arrays
+from dataset_index import DatasetIndex
+from hot_swap import IncompatibleModels, get_model_swapper
+from metrics import METRICS, MetricsExporter
+from risk_index import HORIZON_MINUTES, TOP_K, get_risk_index, stream_key
+from output import FRAMINGS, POLICIES, close_writer, get_writer
+from score_cache import close_score_cache, get_score_cache
+from session_store import SNAPSHOTS, SNAPSHOT_EVERY, get_session_store
+from tree_ensemble import CompiledIsolationForest
+from verdict_store import close_verdict_store, get_verdict_store
+from windows import BatchRingWindow, RingWindow
 
 warnings.filterwarnings("ignore", category=UserWarning)
 
@@ -24,26 +42,8 @@ def log_debug(message):
     print(f"[DEBUG] {message}", file=sys.stderr, flush=True)
 
 # --- CONFIGURATION ---
-CLASSIFICATION_FILES = {
-    "smartphone": {"dataset": "ml/classification/dataset/smartphone_dataset.json", "scaler": "ml/classification/scaler/smartphone_scaler.joblib", "features": "ml/classification/feature/smartphone_features.joblib", "model": "ml/classification/h5/smartphone_classification.h5"},
-    "smartwatch": {"dataset": "ml/classification/dataset/smartwatch_dataset.json", "scaler": "ml/classification/scaler/smartwatch_scaler.joblib", "features": "ml/classification/feature/smartwatch_features.joblib", "model": "ml/classification/h5/smartwatch_classification.h5"},
-    "smartfridge": {"dataset": "ml/classification/dataset/smartfridge_dataset.json", "scaler": "ml/classification/scaler/smartfridge_scaler.joblib", "features": "ml/classification/feature/smartfridge_features.joblib", "model": "ml/classification/h5/smartfridge_classification.h5"}
-}
 CLASSIFICATION_SEQUENCE_LENGTH = 10
 
-PREDICTIVE_FILES = {
-    "smartphone": {"dataset": "ml/prediction/dataset/smartphone_unified_dataset_v2.csv", "scaler": "ml/prediction/scaler/smartphone_multi_task_scaler.joblib", "screener_model": "ml/prediction/models/smartphone/prediction_model_lgbm_final.joblib", "why_model": "ml/prediction/models/smartphone/diagnostician_why_model.joblib", "when_model": "ml/prediction/models/smartphone/diagnostician_when_model.joblib"},
-    # --- THIS SECTION IS THE FIX ---
-    "smartwatch": {
-        "dataset": "ml/prediction/dataset/smartwatch_unified_dataset.csv", 
-        "scaler": "ml/prediction/scaler/smartwatch_multi_task_scaler.joblib", 
-        "screener_model": "ml/prediction/models/smartwatch/prediction_model_lgbm_if.joblib", 
-        # Corrected paths: removed the extra "smartwatch_" prefix
-        "why_model": "ml/prediction/models/smartwatch/diagnostician_why_model.joblib", 
-        "when_model": "ml/prediction/models/smartwatch/diagnostician_when_model.joblib"
-    },
-    "smartfridge": {"dataset": "ml/prediction/dataset/refrigerator_unified_dataset.csv", "scaler": "ml/prediction/scaler/refrigerator_multi_task_scaler.joblib", "screener_model": "ml/prediction/models/smartfridge/refrigerator_screener_model.joblib", "why_model": "ml/prediction/models/smartfridge/refrigerator_diagnostician_why.joblib", "when_model": "ml/prediction/models/smartfridge/refrigerator_diagnostician_when.joblib"}
-}
 PREDICTIVE_FEATURE_CONFIG = {
     "smartphone": ['battery_level', 'cpu_usage_percent', 'memory_usage_percent', 'storage_usage_percent', 'app_crashes', 'network_signal_strength_dbm', 'screen_on_time_minutes', 'fast_charging_active', 'speaker_volume_percent', 'ambient_temp_c'],
     "smartwatch": ['battery_level', 'heart_rate_bpm', 'steps_per_hour', 'gps_active', 'screen_on_time_minutes', 'ambient_temp_c', 'water_pressure_atm', 'fall_detection_events'],
@@ -55,121 +55,794 @@ FAILURE_MAPS = {
     "smartwatch": {1: "Battery Failure", 2: "Heart Rate Sensor Failure", 3: "Water Seal Failure"},
     "smartfridge": {1: "Compressor Failure", 2: "Thermostat Failure", 3: "Seal Failure"}
 }
+TICK_SECONDS = 1.5
+# Upper bounds on what a daemon client may ask for in one reply.
+MAX_RISK_TOP_K = 1000
+MAX_HISTORY_BUCKETS = 10000
+# The models and scalers the engine loads; a model release may replace any of them.
+MODEL_KEYS = [
+    "class_scaler", "class_features", "class_model",
+    "pred_scaler", "screener_model", "why_model", "when_model"
+]
+# Artifacts a verdict depends on; replacing any of them invalidates cached scores.
+VERSION_KEYS = [
+    "class_dataset", "class_scaler", "class_features", "class_model",
+    "pred_dataset", "pred_scaler", "screener_model", "why_model", "when_model"
+]
+
+# --- METRICS ---
+STAGE_SECONDS = METRICS.histogram("engine_stage_seconds", "Wall time of one call of a pipeline stage.")
+TICK_DURATION = METRICS.histogram("engine_tick_seconds", "Wall time to produce one packet (or one fleet batch).")
+TICK_LAG = METRICS.histogram("engine_tick_lag_seconds", "How late a scheduled tick started.")
+WINDOWS_SCORED = METRICS.counter("engine_windows_scored_total", "Windows run through the pipeline.")
+PACKETS_EMITTED = METRICS.counter("engine_packets_emitted_total", "Packets handed to the output writer.")
+ANOMALIES_FIRED = METRICS.counter("engine_anomalies_total", "Windows flagged as anomalous.")
+BACKLOG = METRICS.gauge("engine_backlog", "Pending items per internal queue.")
+ACTIVE_SESSIONS = METRICS.gauge("engine_active_sessions", "Sessions currently served by the daemon.")
 
 def get_status_info(prob):
     if prob < 0.3: return "Normal", "normal"
     if prob < 0.7: return "Warning", "warning"
     return "Critical", "critical"
 
-def run_simulation(device):
-    log_debug(f"Simulation script started for device: {device}")
-    try:
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        
-        class_conf = CLASSIFICATION_FILES[device]
-        pred_conf = PREDICTIVE_FILES[device]
-        failure_map = FAILURE_MAPS[device]
-        
-        log_debug("Loading classification artifacts...")
-        df_class_raw = pd.read_json(os.path.join(base_dir, '..', class_conf["dataset"]))
-        scaler_class = joblib.load(os.path.join(base_dir, '..', class_conf["scaler"]))
-        features_class_list = joblib.load(os.path.join(base_dir, '..', class_conf["features"]))
-        model_class = load_model(os.path.join(base_dir, '..', class_conf["model"]))
-        log_debug("Classification artifacts loaded.")
-
-        log_debug("Loading predictive artifacts...")
-        df_pred_raw = pd.read_csv(os.path.join(base_dir, '..', pred_conf["dataset"]))
-        features_pred_list = PREDICTIVE_FEATURE_CONFIG[device]
-        scaler_pred = joblib.load(os.path.join(base_dir, '..', pred_conf["scaler"]))
-        screener_model = joblib.load(os.path.join(base_dir, '..', pred_conf["screener_model"]))
-        why_model = joblib.load(os.path.join(base_dir, '..', pred_conf["why_model"]))
-        when_model = joblib.load(os.path.join(base_dir, '..', pred_conf["when_model"]))
-        log_debug("Predictive artifacts loaded.")
-        
-        log_debug("Preparing full datasets...")
-        df_metrics_full = pd.json_normalize(df_class_raw["metrics"])
-        df_class_full_prepared = pd.concat([df_class_raw.drop(columns=["metrics", "label", "modelName", "recordId", "deviceId", "deviceType", "timestamp"]), df_metrics_full], axis=1)
-        df_class_features = df_class_full_prepared[features_class_list]
-        df_pred_features = df_pred_raw[features_pred_list]
-
-        log_debug("Searching for a failure event...")
-        device_id_col = 'device_id' if 'device_id' in df_pred_raw.columns else 'watch_id'
-        failure_indices = df_pred_raw.index[df_pred_raw['failure_type'] != 0].tolist()
-        if not failure_indices:
-            start_index = 0
+def _read_classification_dataset(dataset_path, features_class_list):
+    """Parses the classification JSON and returns its feature columns as float32."""
+    df_class_raw = pd.read_json(dataset_path)
+    df_metrics_full = pd.json_normalize(df_class_raw["metrics"])
+    df_class_full_prepared = pd.concat([df_class_raw.drop(columns=["metrics", "label", "modelName", "recordId", "deviceId", "deviceType", "timestamp"]), df_metrics_full], axis=1)
+    return {"features": df_class_full_prepared[features_class_list].to_numpy(dtype=np.float32)}, {}
+
+def _read_predictive_dataset(dataset_path, features_pred_list):
+    """Parses the predictive CSV into float32 features, failure codes and per-row device codes."""
+    df_pred_raw = pd.read_csv(dataset_path)
+    device_id_col = 'device_id' if 'device_id' in df_pred_raw.columns else 'watch_id'
+    if device_id_col in df_pred_raw.columns:
+        device_codes, device_labels = pd.factorize(df_pred_raw[device_id_col], use_na_sentinel=False)
+    else:
+        device_codes, device_labels = np.zeros(len(df_pred_raw), dtype=np.int32), ["0"]
+    arrays = {
+        "features": df_pred_raw[features_pred_list].to_numpy(dtype=np.float32),
+        "failure_type": df_pred_raw['failure_type'].to_numpy(dtype=np.int32),
+        "device_codes": np.asarray(device_codes, dtype=np.int32),
+    }
+    return arrays, {"device_labels": [str(label) for label in device_labels]}
+
+def load_model_artifacts(device, registry=None):
+    """Loads the models and scalers of a device (no datasets)."""
+    registry = registry or get_registry()
+
+    log_debug(f"[{device}] Loading model artifacts...")
+    models = registry.load(device, MODEL_KEYS)
+    log_debug(f"[{device}] Model artifacts loaded.")
+
+    return {
+        "device": device,
+        "features_class": models["class_features"],
+        "scaler_class": models["class_scaler"],
+        "model_class": models["class_model"],
+        "scaler_pred": models["pred_scaler"],
+        "screener_model": models["screener_model"],
+        "why_model": models["why_model"],
+        "when_model": models["when_model"],
+        "failure_map": FAILURE_MAPS[device],
+    }
+
+def prepare_models(device, registry, current, batch_sizes=(1,)):
+    """
+    Loads a device's model set from `registry` to replace the one in the `current`
+    artifacts (see hot_swap.py). The set must use the running classification
+    features and scalers sized for the loaded datasets, and every model is run
+    once per batch size on zero windows, which checks its output shape and pays
+    for lazy initialization (graph tracing, tree compilation) before a live tick
+    does. Raises IncompatibleModels otherwise.
+    """
+    models = load_model_artifacts(device, registry)
+    if list(models["features_class"]) != list(current["features_class"]):
+        raise IncompatibleModels("classification features differ from the running model set")
+    n_class = current["class_matrix"].shape[1]
+    n_pred = current["pred_matrix"].shape[1]
+    for key, n_features in (("scaler_class", n_class), ("scaler_pred", n_pred)):
+        expected = getattr(models[key], "n_features_in_", n_features)
+        if expected != n_features:
+            raise IncompatibleModels(f"{key} expects {expected} features, the dataset has {n_features}")
+
+    for n in batch_sizes:
+        class_inputs = np.zeros((n, CLASSIFICATION_SEQUENCE_LENGTH, n_class), dtype=np.float32)
+        pred_inputs = np.zeros((n, PREDICTIVE_SEQUENCE_LENGTHS[device] * n_pred), dtype=np.float32)
+        try:
+            shapes = {
+                "class_model": (np.shape(models["model_class"].predict(class_inputs, batch_size=n, verbose=0)), (n, 1)),
+                "screener_model": (np.shape(_screen(models["screener_model"], pred_inputs)[1]), (n,)),
+                "why_model": (np.shape(models["why_model"].predict(pred_inputs)), (n,)),
+                "when_model": (np.shape(models["when_model"].predict(pred_inputs)), (n,)),
+            }
+        except Exception as e:
+            raise IncompatibleModels(f"warm-up failed: {e}") from e
+        for key, (shape, expected) in shapes.items():
+            if shape != expected:
+                raise IncompatibleModels(f"{key} returned shape {shape} for {n} windows, expected {expected}")
+
+    models["version"] = registry.version(device, VERSION_KEYS)
+    return models
+
+def refresh_models(simulation):
+    """Moves a session or fleet to a newly prepared model set between ticks, if there is one."""
+    swapper = get_model_swapper()
+    if swapper is None:
+        return
+    artifacts = swapper.apply(simulation.artifacts)
+    if artifacts is not simulation.artifacts:
+        simulation.swap_models(artifacts)
+
+def load_artifacts(device, registry=None):
+    """Loads the models, scalers and prepared datasets needed to simulate a device."""
+    registry = registry or get_registry()
+    artifacts = load_model_artifacts(device, registry)
+    artifacts.update(load_dataset_arrays(device, artifacts["features_class"], registry))
+    attach_score_cache(artifacts, registry)
+    return artifacts
+
+def attach_score_cache(artifacts, registry=None):
+    """Lets score_rows serve this device's windows from the process-wide score cache."""
+    registry = registry or get_registry()
+    artifacts["version"] = registry.version(artifacts["device"], VERSION_KEYS)
+    artifacts["score_cache"] = get_score_cache()
+    return artifacts
+
+def load_dataset_arrays(device, features_class_list, registry=None):
+    """The prepared feature matrices and the device/failure index of a device's datasets."""
+    registry = registry or get_registry()
+    features_pred_list = PREDICTIVE_FEATURE_CONFIG[device]
+
+    log_debug(f"[{device}] Preparing full datasets...")
+    class_path = registry.path(device, "class_dataset")
+    class_arrays, _ = cached_arrays(
+        class_path, f"{device}_classification", features_class_list,
+        lambda: _read_classification_dataset(class_path, features_class_list)
+    )
+    pred_path = registry.path(device, "pred_dataset")
+    pred_arrays, pred_meta = cached_arrays(
+        pred_path, f"{device}_predictive", features_pred_list,
+        lambda: _read_predictive_dataset(pred_path, features_pred_list)
+    )
+    index_arrays, _ = cached_arrays(
+        pred_path, f"{device}_predictive_index", features_pred_list,
+        lambda: (DatasetIndex.build(pred_arrays["device_codes"], pred_arrays["failure_type"], pred_meta["device_labels"]).to_arrays(), {})
+    )
+
+    return {
+        "class_matrix": class_arrays["features"],
+        "pred_matrix": pred_arrays["features"],
+        "index": DatasetIndex.from_arrays(index_arrays, pred_meta["device_labels"]),
+    }
+
+def _screen(screener_model, pred_inputs):
+    """(is_anomaly, screener probability, distance from the decision boundary) per window."""
+    if isinstance(screener_model, (IsolationForest, CompiledIsolationForest)):
+        anomaly_scores = screener_model.decision_function(pred_inputs)
+        return anomaly_scores < 0.0, 1 / (1 + np.maximum(0, anomaly_scores)), np.abs(anomaly_scores)
+    if hasattr(screener_model, 'predict_proba'):
+        screener_probs = screener_model.predict_proba(pred_inputs)[:, 1]
+        return screener_probs > 0.5, screener_probs, np.abs(screener_probs - 0.5)
+    n_windows = len(pred_inputs)
+    return np.zeros(n_windows, dtype=bool), np.zeros(n_windows), np.full(n_windows, np.inf)
+
+def new_gate(artifacts, n_slots):
+    """An EvaluationGate for n_slots streams of this device, or None when the cascade is off."""
+    options = get_cascade()
+    if options is None:
+        return None
+    device = artifacts["device"]
+    return EvaluationGate(n_slots, PREDICTIVE_SEQUENCE_LENGTHS[device], device=device, **options)
+
+def evaluate_batch(artifacts, class_inputs, pred_inputs, gate=None, slots=None):
+    """
+    Runs the full pipeline (classifier -> screener -> diagnosticians) on a batch of
+    already-scaled windows: class_inputs is (N, 10, n_class_features) and pred_inputs
+    is (N, seq_len * n_pred_features). Each model is called once for the whole batch,
+    and the diagnosticians only see the windows flagged as anomalous. With an
+    EvaluationGate, the classifier and screener only run for the windows it selects;
+    `slots` are the gate slots of the windows (default 0..N-1).
+    Returns per-window arrays/lists keyed by stage output; "fresh" marks the
+    windows whose verdict came from running both models rather than the gate.
+    """
+    screener_model = artifacts["screener_model"]
+    model_class = artifacts["model_class"]
+    device = artifacts["device"]
+    n_windows = len(pred_inputs)
+    if gate is not None and slots is None:
+        slots = np.arange(n_windows)
+
+    with STAGE_SECONDS.time(stage="classify", device=device):
+        if gate is None:
+            class_probs = model_class.predict(class_inputs, batch_size=n_windows, verbose=0)[:, 0]
+        else:
+            class_probs = gate.classify(
+                slots, class_inputs, lambda inputs: model_class.predict(inputs, batch_size=len(inputs), verbose=0)[:, 0]
+            )
+
+    statuses = [get_status_info(prob) for prob in class_probs]
+    critical = np.array([style == 'critical' for _, style in statuses], dtype=bool)
+
+    with STAGE_SECONDS.time(stage="screen", device=device):
+        if gate is None:
+            is_anomaly, screener_probs, _ = _screen(screener_model, pred_inputs)
         else:
-            failure_point = random.choice(failure_indices)
-            start_index = max(0, failure_point - 300)
-            log_debug(f"Failure found at index {failure_point}. Starting story at index {start_index}.")
+            is_anomaly, screener_probs = gate.screen(
+                slots, pred_inputs, critical, lambda inputs: _screen(screener_model, inputs)
+            )
+
+    predictive_probs = np.where(critical, np.maximum(screener_probs, 0.85), screener_probs)
+    is_anomaly = is_anomaly | critical
+
+    root_causes = ["None"] * n_windows
+    first_anomaly_times = [None] * n_windows
+    anomalous = np.flatnonzero(is_anomaly)
+    if anomalous.size:
+        with STAGE_SECONDS.time(stage="diagnose", device=device):
+            anomalous_inputs = pred_inputs[anomalous]
+            predicted_codes = artifacts["why_model"].predict(anomalous_inputs)
+            time_hours = artifacts["when_model"].predict(anomalous_inputs)
+        for k, index in enumerate(anomalous):
+            root_causes[index] = artifacts["failure_map"].get(int(predicted_codes[k]), "Unknown Cause")
+            first_anomaly_times[index] = f"+{int(abs(time_hours[k]) * 60)} min"
+
+    WINDOWS_SCORED.inc(n_windows, device=device)
+    ANOMALIES_FIRED.inc(int(anomalous.size), device=device)
+    return {
+        "class_probs": class_probs,
+        "statuses": statuses,
+        "screener_probs": screener_probs,
+        "predictive_probs": predictive_probs,
+        "is_anomaly": is_anomaly,
+        "root_causes": root_causes,
+        "first_anomaly_times": first_anomaly_times,
+        "fresh": np.ones(n_windows, dtype=bool) if gate is None else gate.fresh,
+    }
+
+def _packets(results):
+    statuses = results["statuses"]
+    timestamp = pd.Timestamp.now().strftime('%H:%M:%S')
+    return [
+        {
+            "timestamp": timestamp,
+            "current_health_status": statuses[k][0],
+            "current_health_style": statuses[k][1],
+            "predictive_probability": float(results["predictive_probs"][k]),
+            "is_anomaly_predicted": bool(results["is_anomaly"][k]),
+            "root_cause": str(results["root_causes"][k]),
+            "first_anomaly_time": results["first_anomaly_times"][k]
+        }
+        for k in range(len(statuses))
+    ]
+
+def score_batch(artifacts, class_inputs, pred_inputs, gate=None, slots=None):
+    """Scores a batch of scaled windows and returns one data packet per window."""
+    return _packets(evaluate_batch(artifacts, class_inputs, pred_inputs, gate, slots))
+
+def score_rows(artifacts, rows, class_inputs, pred_inputs, gate=None):
+    """
+    score_batch for windows identified by the dataset row that ends them. Windows
+    found in the artifacts' score cache skip the models; the rest are scored in
+    one batch and cached. With a gate, window k belongs to gate slot k, and
+    verdicts the gate reused instead of scoring are not cached.
+    """
+    cache = artifacts.get("score_cache")
+    if cache is None:
+        return score_batch(artifacts, class_inputs, pred_inputs, gate)
+    device, version = artifacts["device"], artifacts["version"]
+    packets = cache.get_many(device, version, rows)
+    missing = [k for k, packet in enumerate(packets) if packet is None]
+    if missing:
+        results = evaluate_batch(artifacts, class_inputs[missing], pred_inputs[missing], gate, np.asarray(missing))
+        scored = _packets(results)
+        fresh = np.flatnonzero(results["fresh"])
+        cache.put_many(device, version, [rows[missing[k]] for k in fresh], [scored[k] for k in fresh])
+        for k, packet in zip(missing, scored):
+            packets[k] = packet
+    timestamp = pd.Timestamp.now().strftime('%H:%M:%S')
+    return [{"timestamp": timestamp, **packet} for packet in packets]
+
+def score_window(artifacts, input_class, flattened_sequence):
+    """Scores one pair of scaled windows, shaped (1, 10, n) and (1, seq_len * n)."""
+    return score_batch(artifacts, input_class, flattened_sequence)[0]
+
+class SimulationSession:
+    """
+    Replay state of one viewer: the physical device it follows, its position on that
+    device's timeline and its two sliding windows. By default a session starts 300
+    rows before a random failure event; `seed` makes that choice reproducible and
+    `device_id` restricts it to one device. snapshot() / restore() carry a session
+    across reconnects and restarts with its windows still full.
+    """
+
+    def __init__(self, session_id, artifacts, seed=None, device_id=None, start=None):
+        self.session_id = session_id
+        self.artifacts = artifacts
+        self.device = artifacts["device"]
+        self.seed = seed
+        index = artifacts["index"]
+        min_length = max(CLASSIFICATION_SEQUENCE_LENGTH, PREDICTIVE_SEQUENCE_LENGTHS[self.device])
+        if start is None:
+            start = index.seek(np.random.default_rng(seed), device_id, min_length=min_length)
+        self.device_code, self.position = start
+        self.start_position = self.position
+        self.device_id = index.labels[self.device_code]
+        self.rows = index.device_rows(self.device_code)
+        self.row = None  # dataset row that ends the current windows
+        log_debug(f"[{self.device}] Session {session_id} follows device {self.device_id} from row {self.position} of {len(self.rows)}.")
+        self.window_class = RingWindow(CLASSIFICATION_SEQUENCE_LENGTH, artifacts["class_matrix"].shape[1], artifacts["scaler_class"])
+        self.window_pred = RingWindow(PREDICTIVE_SEQUENCE_LENGTHS[self.device], artifacts["pred_matrix"].shape[1], artifacts["scaler_pred"])
+        self.gate = new_gate(artifacts, 1)
+
+    def swap_models(self, artifacts):
+        """Switches to another model set of the same device, keeping the windows full."""
+        self.window_class.rescale(self.artifacts["scaler_class"], artifacts["scaler_class"])
+        self.window_pred.rescale(self.artifacts["scaler_pred"], artifacts["scaler_pred"])
+        self.artifacts = artifacts
+        # Stored cascade scores came from the old models.
+        self.gate = new_gate(artifacts, 1)
+
+    def snapshot(self):
+        """The session's replay state as compact bytes (see restore)."""
+        class_rows, class_count = self.window_class.state()
+        pred_rows, pred_count = self.window_pred.state()
+        meta = {
+            "device": self.device, "version": self.artifacts.get("version"), "device_id": self.device_id,
+            "start_position": self.start_position, "position": self.position,
+            "row": None if self.row is None else int(self.row), "seed": self.seed,
+            "class_count": class_count, "pred_count": pred_count,
+        }
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, meta=np.array(json.dumps(meta)), class_rows=class_rows, pred_rows=pred_rows)
+        return buffer.getvalue()
+
+    @classmethod
+    def restore(cls, session_id, artifacts, blob):
+        """
+        Rebuilds a session from snapshot() bytes. Raises ValueError if the snapshot
+        was taken for another device or with different artifacts.
+        """
+        with np.load(io.BytesIO(blob)) as data:
+            meta = json.loads(str(data["meta"]))
+            class_rows, pred_rows = data["class_rows"], data["pred_rows"]
+        if meta["device"] != artifacts["device"] or meta["version"] != artifacts.get("version"):
+            raise ValueError("Snapshot belongs to another device or artifact version.")
+        code = artifacts["index"].device_code(meta["device_id"])
+        session = cls(session_id, artifacts, seed=meta["seed"], start=(code, meta["start_position"]))
+        session.position = meta["position"]
+        session.row = meta["row"]
+        session.window_class.load_state(class_rows, meta["class_count"])
+        session.window_pred.load_state(pred_rows, meta["pred_count"])
+        return session
+
+    def next_packet(self):
+        """Advances through the dataset until both windows are full and returns the next verdict."""
+        class_input, pred_input = self.next_windows()
+        return score_rows(self.artifacts, [self.row], class_input, pred_input, self.gate)[0]
+
+    def next_windows(self):
+        """Advances to the next full pair of scaled windows, shaped (1, 10, n) and (1, seq_len * n)."""
+        class_matrix = self.artifacts["class_matrix"]
+        pred_matrix = self.artifacts["pred_matrix"]
+        while True:
+            if self.position >= len(self.rows):
+                # Back to the start of the same device; the old windows would span the jump.
+                self.position = 0
+                self.window_class.reset()
+                self.window_pred.reset()
+            i = self.row = self.rows[self.position]
+            self.position += 1
+
+            with STAGE_SECONDS.time(stage="scale", device=self.device):
+                self.window_class.push(class_matrix[i % len(class_matrix)])
+                self.window_pred.push(pred_matrix[i])
+
+            if self.window_class.full and self.window_pred.full:
+                return self.window_class.sequence(), self.window_pred.flat()
 
+class FleetSimulation:
+    """
+    Advances many device streams in lockstep and scores all of their windows with
+    one batched call per model. Each stream replays the rows of a single physical
+    device (a device_id / watch_id partition of the predictive dataset); when there
+    are more streams than devices, partitions are reused from random offsets.
+    `streams` restricts the instance to a subset of the n_streams global stream ids
+    (a shard); those streams behave exactly as they would in the full fleet.
+    """
+
+    def __init__(self, artifacts, n_streams=None, seed=None, streams=None):
+        self.artifacts = artifacts
+        self.device = artifacts["device"]
+        rng = np.random.default_rng(seed)
+
+        index = artifacts["index"]
+        partition_ids = index.labels
+        self._rows_by_partition = index.order
+        self._partition_lengths = index.lengths
+        self._partition_starts = index.offsets[:-1]
+
+        n_partitions = len(partition_ids)
+        total_streams = n_streams or n_partitions
+        all_partitions = np.arange(total_streams) % n_partitions
+        all_positions = np.where(
+            np.arange(total_streams) < n_partitions, 0,
+            rng.integers(0, self._partition_lengths[all_partitions])
+        )
+        self.streams = np.arange(total_streams) if streams is None else np.asarray(streams)
+        self.n_streams = len(self.streams)
+        self.stream_partitions = all_partitions[self.streams]
+        self.stream_device_ids = [partition_ids[p] for p in self.stream_partitions]
+        self._positions = all_positions[self.streams]
+
+        self.window_class = BatchRingWindow(self.n_streams, CLASSIFICATION_SEQUENCE_LENGTH, artifacts["class_matrix"].shape[1], artifacts["scaler_class"])
+        self.window_pred = BatchRingWindow(self.n_streams, PREDICTIVE_SEQUENCE_LENGTHS[self.device], artifacts["pred_matrix"].shape[1], artifacts["scaler_pred"])
+        self.gate = new_gate(artifacts, self.n_streams)
+
+    def swap_models(self, artifacts):
+        """Switches every stream to another model set of the same device, keeping the windows full."""
+        self.window_class.rescale(self.artifacts["scaler_class"], artifacts["scaler_class"])
+        self.window_pred.rescale(self.artifacts["scaler_pred"], artifacts["scaler_pred"])
+        self.artifacts = artifacts
+        self.gate = new_gate(artifacts, self.n_streams)
+
+    def step(self):
+        """Pushes one row into every stream; returns one packet per stream once the windows are full."""
+        lengths = self._partition_lengths[self.stream_partitions]
+        rows = self._rows_by_partition[self._partition_starts[self.stream_partitions] + self._positions % lengths]
+        self._positions += 1
+
+        class_matrix = self.artifacts["class_matrix"]
+        with STAGE_SECONDS.time(stage="scale", device=self.device):
+            self.window_class.push(class_matrix[rows % len(class_matrix)])
+            self.window_pred.push(self.artifacts["pred_matrix"][rows])
+
+        if not (self.window_class.full and self.window_pred.full):
+            return []
+        packets = score_rows(self.artifacts, rows, self.window_class.sequences(), self.window_pred.flat(), self.gate)
+        for k, packet in enumerate(packets):
+            packet["stream"] = int(self.streams[k])
+            packet["device_id"] = self.stream_device_ids[k]
+        return packets
+
+def run_fleet(device, n_streams=None, scheduler=None, seed=None):
+    scheduler = scheduler or TickScheduler(TICK_SECONDS)
+    log_debug(f"Fleet simulation started for device: {device}")
+    try:
+        fleet = FleetSimulation(load_artifacts(device), n_streams, seed=seed)
     except Exception as e:
         log_debug(f"CRITICAL ERROR during setup: {e}")
-        print(json.dumps({"error": f"Failed during setup: {e}"}), flush=True)
+        _emit({"error": f"Failed during setup: {e}"})
         return
+    log_debug(f"Running {fleet.n_streams} streams in lockstep...")
+    swapper = get_model_swapper()
+    if swapper is not None:
+        swapper.warm_batch_sizes.add(fleet.n_streams)
 
-    buffer_class, buffer_pred = [], []
-    seq_len_class, seq_len_pred = CLASSIFICATION_SEQUENCE_LENGTH, PREDICTIVE_SEQUENCE_LENGTHS[device]
+    scheduler.start()
+    while True:
+        refresh_models(fleet)
+        tick_start = time.monotonic()
+        packets = fleet.step()
+        if not packets:
+            continue
+        emit_packets(packets, device)
+        elapsed = time.monotonic() - tick_start
+        TICK_DURATION.observe(elapsed, device=device)
+        log_debug(f"Scored {len(packets)} windows in {elapsed * 1000:.1f} ms" + (f" ({fleet.gate.summary()})." if fleet.gate else "."))
+        TICK_LAG.observe(scheduler.wait(), device=device)
+
+def run_simulation(device, scheduler=None, seed=None, device_id=None):
+    scheduler = scheduler or TickScheduler(TICK_SECONDS)
+    log_debug(f"Simulation script started for device: {device}")
+    try:
+        session = SimulationSession(None, load_artifacts(device), seed=seed, device_id=device_id)
+    except Exception as e:
+        log_debug(f"CRITICAL ERROR during setup: {e}")
+        _emit({"error": f"Failed during setup: {e}"})
+        return
 
     log_debug("Starting main simulation loop...")
+    scheduler.start()
+    while True:
+        refresh_models(session)
+        tick_start = time.monotonic()
+        data_packet = session.next_packet()
+        emit_packets([data_packet], device)
+        TICK_DURATION.observe(time.monotonic() - tick_start, device=device)
+        TICK_LAG.observe(scheduler.wait(), device=device)
+
+# --- DAEMON MODE ---
+# One long-lived process loads every device's artifacts once and multiplexes many
+# sessions over stdin/stdout. Commands arrive as JSON lines on stdin:
+#   {"type": "start", "session": "<id>", "device": "smartphone"[, "seed": 7, "device_id": "...", "resume": "<key>"]}
+#   {"type": "stop", "session": "<id>"}
+#   {"type": "risk"[, "k": 10, "horizon": 60]}   (with --risk-index; see risk_index.py)
+#   {"type": "history", "session": "<id>"[, "device": ..., "key": ..., "start": ..., "end": ..., "buckets": 200]}
+#   {"type": "models"[, "rollback": "<device>"]}   (with --model-dir; see hot_swap.py)
+# and every packet written to stdout carries the "session" it belongs to. Sessions
+# started with a "resume" key are snapshotted under it (see session_store.py), and a
+# later start with the same key and device continues that story with full windows.
+# With --verdict-dir, a session's verdicts are also stored under its resume key (or
+# its id), and "history" returns a stored stream downsampled to `buckets` points;
+# device and key default to those of the requesting session. A command that is
+# invalid or fails is answered with an "error" packet and changes nothing else.
+
+def _open_session(session_id, artifacts, command, resume_key):
+    """A session restored from the resume key's snapshot if there is a usable one, else a new one."""
+    blob = get_session_store().get(resume_key) if resume_key else None
+    if blob is not None:
+        try:
+            session = SimulationSession.restore(session_id, artifacts, blob)
+            SNAPSHOTS.inc(operation="resumed")
+            log_debug(f"Session {session_id} resumed device {session.device_id} at row {session.position}.")
+            return session
+        except ValueError as e:
+            log_debug(f"Session {session_id} cannot resume ({e}); starting fresh.")
+    return SimulationSession(session_id, artifacts, seed=command.get("seed"), device_id=command.get("device_id"))
+
+def _save_snapshot(entry):
+    _, session, resume_key, _, _ = entry
+    if resume_key:
+        get_session_store().put(resume_key, session.snapshot())
+
+def _forget_risk(session):
+    risk_index = get_risk_index()
+    if risk_index is not None:
+        risk_index.remove(stream_key(session.device, {"session": session.session_id}))
+
+def _number(command, name, default=None, integer=False, positive=False, limit=None):
+    """A numeric command field (default when absent); raises ValueError naming the field otherwise."""
+    value = command.get(name, default)
+    if value is None and default is None:
+        return None
+    kind = int if integer else (int, float)
+    if isinstance(value, bool) or not isinstance(value, kind) or (isinstance(value, float) and not np.isfinite(value)) \
+            or (positive and value <= 0) or (limit is not None and value > limit):
+        bounds = f" between 1 and {limit}" if limit is not None else (" above 0" if positive else "")
+        raise ValueError(f'"{name}" must be {"an integer" if integer else "a number"}{bounds}, got {value!r}')
+    return value
+
+def _risk(command):
+    """Reply to a "risk" command: the risk index report for the requested top-K and horizon."""
+    session_id = command.get("session")
+    risk_index = get_risk_index()
+    if risk_index is None:
+        return {"type": "risk", "session": session_id, "error": "Risk index is disabled (start the daemon with --risk-index)."}
+    try:
+        k = _number(command, "k", TOP_K, integer=True, positive=True, limit=MAX_RISK_TOP_K)
+        horizon = _number(command, "horizon", HORIZON_MINUTES, positive=True)
+    except ValueError as e:
+        return {"type": "risk", "session": session_id, "error": str(e)}
+    return risk_index.report(k=k, horizon=horizon)
+
+def _history(command, entry):
+    """Reply to a "history" command: a stored stream downsampled for charting."""
+    session_id = command.get("session")
+    verdict_store = get_verdict_store()
+    if verdict_store is None:
+        return {"type": "history", "session": session_id, "error": "Verdict store is disabled (start the daemon with --verdict-dir)."}
+    try:
+        start, end = _number(command, "start"), _number(command, "end")
+        buckets = _number(command, "buckets", 200, integer=True, positive=True, limit=MAX_HISTORY_BUCKETS)
+    except ValueError as e:
+        return {"type": "history", "session": session_id, "error": str(e)}
+    device = command.get("device") or (entry[1].device if entry else None)
+    key = command.get("key") or (entry[4] if entry else None)
+    points = verdict_store.query(device, key, start, end, buckets)
+    return {"type": "history", "session": session_id, "device": device, "key": key, "points": points}
+
+def _models(command, swapper):
+    """Reply to a "models" command: the active model release per device, after an optional rollback."""
+    session_id = command.get("session")
+    if swapper is None:
+        return {"type": "models", "session": session_id, "error": "Model hot-swap is disabled (start the daemon with --model-dir)."}
+    if command.get("rollback") and not swapper.rollback(command["rollback"]):
+        return {"type": "models", "session": session_id, "error": f"No previous model set for {command['rollback']}."}
+    return {"type": "models", "session": session_id, "devices": swapper.status()}
+
+def _read_commands(command_queue):
+    """Forwards stdin command lines to the scheduler loop; None marks end of input."""
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            command = json.loads(line)
+        except json.JSONDecodeError:
+            command = None
+        if isinstance(command, dict):
+            command_queue.put(command)
+        else:
+            log_debug(f"Ignoring malformed command: {line}")
+    command_queue.put(None)
+
+def _emit(packet):
+    """Control messages (ready, errors) are never dropped by the output writer."""
+    get_writer().send(packet, control=True)
+
+def _stream_key(packet):
+    return packet.get("session"), packet.get("stream")
+
+def emit_packets(packets, device, history_keys=None):
+    """
+    Hands data packets to the output writer, which encodes and writes them off this
+    thread. history_keys overrides the streams the verdict store files them under.
+    """
+    get_writer().send_many(packets, key=_stream_key)
+    PACKETS_EMITTED.inc(len(packets), device=device)
+    verdict_store = get_verdict_store()
+    if verdict_store is not None:
+        verdict_store.append(device, packets, history_keys)
+    risk_index = get_risk_index()
+    if risk_index is not None:
+        risk_index.update_many(device, packets)
+        if risk_index.report_due(time.monotonic()):
+            _emit(risk_index.report())
+
+def run_daemon(devices=None, scheduler=None):
+    scheduler = scheduler or TickScheduler(TICK_SECONDS)
+    devices = devices or DEVICE_TYPES
+    log_debug(f"Simulation daemon starting for devices: {', '.join(devices)}")
+    artifacts_by_device = {}
+    for device in devices:
+        try:
+            artifacts_by_device[device] = load_artifacts(device)
+        except Exception as e:
+            log_debug(f"CRITICAL ERROR loading {device}: {e}")
+    swapper = get_model_swapper()
+    if swapper is not None:
+        # Starts watching the model directory for every served device.
+        for artifacts in artifacts_by_device.values():
+            swapper.apply(artifacts)
+    _emit({"type": "ready", "devices": sorted(artifacts_by_device)})
+
+    command_queue = queue.Queue()
+    threading.Thread(target=_read_commands, args=(command_queue,), daemon=True).start()
+
+    sessions = {}
+    # (due time, generation, session id); stale entries from restarted sessions are skipped
+    schedule = []
+    generation = 0
     while True:
-        for i in range(start_index, len(df_pred_features)):
-            class_index = i % len(df_class_features)
-            
-            row_class = df_class_features.iloc[class_index]
-            row_pred = df_pred_features.iloc[i]
-
-            buffer_class.append(row_class.values)
-            buffer_pred.append(row_pred.values)
-
-            if len(buffer_class) > seq_len_class: buffer_class.pop(0)
-            if len(buffer_pred) > seq_len_pred: buffer_pred.pop(0)
-
-            if len(buffer_class) == seq_len_class and len(buffer_pred) == seq_len_pred:
-                scaled_class = scaler_class.transform(buffer_class)
-                input_class = np.array(scaled_class).reshape(1, seq_len_class, -1)
-                class_prob = model_class.predict(input_class, verbose=0)[0][0]
-                current_health_status, current_health_style = get_status_info(class_prob)
-                
-                scaled_pred = scaler_pred.transform(buffer_pred)
-                flattened_sequence = scaled_pred.reshape(1, -1)
-                
-                is_anomaly, predictive_prob = False, 0.0
-                
-                if isinstance(screener_model, IsolationForest):
-                    anomaly_score = screener_model.decision_function(flattened_sequence)[0]
-                    is_anomaly = anomaly_score < 0.0
-                    predictive_prob = 1 / (1 + max(0, anomaly_score))
-                elif hasattr(screener_model, 'predict_proba'):
-                    predictive_prob = screener_model.predict_proba(flattened_sequence)[0][1]
-                    is_anomaly = predictive_prob > 0.5
-                
-                if current_health_style == 'critical':
-                    predictive_prob = max(predictive_prob, 0.85)
-                    is_anomaly = True
-
-                root_cause, first_anomaly_time = "None", None
-                if is_anomaly:
-                    predicted_code = why_model.predict(flattened_sequence)[0]
-                    root_cause = failure_map.get(int(predicted_code), "Unknown Cause")
-                    time_hours = when_model.predict(flattened_sequence)[0]
-                    first_anomaly_time = f"+{int(abs(time_hours) * 60)} min"
-
-                data_packet = {
-                    "timestamp": pd.Timestamp.now().strftime('%H:%M:%S'),
-                    "current_health_status": current_health_status,
-                    "current_health_style": current_health_style,
-                    "predictive_probability": float(predictive_prob),
-                    "is_anomaly_predicted": bool(is_anomaly),
-                    "root_cause": str(root_cause),
-                    "first_anomaly_time": first_anomaly_time
-                }
-                
-                print(json.dumps(data_packet), flush=True)
-                time.sleep(1.5)
-        
-        start_index = 0
-                
+        timeout = max(0.0, schedule[0][0] - time.monotonic()) if schedule else None
+        try:
+            command = command_queue.get(timeout=timeout)
+        except queue.Empty:
+            command = False
+
+        if command is None:
+            log_debug("stdin closed, shutting down daemon.")
+            for entry in sessions.values():
+                _save_snapshot(entry)
+            return
+        if command:
+            session_id = command.get("session")
+            # One bad command must not end the loop every other session depends on.
+            try:
+                if command.get("type") == "start":
+                    device = command.get("device")
+                    if device not in artifacts_by_device:
+                        _emit({"session": session_id, "error": f"Unknown or unavailable device: {device}"})
+                        continue
+                    resume_key = f"{command['resume']}:{device}" if command.get("resume") else None
+                    if swapper is not None:
+                        artifacts_by_device[device] = swapper.apply(artifacts_by_device[device])
+                    try:
+                        session = _open_session(session_id, artifacts_by_device[device], command, resume_key)
+                    except ValueError as e:
+                        _emit({"session": session_id, "error": str(e)})
+                        continue
+                    generation += 1
+                    # (generation, session, resume key, ticks since start, verdict history key)
+                    sessions[session_id] = [generation, session, resume_key, 0, command.get("resume") or session_id]
+                    heapq.heappush(schedule, (time.monotonic(), generation, session_id))
+                    log_debug(f"Session {session_id} started for {device} ({len(sessions)} active).")
+                elif command.get("type") == "stop":
+                    entry = sessions.pop(session_id, None)
+                    if entry is not None:
+                        _save_snapshot(entry)
+                        _forget_risk(entry[1])
+                        log_debug(f"Session {session_id} stopped ({len(sessions)} active).")
+                elif command.get("type") == "risk":
+                    _emit(_risk(command))
+                elif command.get("type") == "history":
+                    _emit(_history(command, sessions.get(session_id)))
+                elif command.get("type") == "models":
+                    _emit(_models(command, swapper))
+            except Exception as e:
+                log_debug(f"Command {command.get('type')!r} failed: {e}")
+                _emit({"type": command.get("type"), "session": session_id, "error": f"Command failed: {e}"})
+            continue
+
+        now = time.monotonic()
+        BACKLOG.set(sum(1 for entry in schedule if entry[0] <= now), queue="due_ticks")
+        BACKLOG.set(command_queue.qsize(), queue="commands")
+        ACTIVE_SESSIONS.set(len(sessions))
+        while schedule and schedule[0][0] <= now:
+            due, session_generation, session_id = heapq.heappop(schedule)
+            entry = sessions.get(session_id)
+            if entry is None or entry[0] != session_generation:
+                continue
+            session = entry[1]
+            TICK_LAG.observe(max(0.0, time.monotonic() - due), device=session.device)
+            try:
+                refresh_models(session)
+                tick_start = time.monotonic()
+                data_packet = session.next_packet()
+            except Exception as e:
+                log_debug(f"Session {session_id} failed: {e}")
+                _emit({"session": session_id, "error": f"Simulation failed: {e}"})
+                sessions.pop(session_id, None)
+                _forget_risk(session)
+                continue
+            data_packet["session"] = session_id
+            emit_packets([data_packet], session.device, [entry[4]])
+            entry[3] += 1
+            if entry[3] % SNAPSHOT_EVERY == 0:
+                _save_snapshot(entry)
+            TICK_DURATION.observe(time.monotonic() - tick_start, device=session.device)
+            heapq.heappush(schedule, (scheduler.next_deadline(due), session_generation, session_id))
+
 if __name__ == "__main__":
-    device_arg = sys.argv[1] if len(sys.argv) > 1 else "smartphone"
-    run_simulation(device_arg)
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Stream simulated device verdicts as JSON lines.")
+    parser.add_argument("target", nargs="*", help="device (single mode), devices (--daemon) or device and stream count (--fleet)")
+    parser.add_argument("--daemon", action="store_true", help="serve many sessions over stdin/stdout")
+    parser.add_argument("--fleet", action="store_true", help="score many device streams per batched call")
+    parser.add_argument("--backend", choices=["keras", "numpy"], help="classifier backend (default: PRISM_CLASSIFIER_BACKEND or keras)")
+    parser.add_argument("--trees", choices=["native", "numpy"], help="screener/diagnostician backend (default: PRISM_TREE_BACKEND or native)")
+    parser.add_argument("--seed", type=int, help="makes the replayed devices and start points reproducible")
+    parser.add_argument("--device-id", help="single mode: replay this physical device (device_id / watch_id)")
+    parser.add_argument("--interval", type=float, default=TICK_SECONDS, help="seconds between packets at real-time speed")
+    parser.add_argument("--speed", type=speed_arg, default=1.0, help="replay speed multiplier (e.g. 60 for one hour per minute)")
+    parser.add_argument("--unthrottled", action="store_true", help="emit packets as fast as they can be computed")
+    parser.add_argument("--framing", choices=FRAMINGS, default="lines", help="JSON lines or 4-byte length-prefixed frames")
+    parser.add_argument("--encoding", choices=["json", "msgpack"], default="json", help="frame encoding (msgpack requires --framing length)")
+    parser.add_argument("--output-policy", choices=POLICIES, default="block", help="what to do when the consumer falls behind")
+    parser.add_argument("--output-queue", type=int, default=1024, help="max data packets waiting to be written")
+    parser.add_argument("--score-cache-entries", type=int, help="verdicts kept in memory (0 disables; default PRISM_SCORE_CACHE_ENTRIES or 100000)")
+    parser.add_argument("--score-cache-path", help="SQLite file that persists cached verdicts across runs")
+    parser.add_argument("--cascade", action="store_true", default=None, help="skip the classifier/screener on windows that have not changed (default: PRISM_CASCADE)")
+    parser.add_argument("--max-staleness", type=int, help="cascade: re-run a skipped model after this many ticks")
+    parser.add_argument("--drift-tolerance", type=float, help="cascade: re-run once a window statistic moves this far (scaled units)")
+    parser.add_argument("--threshold-margin", type=float, help="cascade: always re-run scores this close to a decision threshold")
+    parser.add_argument("--risk-index", action="store_true", default=None, help="keep a fleet risk index and emit periodic risk reports (default: PRISM_RISK_INDEX)")
+    parser.add_argument("--verdict-dir", help="append every verdict to a queryable history store in this directory (default: PRISM_VERDICT_DIR)")
+    parser.add_argument("--model-dir", help="watch this directory for model releases and switch to them without restarting (default: PRISM_MODEL_DIR)")
+    parser.add_argument("--snapshot-dir", help="daemon: keep session snapshots in this directory so resumes survive restarts")
+    parser.add_argument("--metrics-file", help="periodically write metrics (Prometheus text format) to this file")
+    parser.add_argument("--metrics-port", type=int, help="serve metrics on http://127.0.0.1:<port>/metrics")
+    parser.add_argument("--metrics-interval", type=float, default=5.0, help="seconds between metrics file writes")
+    args = parser.parse_args()
 
+    get_registry(model_backend=args.backend, tree_backend=args.trees)
+    exporter = None
+    if args.metrics_file or args.metrics_port is not None:
+        exporter = MetricsExporter(path=args.metrics_file, port=args.metrics_port, interval=args.metrics_interval).start()
+    cache_options = {"max_entries": args.score_cache_entries, "path": args.score_cache_path}
+    get_score_cache(**{name: value for name, value in cache_options.items() if value is not None})
+    get_cascade(enabled=args.cascade, max_staleness=args.max_staleness, tolerance=args.drift_tolerance, margin=args.threshold_margin)
+    get_risk_index(enabled=args.risk_index)
+    get_verdict_store(directory=args.verdict_dir)
+    get_model_swapper(directory=args.model_dir, prepare=prepare_models, keys=MODEL_KEYS, log=log_debug)
+    if args.snapshot_dir:
+        get_session_store(directory=args.snapshot_dir)
+    get_writer(framing=args.framing, encoding=args.encoding, policy=args.output_policy, max_queue=args.output_queue)
+    scheduler = TickScheduler(args.interval, speed=None if args.unthrottled else args.speed)
+    try:
+        if args.daemon:
+            run_daemon(args.target or None, scheduler)
+        elif args.fleet:
+            device_arg = args.target[0] if args.target else "smartphone"
+            run_fleet(device_arg, int(args.target[1]) if len(args.target) > 1 else None, scheduler, args.seed)
+        else:
+            run_simulation(args.target[0] if args.target else "smartphone", scheduler, args.seed, args.device_id)
+    finally:
+        close_score_cache()
+        close_verdict_store()
+        close_writer()
+        if exporter is not None:
+            # A last write, so the file covers the whole run.
+            exporter.stop()
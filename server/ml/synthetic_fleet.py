@@ -0,0 +1,77 @@
+# server/ml/synthetic_fleet.py
+"""
+Synthetic telemetry for benchmarks and load tests.
+
+Fabricates N-device fleets from the feature schemas in PREDICTIVE_FEATURE_CONFIG:
+each device is a bounded random walk inside the value range its scaler was fitted
+on (MinMaxScaler data_min_/data_max_, StandardScaler mean_ +/- 3 std), binary
+features are Bernoulli flags, and a fraction of devices drift toward one end of
+their range before a labelled failure. No dataset files are needed.
+"""
+import numpy as np
+from sklearn.preprocessing import MinMaxScaler, StandardScaler
+
+from dataset_index import DatasetIndex
+
+def feature_ranges(scaler, n_features):
+    """(low, high) value ranges per feature, taken from a fitted scaler."""
+    if isinstance(scaler, MinMaxScaler):
+        return np.asarray(scaler.data_min_, dtype=np.float64), np.asarray(scaler.data_max_, dtype=np.float64)
+    if isinstance(scaler, StandardScaler):
+        mean = np.asarray(scaler.mean_, dtype=np.float64)
+        std = np.asarray(scaler.scale_, dtype=np.float64)
+        return mean - 3 * std, mean + 3 * std
+    return np.zeros(n_features), np.ones(n_features)
+
+def generate_matrix(scaler, n_features, n_devices, rows_per_device, failure_fraction=0.1, seed=None):
+    """
+    Returns (matrix, device_codes, failure_type): float32 rows grouped by device,
+    the device index of every row, and a non-zero failure code on the last row of
+    each failing device.
+    """
+    rng = np.random.default_rng(seed)
+    low, high = feature_ranges(scaler, n_features)
+    span = np.where(high > low, high - low, 1.0)
+    binary = (low == 0) & (high == 1)
+
+    start = low + rng.random((n_devices, n_features)) * span
+    steps = rng.normal(scale=0.02, size=(n_devices, rows_per_device, n_features)) * span
+    walk = start[:, np.newaxis] + np.cumsum(steps, axis=1)
+
+    failure_type = np.zeros((n_devices, rows_per_device), dtype=np.int32)
+    failing = np.flatnonzero(rng.random(n_devices) < failure_fraction)
+    if failing.size and rows_per_device > 1:
+        drift = np.linspace(0.0, 1.0, rows_per_device)[:, np.newaxis] * span * 0.5
+        walk[failing] += drift * rng.choice([-1.0, 1.0], size=(failing.size, 1, n_features))
+        failure_type[failing, -1] = rng.integers(1, 4, size=failing.size)
+
+    walk = np.clip(walk, low, high)
+    walk[..., binary] = rng.random((n_devices, rows_per_device, int(binary.sum()))) < 0.3
+    matrix = walk.reshape(n_devices * rows_per_device, n_features).astype(np.float32)
+    device_codes = np.repeat(np.arange(n_devices, dtype=np.int32), rows_per_device)
+    return matrix, device_codes, failure_type.reshape(-1)
+
+def synthetic_artifacts(artifacts, n_devices, rows_per_device, seed=None):
+    """
+    Copy of a loaded artifacts dict (see simulation_engine.load_artifacts) whose
+    dataset matrices are replaced by a synthetic fleet, so FleetSimulation,
+    replay_dataset and friends run unchanged on fabricated telemetry.
+    """
+    pred_matrix, device_codes, failure_type = generate_matrix(
+        artifacts["scaler_pred"], artifacts["scaler_pred"].n_features_in_,
+        n_devices, rows_per_device, seed=seed
+    )
+    class_matrix, _, _ = generate_matrix(
+        artifacts["scaler_class"], artifacts["scaler_class"].n_features_in_,
+        n_devices, rows_per_device, failure_fraction=0.0, seed=None if seed is None else seed + 1
+    )
+    labels = [f"synthetic-{artifacts['device']}-{k}" for k in range(n_devices)]
+    synthetic = dict(artifacts)
+    # Synthetic windows must never be served from (or stored in) the real score cache.
+    synthetic.pop("score_cache", None)
+    synthetic.update({
+        "class_matrix": class_matrix,
+        "pred_matrix": pred_matrix,
+        "index": DatasetIndex.build(device_codes, failure_type, labels),
+    })
+    return synthetic
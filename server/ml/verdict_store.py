@@ -0,0 +1,411 @@
+# server/ml/verdict_store.py
+"""
+Append-only verdict history: every emitted packet is recorded so dashboards can
+backfill charts and history survives restarts without replaying the pipeline.
+
+Layout of the store directory:
+  streams.jsonl        one [device, key] line per stream; the line number is its id
+  labels.json          root-cause names by code
+  raw-<start>.log      the active segment: packed RAW records in arrival order
+  raw-<start>.npy      a sealed segment: the same records sorted by (stream, time)
+  rollup-<day>.npy     a compacted day: ROLLUP records (per-stream buckets)
+  *.idx.npy            per-stream (offset, count, first, last) index of a segment
+  writer.lock          held (flock) by the one process appending to the store
+
+The active segment is sealed every segment_seconds. Sealed raw segments older
+than raw_retention are compacted into one rollup segment per UTC day, with
+count/min/max/sum of predictive_probability per rollup_seconds bucket. Segment
+indexes are loaded once, and the segments themselves are memory-mapped, so a
+query only reads the rows of the stream it asks for. A 30-day chart at the
+default 5-minute rollup is about 8640 records (roughly 300 KB) of one stream.
+
+A stream's key is the packet's session, else its stream (fleet stream number or
+ingested device id); the daemon keys sessions by the client's resume id so a
+reconnecting client finds its history. The store is off unless PRISM_VERDICT_DIR
+is set or the engine runs with --verdict-dir.
+
+Only one process may write a store: a second writer, including
+"verdict_store.py --compact" beside a running engine, is refused with
+StoreLocked. Readers (readonly=True) need no lock.
+"""
+import argparse
+import glob
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, a single writer is up to the operator
+    fcntl = None
+
+from metrics import METRICS
+from risk_index import parse_minutes
+
+VERDICT_DIR = os.environ.get("PRISM_VERDICT_DIR") or None
+SEGMENT_SECONDS = 3600
+RAW_RETENTION_SECONDS = 24 * 3600
+ROLLUP_SECONDS = 300
+DAY_SECONDS = 24 * 3600
+
+STYLE_CODES = {"normal": 0, "warning": 1, "critical": 2}
+STYLES = {code: style for style, code in STYLE_CODES.items()}
+
+RAW = np.dtype([
+    ("time", "<f8"), ("stream", "<u4"), ("probability", "<f4"),
+    ("style", "u1"), ("anomaly", "u1"), ("root_cause", "u1"), ("minutes", "<i4"),
+])
+ROLLUP = np.dtype([
+    ("time", "<f8"), ("stream", "<u4"), ("count", "<u4"), ("min", "<f4"), ("max", "<f4"),
+    ("sum", "<f8"), ("worst", "u1"), ("anomalies", "<u4"),
+])
+INDEX = np.dtype([("stream", "<u4"), ("offset", "<u8"), ("count", "<u8"), ("first", "<f8"), ("last", "<f8")])
+
+RECORDS = METRICS.counter("engine_verdict_records_total", "Verdicts appended to the verdict store.")
+SEGMENTS = METRICS.counter("engine_verdict_segments_total", "Verdict store segment operations (sealed, compacted).")
+
+class StoreLocked(RuntimeError):
+    """Another process is already writing the verdict store."""
+
+def history_key(packet):
+    """The stream a packet's history is kept under: its session, else its stream."""
+    return packet["session"] if packet.get("session") is not None else packet.get("stream")
+
+def _save(path, array):
+    with open(f"{path}.tmp", "wb") as f:
+        np.save(f, array)
+    os.replace(f"{path}.tmp", path)
+
+def _build_index(records):
+    """Sorts records by (stream, time) and returns them with their INDEX rows."""
+    records = records[np.lexsort((records["time"], records["stream"]))]
+    streams, offsets, counts = np.unique(records["stream"], return_index=True, return_counts=True)
+    index = np.zeros(len(streams), dtype=INDEX)
+    index["stream"], index["offset"], index["count"] = streams, offsets, counts
+    if len(records):
+        index["first"] = records["time"][offsets]
+        index["last"] = records["time"][offsets + counts - 1]
+    return records, index
+
+def _single_rollups(records):
+    """RAW records as one-verdict ROLLUP records; ROLLUP records pass through."""
+    if records.dtype != RAW:
+        return records
+    rollups = np.zeros(len(records), dtype=ROLLUP)
+    rollups["time"], rollups["stream"], rollups["count"] = records["time"], records["stream"], 1
+    rollups["min"] = rollups["max"] = rollups["sum"] = records["probability"]
+    rollups["worst"], rollups["anomalies"] = records["style"], records["anomaly"]
+    return rollups
+
+def _merge_groups(records, starts, times):
+    """One ROLLUP record per group of consecutive records beginning at `starts`."""
+    out = np.zeros(len(starts), dtype=ROLLUP)
+    out["time"], out["stream"] = times, records["stream"][starts]
+    out["count"] = np.add.reduceat(records["count"], starts)
+    out["min"] = np.minimum.reduceat(records["min"], starts)
+    out["max"] = np.maximum.reduceat(records["max"], starts)
+    out["sum"] = np.add.reduceat(records["sum"], starts)
+    out["worst"] = np.maximum.reduceat(records["worst"], starts)
+    out["anomalies"] = np.add.reduceat(records["anomalies"], starts)
+    return out
+
+def as_rollups(records, bucket_seconds):
+    """Collapses RAW or ROLLUP records into ROLLUP records per (stream, bucket)."""
+    records = _single_rollups(records)
+    if not len(records):
+        return records
+    buckets = np.floor(records["time"] / bucket_seconds) * bucket_seconds
+    order = np.lexsort((buckets, records["stream"]))
+    records, buckets = records[order], buckets[order]
+    starts = np.flatnonzero(np.r_[True, (np.diff(buckets) != 0) | (np.diff(records["stream"]) != 0)])
+    return _merge_groups(records, starts, buckets[starts])
+
+class _Segment:
+    """A sealed raw or rollup segment: memory-mapped records plus their per-stream index."""
+
+    def __init__(self, path):
+        self.path = path
+        self.kind, start = os.path.basename(path)[:-len(".npy")].split("-")
+        self.start = float(start)
+        self.records = np.load(path, mmap_mode="r")
+        index = np.load(path[:-len(".npy")] + ".idx.npy")
+        self.first = float(index["first"].min()) if len(index) else self.start
+        self.last = float(index["last"].max()) if len(index) else self.start
+        self.streams = {int(row["stream"]): (int(row["offset"]), int(row["count"])) for row in index}
+
+    def rows(self, stream):
+        span = self.streams.get(stream)
+        if span is None:
+            return self.records[:0]
+        offset, count = span
+        return np.asarray(self.records[offset:offset + count])
+
+    def remove(self):
+        os.remove(self.path)
+        os.remove(self.path[:-len(".npy")] + ".idx.npy")
+
+class VerdictStore:
+    """Segmented verdict log with per-stream indexes, downsampled range queries and compaction. Thread-safe."""
+
+    def __init__(self, directory, segment_seconds=SEGMENT_SECONDS, raw_retention=RAW_RETENTION_SECONDS,
+                 rollup_seconds=ROLLUP_SECONDS, readonly=False):
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.raw_retention = raw_retention
+        self.rollup_seconds = rollup_seconds
+        self.readonly = readonly
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._writer_lock = None if readonly else self._lock_writer()
+        self._streams, self._stream_ids = self._load_streams()
+        self._labels = self._load_labels()
+        self._segments = [_Segment(path) for path in sorted(glob.glob(os.path.join(directory, "*-*[0-9].npy")))]
+        self._active_start = None
+        self._active_file = None
+        self._active = []
+        for path in sorted(glob.glob(os.path.join(directory, "raw-*.log"))):
+            # A log left by a previous run (or, read-only, by the running writer).
+            try:
+                records = self._read_log(path)
+            except FileNotFoundError:
+                continue  # sealed by the writer meanwhile
+            if readonly:
+                self._active.append(records)
+            else:
+                self._seal(path, records)
+
+    def _lock_writer(self):
+        lock_file = open(os.path.join(self.directory, "writer.lock"), "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                raise StoreLocked(f"{self.directory} is being written by another process") from None
+        return lock_file
+
+    def _load_streams(self):
+        streams = []
+        path = os.path.join(self.directory, "streams.jsonl")
+        if os.path.exists(path):
+            with open(path) as f:
+                streams = [tuple(json.loads(line)) for line in f if line.strip()]
+        return streams, {stream: k for k, stream in enumerate(streams)}
+
+    def _load_labels(self):
+        path = os.path.join(self.directory, "labels.json")
+        if not os.path.exists(path):
+            return ["None"]
+        with open(path) as f:
+            return json.load(f)
+
+    def _read_log(self, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        # A crash can leave a partial record at the end.
+        return np.frombuffer(data[:len(data) - len(data) % RAW.itemsize], dtype=RAW).copy()
+
+    def _stream_id(self, device, key):
+        stream = (device, key)
+        stream_id = self._stream_ids.get(stream)
+        if stream_id is None:
+            stream_id = self._stream_ids[stream] = len(self._streams)
+            self._streams.append(stream)
+            with open(os.path.join(self.directory, "streams.jsonl"), "a") as f:
+                f.write(json.dumps([device, key]) + "\n")
+        return stream_id
+
+    def _label(self, root_cause):
+        if root_cause not in self._labels:
+            self._labels.append(root_cause)
+            path = os.path.join(self.directory, "labels.json")
+            with open(f"{path}.tmp", "w") as f:
+                json.dump(self._labels, f)
+            os.replace(f"{path}.tmp", path)
+        return self._labels.index(root_cause)
+
+    def append(self, device, packets, keys=None, now=None):
+        """Records packets (engine output) of one device; keys default to history_key(packet)."""
+        now = time.time() if now is None else now
+        records = np.zeros(len(packets), dtype=RAW)
+        with self._lock:
+            for k, packet in enumerate(packets):
+                key = history_key(packet) if keys is None else keys[k]
+                minutes = parse_minutes(packet.get("first_anomaly_time"))
+                records[k] = (
+                    now, self._stream_id(device, key), packet["predictive_probability"],
+                    STYLE_CODES.get(packet["current_health_style"], 0), packet["is_anomaly_predicted"],
+                    self._label(packet.get("root_cause") or "None"),
+                    -1 if minutes is None else minutes,
+                )
+            if self._active_start is not None and now - self._active_start >= self.segment_seconds:
+                self._roll(now)
+            if self._active_file is None:
+                self._active_start = now
+                self._active_file = open(os.path.join(self.directory, f"raw-{now:.3f}.log"), "ab")
+            self._active_file.write(records.tobytes())
+            self._active_file.flush()
+            self._active.append(records)
+        RECORDS.inc(len(records))
+
+    def _roll(self, now):
+        path = self._active_file.name
+        self._active_file.close()
+        self._active_file, self._active_start = None, None
+        records = np.concatenate(self._active) if self._active else np.zeros(0, dtype=RAW)
+        self._active = []
+        self._seal(path, records)
+        self._compact(now)
+
+    def _seal(self, log_path, records):
+        """Rewrites a raw log as a sorted, indexed segment."""
+        path = log_path[:-len(".log")] + ".npy"
+        records, index = _build_index(records)
+        _save(path[:-len(".npy")] + ".idx.npy", index)
+        _save(path, records)
+        try:
+            os.remove(log_path)
+        except FileNotFoundError:
+            pass
+        self._segments.append(_Segment(path))
+        SEGMENTS.inc(operation="sealed")
+
+    def _compact(self, now):
+        old = [segment for segment in self._segments if segment.kind == "raw" and segment.last < now - self.raw_retention]
+        by_day = {}
+        for segment in old:
+            by_day.setdefault(int(segment.start // DAY_SECONDS) * DAY_SECONDS, []).append(segment)
+        for day, segments in by_day.items():
+            existing = [segment for segment in self._segments if segment.kind == "rollup" and segment.start == day]
+            rollups = as_rollups(np.concatenate([
+                as_rollups(np.asarray(segment.records), self.rollup_seconds) for segment in segments + existing
+            ]), self.rollup_seconds)
+            path = os.path.join(self.directory, f"rollup-{day}.npy")
+            rollups, index = _build_index(rollups)
+            _save(path[:-len(".npy")] + ".idx.npy", index)
+            _save(path, rollups)
+            for segment in segments:
+                segment.remove()
+            self._segments = [segment for segment in self._segments if segment not in segments and segment not in existing]
+            self._segments.append(_Segment(path))
+            SEGMENTS.inc(len(segments), operation="compacted")
+
+    def compact(self, now=None):
+        """Seals the active segment and compacts every raw segment older than raw_retention."""
+        now = time.time() if now is None else now
+        with self._lock:
+            if self._active_file is not None:
+                self._roll(now)
+            else:
+                self._compact(now)
+
+    def streams(self, device=None):
+        """Known stream keys, optionally of one device."""
+        with self._lock:
+            return [key for stream_device, key in self._streams if device is None or stream_device == device]
+
+    def query(self, device, key, start=None, end=None, buckets=None):
+        """
+        The stream's verdicts in [start, end] (epoch seconds); compacted buckets that
+        overlap the range are included whole. Without buckets every
+        stored record becomes a point (compacted days are already per-rollup_seconds);
+        with buckets the range is split into that many equal buckets. Each point has
+        time, count, min/max/mean predictive_probability, the worst health style and
+        the number of anomalous verdicts.
+        """
+        with self._lock:
+            stream = self._stream_ids.get((device, key))
+            if stream is None:
+                return []
+            start = -np.inf if start is None else start
+            end = np.inf if end is None else end
+            # Rollups are stamped with their bucket's start.
+            rollup_start = np.floor(start / self.rollup_seconds) * self.rollup_seconds
+            parts = []
+            for segment in self._segments:
+                lower = rollup_start if segment.kind == "rollup" else start
+                if segment.last >= lower and segment.first <= end:
+                    rows = segment.rows(stream)
+                    parts.append(rows[(rows["time"] >= lower) & (rows["time"] <= end)])
+            parts += [records[(records["stream"] == stream) & (records["time"] >= start) & (records["time"] <= end)]
+                      for records in self._active]
+        parts = [_single_rollups(part) for part in parts]
+        records = np.concatenate(parts) if parts else np.zeros(0, dtype=ROLLUP)
+        records = records[np.argsort(records["time"], kind="stable")]
+        if buckets and len(records):
+            lo = records["time"][0] if np.isinf(start) else start
+            hi = records["time"][-1] if np.isinf(end) else end
+            width = max((hi - lo) / buckets, 1e-9)
+            bucket_ids = np.clip(((records["time"] - lo) // width).astype(np.int64), 0, buckets - 1)
+            starts = np.flatnonzero(np.r_[True, np.diff(bucket_ids) != 0])
+            records = _merge_groups(records, starts, lo + bucket_ids[starts] * width)
+        return [
+            {
+                "time": float(row["time"]), "count": int(row["count"]), "min": float(row["min"]),
+                "max": float(row["max"]), "mean": float(row["sum"] / row["count"]),
+                "worst_style": STYLES[int(row["worst"])], "anomalies": int(row["anomalies"]),
+            }
+            for row in records
+        ]
+
+    def close(self):
+        with self._lock:
+            if self._active_file is not None:
+                self._active_file.close()
+                self._active_file = None
+            if self._writer_lock is not None:
+                self._writer_lock.close()
+                self._writer_lock = None
+
+_default_store = None
+_configured = False
+
+def get_verdict_store(**options):
+    """
+    Process-wide store in PRISM_VERDICT_DIR (or options["directory"]), or None when
+    no directory is configured. Options only take effect on the first call.
+    """
+    global _default_store, _configured
+    if not _configured:
+        _configured = True
+        directory = options.pop("directory", None) or VERDICT_DIR
+        if directory:
+            _default_store = VerdictStore(directory, **options)
+    return _default_store
+
+def close_verdict_store():
+    if _default_store is not None:
+        _default_store.close()
+
+def _parse_since(text):
+    units = {"s": 1, "m": 60, "h": 3600, "d": DAY_SECONDS}
+    return float(text[:-1]) * units[text[-1]] if text[-1] in units else float(text)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query or compact a verdict store.")
+    parser.add_argument("directory")
+    parser.add_argument("device", nargs="?", help="device type (omit to list streams)")
+    parser.add_argument("key", nargs="?", help="session / resume id, fleet stream or device id")
+    parser.add_argument("--since", default="1d", help="how far back to read, e.g. 30d, 6h, 90m")
+    parser.add_argument("--buckets", type=int, default=200, help="points to downsample to (0 for every stored record)")
+    parser.add_argument("--compact", action="store_true", help="seal and compact old segments instead of querying")
+    args = parser.parse_args()
+
+    try:
+        store = VerdictStore(args.directory, readonly=not args.compact)
+    except StoreLocked as e:
+        # The running engine owns the active log and compacts on its own when it rolls a segment.
+        raise SystemExit(f"Not compacting: {e}.")
+    if args.compact:
+        store.compact()
+        store.close()
+    elif args.device is None or args.key is None:
+        print(json.dumps({"streams": store.streams(args.device)}))
+    else:
+        # Keys arrive as text; fleet streams are stored as numbers.
+        key = int(args.key) if args.key.isdigit() and args.key not in store.streams(args.device) else args.key
+        points = store.query(args.device, key, start=time.time() - _parse_since(args.since), buckets=args.buckets or None)
+        print(json.dumps({"device": args.device, "key": key, "points": points}))
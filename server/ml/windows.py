@@ -0,0 +1,145 @@
+# server/ml/windows.py
+import numpy as np
+from sklearn.preprocessing import MinMaxScaler, StandardScaler
+
+def row_scaler(scaler):
+    """Returns a function that scales rows (1-D or stacked along leading axes) like scaler.transform."""
+    if isinstance(scaler, StandardScaler):
+        mean = scaler.mean_ if scaler.with_mean else 0.0
+        scale = scaler.scale_ if scaler.with_std else 1.0
+        return lambda row: (row - mean) / scale
+    if isinstance(scaler, MinMaxScaler) and not scaler.clip:
+        scale, offset = scaler.scale_, scaler.min_
+        return lambda row: row * scale + offset
+    if scaler is None:
+        return lambda row: row
+    # Unknown scaler types still go through sklearn.
+    return lambda row: scaler.transform(row.reshape(-1, row.shape[-1])).reshape(row.shape)
+
+def row_unscaler(scaler):
+    """The inverse of row_scaler(scaler): maps scaled rows back to raw values."""
+    if isinstance(scaler, StandardScaler):
+        mean = scaler.mean_ if scaler.with_mean else 0.0
+        scale = scaler.scale_ if scaler.with_std else 1.0
+        return lambda row: row * scale + mean
+    if isinstance(scaler, MinMaxScaler) and not scaler.clip:
+        scale, offset = scaler.scale_, scaler.min_
+        return lambda row: (row - offset) / scale
+    if scaler is None:
+        return lambda row: row
+    return lambda row: scaler.inverse_transform(row.reshape(-1, row.shape[-1])).reshape(row.shape)
+
+def _rescaled(data, old_scaler, new_scaler):
+    return row_scaler(new_scaler)(row_unscaler(old_scaler)(data.astype(np.float64)))
+
+class RingWindow:
+    """
+    Fixed-length sliding window of scaled rows backed by one preallocated array.
+
+    Every row is written twice (at head and head + seq_len), so the last seq_len
+    rows are always a contiguous slice and the model inputs are views, not copies.
+    """
+
+    def __init__(self, seq_len, n_features, scaler=None, dtype=np.float32):
+        self.seq_len = seq_len
+        self.n_features = n_features
+        self._scale = row_scaler(scaler)
+        self._data = np.zeros((2 * seq_len, n_features), dtype=dtype)
+        self._head = 0
+        self.count = 0
+
+    @property
+    def full(self):
+        return self.count >= self.seq_len
+
+    def push(self, row):
+        """Scales one raw row and appends it, dropping the oldest row once full."""
+        scaled = self._scale(np.asarray(row, dtype=np.float64))
+        self._data[self._head] = scaled
+        self._data[self._head + self.seq_len] = scaled
+        self._head = (self._head + 1) % self.seq_len
+        self.count += 1
+
+    def rows(self):
+        """The window's rows in arrival order, shape (seq_len, n_features)."""
+        return self._data[self._head:self._head + self.seq_len]
+
+    def sequence(self):
+        """The window as a (1, seq_len, n_features) model input."""
+        return self.rows()[np.newaxis]
+
+    def flat(self):
+        """The window flattened to a (1, seq_len * n_features) model input."""
+        return self.rows().reshape(1, -1)
+
+    def reset(self):
+        self._head = 0
+        self.count = 0
+
+    def rescale(self, old_scaler, new_scaler):
+        """Switches to new_scaler, re-expressing the rows already in the window in its units."""
+        if new_scaler is not old_scaler:
+            self._data[:] = _rescaled(self._data, old_scaler, new_scaler)
+        self._scale = row_scaler(new_scaler)
+
+    def state(self):
+        """(rows in arrival order, count): everything needed to rebuild the window."""
+        return self.rows().copy(), self.count
+
+    def load_state(self, rows, count):
+        """Restores a window saved with state(); rows are already scaled."""
+        self._data[:self.seq_len] = rows
+        self._data[self.seq_len:] = rows
+        self._head = 0
+        self.count = int(count)
+
+class BatchRingWindow:
+    """
+    RingWindow for n_streams streams advancing in lockstep: one push appends a row
+    to every stream, and the batched model inputs are views over a single array.
+    """
+
+    def __init__(self, n_streams, seq_len, n_features, scaler=None, dtype=np.float32):
+        self.n_streams = n_streams
+        self.seq_len = seq_len
+        self.n_features = n_features
+        self._scale = row_scaler(scaler)
+        self._data = np.zeros((n_streams, 2 * seq_len, n_features), dtype=dtype)
+        self._head = 0
+        self.count = 0
+
+    @property
+    def full(self):
+        return self.count >= self.seq_len
+
+    def push(self, rows):
+        """Scales an (n_streams, n_features) block of raw rows and appends one row per stream."""
+        scaled = self._scale(np.asarray(rows, dtype=np.float64))
+        self._data[:, self._head] = scaled
+        self._data[:, self._head + self.seq_len] = scaled
+        self._head = (self._head + 1) % self.seq_len
+        self.count += 1
+
+    def sequences(self):
+        """All windows as an (n_streams, seq_len, n_features) model input."""
+        return self._data[:, self._head:self._head + self.seq_len]
+
+    def flat(self):
+        """All windows flattened to an (n_streams, seq_len * n_features) model input."""
+        return self.sequences().reshape(self.n_streams, -1)
+
+    def rescale(self, old_scaler, new_scaler):
+        """Switches to new_scaler, re-expressing the rows already in the windows in its units."""
+        if new_scaler is not old_scaler:
+            self._data[:] = _rescaled(self._data, old_scaler, new_scaler)
+        self._scale = row_scaler(new_scaler)
+
+def sliding_windows(matrix, seq_len):
+    """
+    Zero-copy view of every seq_len-row window of a C-contiguous (n_rows, n_features)
+    matrix, shaped (n_rows - seq_len + 1, seq_len, n_features).
+    """
+    n_features = matrix.shape[1]
+    flat = np.ascontiguousarray(matrix).reshape(-1)
+    windows = np.lib.stride_tricks.sliding_window_view(flat, seq_len * n_features)[::n_features]
+    return windows.reshape(-1, seq_len, n_features)
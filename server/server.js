@@ -1,112 +1,180 @@
-const express = require('express');
-const http = require('http');
-const WebSocket = require('ws');
-const { spawn } = require('child_process');
-const path = require('path');
-const cors = require('cors');
-const connectDB = require('./config/db');
-const { addSimulationData } = require('./routes/reports');
-
-connectDB();
-
-const app = express();
-const server = http.createServer(app);
-const wss = new WebSocket.Server({ server });
-
-app.use(cors());
-app.use(express.json());
-
-app.use('/api/users', require('./routes/users'));
-app.use('/api/diagnose', require('./routes/diagnose'));
-app.use('/api/reports', require('./routes/reports').router);
-
-wss.on('connection', (ws) => {
-    console.log('Client connected to WebSocket');
-    let pythonProcess = null;
-
-    const safeKill = () => {
-        if (pythonProcess && !pythonProcess.killed) {
-            console.log('🔴 Killing Python process...');
-            pythonProcess.kill();
-            pythonProcess = null;
-        }
-    };
-
-    ws.on('message', (message) => {
-        const data = JSON.parse(message);
-
-        if (data.type === 'start' && data.device && data.sessionId) {
-            safeKill();
-            console.log(`Starting simulation for device: ${data.device}`);
-
-            const pythonPath = path.resolve(
-                __dirname, '..', '.venv',
-                process.platform === 'win32' ? 'Scripts' : 'bin',
-                process.platform === 'win32' ? 'python.exe' : 'python'
-            );
-
-            const scriptPath = path.resolve(__dirname, 'ml', 'simulation_engine.py');
-            pythonProcess = spawn(pythonPath, ['-u', scriptPath, data.device]);
-
-            pythonProcess.stdout.on('data', (chunk) => {
-                if (ws.readyState === WebSocket.OPEN) {
-                    ws.send(chunk.toString());
-                }
-            });
-
-            // --- THIS BLOCK IS THE FIX ---
-            // It now intelligently checks for real errors vs. warnings.
-            pythonProcess.stderr.on('data', (chunk) => {
-                const errorMsg = chunk.toString();
-                // Always log any stderr message to the server console for debugging
-                console.error(`[Python stderr]: ${errorMsg}`);
-
-                // ONLY send a message to the frontend if it's a REAL error.
-                // Harmless warnings (like from TensorFlow) will be ignored.
-                if (errorMsg.includes('Traceback') || errorMsg.toLowerCase().includes('error')) {
-                    if (ws.readyState === WebSocket.OPEN) {
-                        ws.send(JSON.stringify({ error: errorMsg }));
-                    }
-                }
-            });
-
-            pythonProcess.on('close', (code) => {
-                console.log(`Python process exited with code ${code}`);
-                pythonProcess = null;
-            });
-        }
-        
-        if (data.type === 'trigger' && data.event) {
-            // Your trigger logic is fine and needs no changes
-            const { sessionId, device, event } = data;
-            const reportData = {
-                timestamp: new Date().toLocaleTimeString(),
-                trigger: event,
-                final_status_text: "Critical",
-                final_status_style: "critical",
-                probability: 0.95,
-                is_anomaly_predicted: true,
-                first_anomaly_time: "+1 min",
-                verdict_text: `🚨 Manual Trigger Activated: ${event}`,
-                root_cause: event === 'critical_cpu' ? 'CPU Overload' : 'Battery Failure',
-                forecast: [{"Time": "+1 min", "Predicted Metric": event === 'critical_cpu' ? 'CPU Temp > 95°C' : 'Voltage Drop'}],
-            };
-            const reportId = addSimulationData(sessionId, device, 'predictive', reportData);
-            if (ws.readyState === WebSocket.OPEN) {
-                ws.send(JSON.stringify({ reportId, ...reportData }));
-            }
-        }
-
-        if (data.type === 'stop') {
-            safeKill();
-        }
-    });
-
-    ws.on('close', () => {
-        console.log('Client disconnected');
-        safeKill();
-    });
-});
-
-const PORT = process.env.PORT || 5001;
+const express = require('express');
+const http = require('http');
+const WebSocket = require('ws');
+const { spawn } = require('child_process');
+const path = require('path');
+const crypto = require('crypto');
+const cors = require('cors');
+const connectDB = require('./config/db');
+const { addSimulationData } = require('./routes/reports');
+
+connectDB();
+
+const app = express();
+const server = http.createServer(app);
+const wss = new WebSocket.Server({ server });
+
+app.use(cors());
+app.use(express.json());
+
+app.use('/api/users', require('./routes/users'));
+app.use('/api/diagnose', require('./routes/diagnose'));
+app.use('/api/reports', require('./routes/reports').router);
+
+// --- Shared simulation daemon ---
+// A single long-lived Python process keeps every device's models in memory and
+// multiplexes all WebSocket sessions; packets are routed back by their "session" id.
+// The engine writes length-prefixed JSON frames (4-byte big-endian length + payload)
+// and keeps only the newest packet per session when this process falls behind.
+const engineSessions = new Map();
+let engineProcess = null;
+let engineStdoutBuffer = Buffer.alloc(0);
+
+// A client whose socket has this much unsent data skips packets until it catches up.
+const MAX_CLIENT_BUFFER_BYTES = 1 << 20;
+
+const routeEnginePacket = (frame) => {
+    let packet;
+    try {
+        packet = JSON.parse(frame);
+    } catch (err) {
+        console.error(`[Python stdout] Unparseable frame: ${frame}`);
+        return;
+    }
+    const { session, ...payload } = packet;
+    const ws = engineSessions.get(session);
+    if (ws && ws.readyState === WebSocket.OPEN && ws.bufferedAmount < MAX_CLIENT_BUFFER_BYTES) {
+        ws.send(JSON.stringify(payload));
+    }
+};
+
+const getEngine = () => {
+    if (engineProcess) return engineProcess;
+
+    const pythonPath = path.resolve(
+        __dirname, '..', '.venv',
+        process.platform === 'win32' ? 'Scripts' : 'bin',
+        process.platform === 'win32' ? 'python.exe' : 'python'
+    );
+    const scriptPath = path.resolve(__dirname, 'ml', 'simulation_engine.py');
+    engineProcess = spawn(pythonPath, [
+        '-u', scriptPath, '--daemon', '--framing', 'length', '--output-policy', 'latest'
+    ]);
+    engineStdoutBuffer = Buffer.alloc(0);
+
+    engineProcess.stdout.on('data', (chunk) => {
+        engineStdoutBuffer = Buffer.concat([engineStdoutBuffer, chunk]);
+        let offset = 0;
+        while (engineStdoutBuffer.length - offset >= 4) {
+            const length = engineStdoutBuffer.readUInt32BE(offset);
+            if (engineStdoutBuffer.length - offset - 4 < length) break;
+            routeEnginePacket(engineStdoutBuffer.toString('utf8', offset + 4, offset + 4 + length));
+            offset += 4 + length;
+        }
+        engineStdoutBuffer = engineStdoutBuffer.subarray(offset);
+    });
+
+    // The daemon's stderr is shared by every session, so it is only logged here;
+    // per-session errors arrive on stdout as {"session", "error"} packets.
+    engineProcess.stderr.on('data', (chunk) => {
+        console.error(`[Python stderr]: ${chunk.toString()}`);
+    });
+
+    // A failed spawn (e.g. no .venv python) and a write to a daemon that already died
+    // (EPIPE) surface as 'error' events; unhandled, they would take down this server.
+    const child = engineProcess;
+    child.on('error', (err) => {
+        console.error(`Simulation daemon error: ${err.message}`);
+        engineStopped(child);
+    });
+    child.stdin.on('error', (err) => {
+        console.error(`Simulation daemon stdin error: ${err.message}`);
+        engineStopped(child);
+        child.kill();
+    });
+    child.on('close', (code) => {
+        console.log(`Simulation daemon exited with code ${code}`);
+        engineStopped(child);
+    });
+
+    return engineProcess;
+};
+
+// Forgets a daemon that failed or exited and tells its sessions; the next start spawns
+// a new one. Runs once per process, whichever of 'error' / 'close' comes first.
+const engineStopped = (child) => {
+    if (engineProcess !== child) return;
+    engineProcess = null;
+    for (const ws of engineSessions.values()) {
+        if (ws.readyState === WebSocket.OPEN) {
+            ws.send(JSON.stringify({ error: 'Simulation engine stopped unexpectedly.' }));
+        }
+    }
+    engineSessions.clear();
+};
+
+const sendEngineCommand = (command) => {
+    getEngine().stdin.write(JSON.stringify(command) + '\n');
+};
+
+wss.on('connection', (ws) => {
+    console.log('Client connected to WebSocket');
+    let engineSessionId = null;
+
+    const safeStop = () => {
+        if (engineSessionId) {
+            console.log(`🔴 Stopping simulation session ${engineSessionId}...`);
+            engineSessions.delete(engineSessionId);
+            if (engineProcess) sendEngineCommand({ type: 'stop', session: engineSessionId });
+            engineSessionId = null;
+        }
+    };
+
+    ws.on('message', (message) => {
+        const data = JSON.parse(message);
+
+        if (data.type === 'start' && data.device && data.sessionId) {
+            safeStop();
+            console.log(`Starting simulation for device: ${data.device}`);
+
+            engineSessionId = `${data.sessionId}-${crypto.randomUUID()}`;
+            engineSessions.set(engineSessionId, ws);
+            // The client's sessionId is stable across reconnects, so it doubles as the
+            // resume key: the engine continues that client's story with full windows.
+            sendEngineCommand({ type: 'start', session: engineSessionId, device: data.device, resume: data.sessionId });
+        }
+        
+        if (data.type === 'trigger' && data.event) {
+            // Your trigger logic is fine and needs no changes
+            const { sessionId, device, event } = data;
+            const reportData = {
+                timestamp: new Date().toLocaleTimeString(),
+                trigger: event,
+                final_status_text: "Critical",
+                final_status_style: "critical",
+                probability: 0.95,
+                is_anomaly_predicted: true,
+                first_anomaly_time: "+1 min",
+                verdict_text: `🚨 Manual Trigger Activated: ${event}`,
+                root_cause: event === 'critical_cpu' ? 'CPU Overload' : 'Battery Failure',
+                forecast: [{"Time": "+1 min", "Predicted Metric": event === 'critical_cpu' ? 'CPU Temp > 95°C' : 'Voltage Drop'}],
+            };
+            const reportId = addSimulationData(sessionId, device, 'predictive', reportData);
+            if (ws.readyState === WebSocket.OPEN) {
+                ws.send(JSON.stringify({ reportId, ...reportData }));
+            }
+        }
+
+        if (data.type === 'stop') {
+            safeStop();
+        }
+    });
+
+    ws.on('close', () => {
+        console.log('Client disconnected');
+        safeStop();
+    });
+});
+
+const PORT = process.env.PORT || 5001;
 server.listen(PORT, () => console.log(`🚀 Server running on port ${PORT}`));
\ No newline at end of file
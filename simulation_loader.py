@@ -1,65 +1,272 @@
 # simulation_loader.py
 import os
+import sys
 import json
+import hashlib
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import joblib
 import pandas as pd
-import numpy as np
-from tensorflow.keras.models import load_model
-from sklearn.preprocessing import StandardScaler
 
-BASE_DIR = os.getcwd()  # adjust if running from a different location
+# All artifact paths below are relative to this root (the bundled server/ml folder
+# by default); point PRISM_ARTIFACT_ROOT elsewhere to serve a different copy.
+BASE_DIR = os.environ.get(
+    "PRISM_ARTIFACT_ROOT",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "server", "ml")
+)
 
 DEVICE_TYPES = ["smartphone", "smartwatch", "smartfridge"]
 
-MODEL_FOLDERS = {
-    "classification": {
-        "model": os.path.join(BASE_DIR, "classification", "h5"),
-        "scaler": os.path.join(BASE_DIR, "classification", "scaler"),
-        "feature": os.path.join(BASE_DIR, "classification", "feature"),
-        "dataset": os.path.join(BASE_DIR, "classification", "dataset")
+# Single source of truth for every artifact used by the engine, the Streamlit app
+# and the CLI loop. "class_*" is the LSTM health classifier, "pred_*"/"*_model" the
+# LightGBM screener + diagnosticians, and "forecast_*" the legacy Keras forecaster.
+ARTIFACT_FILES = {
+    "smartphone": {
+        "class_dataset": "classification/dataset/smartphone_dataset.json",
+        "class_scaler": "classification/scaler/smartphone_scaler.joblib",
+        "class_features": "classification/feature/smartphone_features.joblib",
+        "class_model": "classification/h5/smartphone_classification.h5",
+        "pred_dataset": "prediction/dataset/smartphone_unified_dataset_v2.csv",
+        "pred_scaler": "prediction/scaler/smartphone_multi_task_scaler.joblib",
+        "screener_model": "prediction/models/smartphone/prediction_model_lgbm_final.joblib",
+        "why_model": "prediction/models/smartphone/diagnostician_why_model.joblib",
+        "when_model": "prediction/models/smartphone/diagnostician_when_model.joblib",
+        "forecast_dataset": "predictive/dataset/smartphone_dataset.csv",
+        "forecast_scaler": "predictive/scaler/smartphone_scaler.joblib",
+        "forecast_model": "predictive/h5/smartphone_predictive.h5",
     },
-    "predictive": {
-        "model": os.path.join(BASE_DIR, "predictive", "h5"),
-        "scaler": os.path.join(BASE_DIR, "predictive", "scaler"),
-        "dataset": os.path.join(BASE_DIR, "predictive", "dataset")
-    }
+    "smartwatch": {
+        "class_dataset": "classification/dataset/smartwatch_dataset.json",
+        "class_scaler": "classification/scaler/smartwatch_scaler.joblib",
+        "class_features": "classification/feature/smartwatch_features.joblib",
+        "class_model": "classification/h5/smartwatch_classification.h5",
+        "pred_dataset": "prediction/dataset/smartwatch_unified_dataset.csv",
+        "pred_scaler": "prediction/scaler/smartwatch_multi_task_scaler.joblib",
+        "screener_model": "prediction/models/smartwatch/prediction_model_lgbm_if.joblib",
+        "why_model": "prediction/models/smartwatch/diagnostician_why_model.joblib",
+        "when_model": "prediction/models/smartwatch/diagnostician_when_model.joblib",
+        "forecast_dataset": "predictive/dataset/smartwatch_dataset.csv",
+        "forecast_scaler": "predictive/scaler/smartwatch_scaler.joblib",
+        "forecast_model": "predictive/h5/smartwatch_predictive.h5",
+    },
+    "smartfridge": {
+        "class_dataset": "classification/dataset/smartfridge_dataset.json",
+        "class_scaler": "classification/scaler/smartfridge_scaler.joblib",
+        "class_features": "classification/feature/smartfridge_features.joblib",
+        "class_model": "classification/h5/smartfridge_classification.h5",
+        "pred_dataset": "prediction/dataset/refrigerator_unified_dataset.csv",
+        "pred_scaler": "prediction/scaler/refrigerator_multi_task_scaler.joblib",
+        "screener_model": "prediction/models/smartfridge/refrigerator_screener_model.joblib",
+        "why_model": "prediction/models/smartfridge/refrigerator_diagnostician_why.joblib",
+        "when_model": "prediction/models/smartfridge/refrigerator_diagnostician_when.joblib",
+        "forecast_dataset": "predictive/dataset/smartfridge_dataset.csv",
+        "forecast_scaler": "predictive/scaler/smartfridge_scaler.joblib",
+        "forecast_model": "predictive/h5/smartfridge_predictive.h5",
+    },
+}
+
+# "keras" loads .h5 classifiers with TensorFlow; "numpy" runs them through the
+# TensorFlow-free forward pass in server/ml/numpy_backend.py.
+MODEL_BACKEND = os.environ.get("PRISM_CLASSIFIER_BACKEND", "keras")
+# "native" keeps the LightGBM / IsolationForest objects; "numpy" swaps them for the
+# array-backed evaluators in server/ml/tree_ensemble.py.
+TREE_BACKEND = os.environ.get("PRISM_TREE_BACKEND", "native")
+MAX_LOADED_DEVICES = int(os.environ.get("PRISM_MAX_LOADED_DEVICES", len(DEVICE_TYPES)))
+IDLE_EVICT_SECONDS = float(os.environ.get("PRISM_IDLE_EVICT_SECONDS", 0)) or None
+
+def _load_keras(path):
+    # Imported lazily so processes that never touch a Keras model skip TensorFlow.
+    from tensorflow.keras.models import load_model
+    return load_model(path)
+
+def _add_ml_path():
+    ml_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server", "ml")
+    if ml_dir not in sys.path:
+        sys.path.append(ml_dir)
+
+def _load_numpy(path):
+    _add_ml_path()
+    from numpy_backend import load_numpy_model
+    return load_numpy_model(path)
+
+MODEL_LOADERS = {"keras": _load_keras, "numpy": _load_numpy}
+
+def _load_joblib(path):
+    # mmap_mode lets large numpy arrays inside the pickle (tree tables, scaler
+    # statistics) be paged in from disk and shared between processes.
+    return joblib.load(path, mmap_mode="r")
+
+def _load_joblib_trees(path):
+    obj = _load_joblib(path)
+    _add_ml_path()
+    from tree_ensemble import is_supported, load_compiled
+    return load_compiled(path, obj) if is_supported(obj) else obj
+
+TREE_LOADERS = {"native": _load_joblib, "numpy": _load_joblib_trees}
+
+def _load_json(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+LOADERS = {
+    ".h5": _load_keras,
+    ".joblib": _load_joblib,
+    ".json": _load_json,
+    ".csv": pd.read_csv,
 }
 
+class ArtifactRegistry:
+    """
+    Resolves and loads artifacts per device.
+
+    Artifacts are loaded lazily on first use, independent artifacts of one request
+    are loaded concurrently in a thread pool, and loaded devices live in an LRU
+    cache bounded by max_devices (and optionally evicted after idle_seconds
+    without use), so a process serving one device type only holds that device's
+    models.
+    """
+
+    def __init__(self, root=None, files=None, max_devices=MAX_LOADED_DEVICES,
+                 idle_seconds=IDLE_EVICT_SECONDS, max_workers=4, loaders=None,
+                 model_backend=None, tree_backend=None):
+        self.root = root or BASE_DIR
+        self.files = files or ARTIFACT_FILES
+        self.max_devices = max_devices
+        self.idle_seconds = idle_seconds
+        self.model_backend = model_backend or MODEL_BACKEND
+        self.tree_backend = tree_backend or TREE_BACKEND
+        if self.model_backend not in MODEL_LOADERS:
+            raise ValueError(f"Unknown model backend: {self.model_backend}")
+        if self.tree_backend not in TREE_LOADERS:
+            raise ValueError(f"Unknown tree backend: {self.tree_backend}")
+        self.loaders = dict(
+            LOADERS, **{".h5": MODEL_LOADERS[self.model_backend], ".joblib": TREE_LOADERS[self.tree_backend]},
+            **(loaders or {})
+        )
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="artifact-loader")
+        self._lock = threading.Lock()
+        self._devices = OrderedDict()  # device -> {key: Future}
+        self._last_used = {}
+
+    def path(self, device, key):
+        """Absolute path of one artifact."""
+        if device not in self.files:
+            raise KeyError(f"Unknown device: {device}")
+        return os.path.join(self.root, self.files[device][key])
+
+    def _load_file(self, path):
+        loader = self.loaders.get(os.path.splitext(path)[1])
+        if loader is None:
+            raise ValueError(f"No loader registered for {path}")
+        return loader(path)
+
+    def _futures(self, device, keys):
+        """Returns a future per key, submitting loads for anything not cached yet."""
+        with self._lock:
+            cached = self._devices.get(device)
+            if cached is None:
+                cached = self._devices[device] = {}
+            self._devices.move_to_end(device)
+            self._last_used[device] = time.monotonic()
+
+            futures = {}
+            for key in keys:
+                future = cached.get(key)
+                if future is None or (future.done() and future.exception() is not None):
+                    future = cached[key] = self._executor.submit(self._load_file, self.path(device, key))
+                futures[key] = future
+
+            while len(self._devices) > self.max_devices:
+                evicted, _ = self._devices.popitem(last=False)
+                self._last_used.pop(evicted, None)
+        self.evict_idle()
+        return futures
+
+    def load(self, device, keys):
+        """Loads several artifacts of one device concurrently and returns {key: artifact}."""
+        futures = self._futures(device, keys)
+        return {key: future.result() for key, future in futures.items()}
+
+    def get(self, device, key):
+        """Loads (or returns the cached) single artifact."""
+        return self.load(device, [key])[key]
+
+    def version(self, device, keys=None):
+        """
+        Short fingerprint of the given artifact files (default: all of the device's)
+        and the model backends; changes whenever one of the files is replaced.
+        Models, scalers and feature lists are hashed by content, so a replacement
+        that kept the original's size and mtime (cp -p, rsync -a) still changes the
+        version; datasets, which can be large, by resolved path, size and mtime.
+        """
+        digest = hashlib.sha1(f"{self.model_backend}:{self.tree_backend}".encode())
+        for key in sorted(keys or self.files[device]):
+            path = os.path.realpath(self.path(device, key))
+            try:
+                if key.endswith("_dataset"):
+                    stat = os.stat(path)
+                    digest.update(f"{key}:{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+                else:
+                    digest.update(f"{key}:".encode())
+                    with open(path, "rb") as f:
+                        for block in iter(lambda: f.read(1 << 20), b""):
+                            digest.update(block)
+            except OSError:
+                digest.update(f"{key}:missing".encode())
+        return digest.hexdigest()[:16]
+
+    def loaded_devices(self):
+        with self._lock:
+            return list(self._devices)
+
+    def evict(self, device):
+        """Drops every cached artifact of a device."""
+        with self._lock:
+            self._devices.pop(device, None)
+            self._last_used.pop(device, None)
+
+    def evict_idle(self):
+        """Drops devices that have not been used for idle_seconds."""
+        if not self.idle_seconds:
+            return
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            for device in [d for d, used in self._last_used.items() if used < cutoff]:
+                self._devices.pop(device, None)
+                self._last_used.pop(device, None)
+
+    def clear(self):
+        with self._lock:
+            self._devices.clear()
+            self._last_used.clear()
+
+    def close(self):
+        """Stops the loader threads; artifacts already loaded stay usable."""
+        self._executor.shutdown(wait=False)
+
+_default_registry = None
+
+def get_registry(**options):
+    """
+    Process-wide registry shared by every loader in this process. Options (see
+    ArtifactRegistry) only take effect on the first call, which creates it.
+    """
+    global _default_registry
+    if _default_registry is None:
+        _default_registry = ArtifactRegistry(**options)
+    return _default_registry
+
 def load_classification_components(device_type):
     """Load classification model, scaler, features, and dataset for a device."""
-    paths = MODEL_FOLDERS["classification"]
-    
-    model_path = os.path.join(paths["model"], f"{device_type}_classification.h5")
-    scaler_path = os.path.join(paths["scaler"], f"{device_type}_scaler.joblib")
-    feature_path = os.path.join(paths["feature"], f"{device_type}_features.joblib")
-    dataset_path = os.path.join(paths["dataset"], f"{device_type}_dataset.json")
-    
-    # Load model, scaler, features
-    model = load_model(model_path)
-    scaler = joblib.load(scaler_path)
-    features = joblib.load(feature_path)
-    
-    # Load dataset
-    with open(dataset_path, "r") as f:
-        dataset = json.load(f)
-    
-    return model, scaler, features, dataset
+    artifacts = get_registry().load(device_type, ["class_model", "class_scaler", "class_features", "class_dataset"])
+    return artifacts["class_model"], artifacts["class_scaler"], artifacts["class_features"], artifacts["class_dataset"]
 
 def load_predictive_components(device_type):
     """Load predictive model, scaler, and dataset for a device."""
-    paths = MODEL_FOLDERS["predictive"]
-    
-    model_path = os.path.join(paths["model"], f"{device_type}_predictive.h5")
-    scaler_path = os.path.join(paths["scaler"], f"{device_type}_scaler.joblib")
-    dataset_path = os.path.join(paths["dataset"], f"{device_type}_dataset.csv")
-    
-    model = load_model(model_path)
-    scaler = joblib.load(scaler_path)
-    
-    # CSV dataset
-    dataset = pd.read_csv(dataset_path)
-    
-    return model, scaler, dataset
+    artifacts = get_registry().load(device_type, ["forecast_model", "forecast_scaler", "forecast_dataset"])
+    return artifacts["forecast_model"], artifacts["forecast_scaler"], artifacts["forecast_dataset"]
 
 if __name__ == "__main__":
     # Quick test
@@ -1,8 +1,8 @@
-import time
 import numpy as np
 import pandas as pd
-import joblib
-from tensorflow.keras.models import load_model
+from simulation_loader import DEVICE_TYPES, get_registry
+from forecaster import Forecaster
+from scheduler import TickScheduler
 import warnings
 warnings.filterwarnings("ignore", category=UserWarning)
 
@@ -15,20 +15,6 @@ FUTURE_STEPS = 5
 # NEW: Threshold to detect a future problem. If the predicted metric goes above this, flag it.
 PREDICTIVE_ANOMALY_THRESHOLD = 14.0 
 
-# ==============================================================================
-# Device -> File Paths
-# ==============================================================================
-CLASSIFICATION_FILES = {
-    "smartphone": {"dataset": "classification/dataset/smartphone_dataset.json", "scaler": "classification/scaler/smartphone_scaler.joblib", "features": "classification/feature/smartphone_features.joblib", "model": "classification/h5/smartphone_classification.h5"},
-    "smartwatch": {"dataset": "classification/dataset/smartwatch_dataset.json", "scaler": "classification/scaler/smartwatch_scaler.joblib", "features": "classification/feature/smartwatch_features.joblib", "model": "classification/h5/smartwatch_classification.h5"},
-    "smartfridge": {"dataset": "classification/dataset/smartfridge_dataset.json", "scaler": "classification/scaler/smartfridge_scaler.joblib", "features": "classification/feature/smartfridge_features.joblib", "model": "classification/h5/smartfridge_classification.h5"}
-}
-PREDICTIVE_FILES = {
-    "smartphone": {"dataset": "predictive/dataset/smartphone_dataset.csv", "scaler": "predictive/scaler/smartphone_scaler.joblib", "model": "predictive/h5/smartphone_predictive.h5"},
-    "smartwatch": {"dataset": "predictive/dataset/smartwatch_dataset.csv", "scaler": "predictive/scaler/smartwatch_scaler.joblib", "model": "predictive/h5/smartwatch_predictive.h5"},
-    "smartfridge": {"dataset": "predictive/dataset/smartfridge_dataset.csv", "scaler": "predictive/scaler/smartfridge_scaler.joblib", "model": "predictive/h5/smartfridge_predictive.h5"}
-}
-
 # ==============================================================================
 # Helper Functions & Model Loading
 # ==============================================================================
@@ -37,26 +23,24 @@ def health_status(pred_prob):
     elif pred_prob < 0.7: return "Warning 🟠"
     else: return "Critical 🔴"
 
-# (Loading functions remain the same)
+# Artifact paths live in the shared registry (simulation_loader.ARTIFACT_FILES).
 def load_classification_artifacts(device):
-    files = CLASSIFICATION_FILES[device]
-    df = pd.read_json(files["dataset"])
+    registry = get_registry()
+    artifacts = registry.load(device, ["class_scaler", "class_features", "class_model"])
+    df = pd.read_json(registry.path(device, "class_dataset"))
     df_metrics = pd.json_normalize(df["metrics"])
     df_labels = pd.json_normalize(df["label"])
     df = pd.concat([df.drop(columns=["metrics", "label", "recordId", "modelName"]), df_metrics, df_labels], axis=1)
-    scaler = joblib.load(files["scaler"])
-    features = joblib.load(files["features"])
-    model = load_model(files["model"])
-    return df, scaler, features, model
+    return df, artifacts["class_scaler"], artifacts["class_features"], artifacts["class_model"]
 
 def load_predictive_artifacts(device):
-    files = PREDICTIVE_FILES[device]
-    df = pd.read_csv(files["dataset"])
-    scaler = joblib.load(files["scaler"])
-    model = load_model(files["model"])
+    registry = get_registry()
+    artifacts = registry.load(device, ["forecast_scaler", "forecast_model"])
+    df = pd.read_csv(registry.path(device, "forecast_dataset"))
+    scaler = artifacts["forecast_scaler"]
     df_numeric = df.select_dtypes(include=[np.number])
     df_numeric = df_numeric.iloc[:, :scaler.n_features_in_]
-    return df_numeric, scaler, model
+    return df_numeric, scaler, artifacts["forecast_model"]
 
 # ==============================================================================
 # Interactive Simulation Loop
@@ -70,9 +54,11 @@ def run_interactive_simulation(device):
     df_features_class = df_class[features_class]
     
     buffer_class = []
-    buffer_pred = df_pred.tail(SEQUENCE_LENGTH).values.tolist()
+    forecaster = Forecaster(model_pred, scaler_pred, SEQUENCE_LENGTH)
+    forecaster.set_window(df_pred.tail(SEQUENCE_LENGTH).values)
 
     print("\n✅ System Online. Starting real-time monitoring...\n" + "="*60)
+    scheduler = TickScheduler.from_env(DELAY_SECONDS).start()
     
     for idx, row_class in df_features_class.iterrows():
         x_scaled = scaler_class.transform([row_class.values])[0]
@@ -93,23 +79,10 @@ def run_interactive_simulation(device):
             # --- [STEP 2] PREDICTIVE MODEL SCANS THE FUTURE ---
             print(f"[2] Predictive Scan: Looking for future anomalies...")
             
-            temp_buffer_pred = buffer_pred.copy()
-            n_features_pred = scaler_pred.n_features_in_
-            future_predictions = []
             is_anomaly_predicted = False
+            future_predictions = forecaster.rollout(FUTURE_STEPS)
 
-            for step in range(FUTURE_STEPS):
-                seq_raw = np.array(temp_buffer_pred[-SEQUENCE_LENGTH:])
-                seq_scaled = scaler_pred.transform(seq_raw)
-                x_input_pred = seq_scaled.reshape(1, SEQUENCE_LENGTH, n_features_pred)
-                pred_scaled = model_pred.predict(x_input_pred, verbose=0)
-                
-                dummy_row = np.zeros((1, n_features_pred))
-                dummy_row[0, 0] = pred_scaled[0, 0]
-                pred_unscaled = scaler_pred.inverse_transform(dummy_row)
-                metric_pred = pred_unscaled[0, 0]
-                future_predictions.append(metric_pred)
-
+            for step, metric_pred in enumerate(future_predictions):
                 # Check if the prediction crosses our threshold
                 if metric_pred > PREDICTIVE_ANOMALY_THRESHOLD:
                     is_anomaly_predicted = True
@@ -117,11 +90,6 @@ def run_interactive_simulation(device):
                 else:
                     print(f"     - In {(step + 1) * 10} mins: Metric={metric_pred:.2f}")
 
-                next_forecast_input = seq_raw[-1, :].tolist()
-                next_forecast_input[0] = metric_pred
-                temp_buffer_pred.append(next_forecast_input)
-                if len(temp_buffer_pred) > SEQUENCE_LENGTH: temp_buffer_pred.pop(0)
-
             # --- [STEP 3] SYSTEM MAKES A FINAL VERDICT ---
             final_status = current_status
             if is_anomaly_predicted and current_status == "Normal 🟢":
@@ -133,12 +101,10 @@ def run_interactive_simulation(device):
             print(f"--> System Health Status: {final_status}")
             
             # Update main predictive buffer with new, actual data
-            new_pred_row = df_pred.iloc[idx].values.tolist()
-            buffer_pred.append(new_pred_row)
-            if len(buffer_pred) > SEQUENCE_LENGTH: buffer_pred.pop(0)
+            forecaster.push(df_pred.iloc[idx].values)
 
             print("="*60)
-            time.sleep(DELAY_SECONDS)
+            scheduler.wait()
 
     print("\n✅ Simulation complete. Reached end of dataset.")
 
@@ -147,7 +113,7 @@ def run_interactive_simulation(device):
 # ==============================================================================
 if __name__ == "__main__":
     device = input("Select device (smartphone/smartwatch/smartfridge): ").strip().lower()
-    if device not in CLASSIFICATION_FILES:
+    if device not in DEVICE_TYPES:
         print("Invalid device!")
     else:
         run_interactive_simulation(device)
\ No newline at end of file